@@ -16,11 +16,19 @@ import matplotlib.pyplot as plt
 # Agrega la ruta del directorio donde están las funciones del chatbot
 sys.path.append(os.path.abspath(os.path.join(os.getcwd(), "src")))
 from utils import *
+from deadline import CancelToken, STOP_NEW_QUESTION
 
 # Configuración de la página
 st.set_page_config(page_title="PharmAI Chatbot", page_icon="💊")
 st.title("💬 PharmAI: Asistente de Medicamentos")
 
+# Registro de modelos compartido por todas las sesiones y reejecuciones
+registry = get_chatbot_registry()
+with st.spinner("Cargando modelos..."):
+    registry.warm_up(["retrieval", "embedder", "bundle_watcher"])
+# El LLM se carga en segundo plano: mientras tanto (o con demasiadas generaciones en curso) se responde de forma extractiva
+load_in_background(registry, "engine:llama2")
+
 # Inicializar historial de conversación
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -34,18 +42,33 @@ for msg in st.session_state.messages:
 query = st.chat_input("Escribe tu pregunta sobre un medicamento...")
 
 if query:
+    # Una nueva pregunta cancela la generación anterior de la sesión si sigue en curso (al cerrar
+    # la sesión, Streamlit deja de leer el generador y la generación también se cancela)
+    if "cancel_token" in st.session_state:
+        st.session_state.cancel_token.cancel(STOP_NEW_QUESTION)
+    st.session_state.cancel_token = CancelToken()
+
     # Mostrar el mensaje del usuario
     st.session_state.messages.append({"role": "user", "content": query})
     with st.chat_message("user"):
         st.markdown(query)
 
-    # 1. Cargar modelo 
-    model, tokenizer = load_llama_model()
-
-    # 2. Generar respuesta
-    respuesta = answer_query(query, model, tokenizer)
-
-    # Mostrar y guardar la respuesta del asistente
-    st.session_state.messages.append({"role": "assistant", "content": respuesta})
+    # 1. Generar y mostrar la respuesta en streaming (los modelos se cargan una sola vez por proceso)
     with st.chat_message("assistant"):
-        st.markdown(respuesta)
\ No newline at end of file
+        stats = {}
+        respuesta = st.write_stream(answer_query_stream(
+            query, "llama2", registry=registry, stats=stats, batching=True, mode="auto",
+            cancel_token=st.session_state.cancel_token,
+        ))
+        ruta = " · Sin búsqueda vectorial" if stats.get("retrieval", {}).get("path") == "intent" else ""
+        if stats.get("truncated"):
+            ruta += " · Respuesta interrumpida"
+        if stats.get("answer_mode") == "extractive":
+            st.caption(f"Respuesta extractiva (sin LLM) · Total: {stats['total_s'] * 1000:.0f} ms{ruta}")
+        elif stats.get("cache"):
+            st.caption(f"Respuesta desde caché ({stats['cache']}) · Total: {stats['total_s']:.2f} s{ruta}")
+        elif stats.get("ttft_s") is not None:
+            st.caption(f"Primer token: {stats['ttft_s']:.2f} s · Total: {stats['total_s']:.2f} s{ruta}")
+
+    # Guardar la respuesta del asistente
+    st.session_state.messages.append({"role": "assistant", "content": respuesta})
\ No newline at end of file
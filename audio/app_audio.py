@@ -9,7 +9,9 @@ import streamlit as st
 # Agrega la ruta del directorio donde están las funciones de audio y chatbot
 sys.path.append(os.path.abspath(os.path.join(os.getcwd(), "src")))
 from audio.utils_audio import load_whisper_model, preprocess_audio_file, transcribe_audio_file, load_tts_model, obtain_audio_response
-from utils import load_llama_model, load_gpt2_model, answer_query
+from utils import load_llama_model, load_gpt2_model, answer_query_stream, get_chatbot_registry
+from telemetry import get_telemetry
+from deadline import CancelToken, STOP_NEW_QUESTION
 
 # Configuración de logging
 enable_dir = "logs"
@@ -20,10 +22,31 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)s %(message)s"
 )
 
+# Spans de latencia por etapa: líneas JSON en el mismo log y métricas en formato Prometheus
+# (en fichero y, si se define PHARMAI_METRICS_PORT, en http://localhost:<puerto>/metrics)
+telemetry = get_telemetry()
+telemetry.configure(
+    log_path=os.path.join(enable_dir, "app_audio.log"),
+    metrics_path=os.path.join(enable_dir, "metrics.prom"),
+    port=int(os.environ["PHARMAI_METRICS_PORT"]) if os.environ.get("PHARMAI_METRICS_PORT") else None,
+)
+
 # Configuración de la página
 st.set_page_config(page_title="PharmAI Chatbot Audio", page_icon="💊")
 st.title("💊 PharmAI: Asistente de Medicamentos")
 
+# Modelo a usar en el chatbot: "cascade" (respuesta extractiva, GPT-2 o Llama-2 según la confianza,
+# ver src/cascade.py), "llama2" o "gpt2"
+model_name = os.environ.get("PHARMAI_CHAT_MODEL", "cascade")
+llm_resources = {"cascade": ["prefix:gpt2", "engine:llama2"]}.get(model_name, [f"engine:{model_name}"])
+
+# Registro de modelos compartido por todas las sesiones y reejecuciones de Streamlit
+registry = get_chatbot_registry()
+registry.register("whisper", lambda: load_whisper_model("medium"))
+registry.register("tts", lambda: load_tts_model(cache=False))
+with st.spinner("Cargando modelos..."):
+    registry.warm_up(["retrieval", "embedder", "bundle_watcher", *llm_resources, "whisper", "tts"])
+
 # Inicializar historial de chat
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -45,17 +68,21 @@ query = None
 if audio_value:
     try:
         # Guardar bytes en archivo WAV
-        os.makedirs("./audio", exist_ok=True)
-        output_path = os.path.join("./audio", "recorded.wav")
-        data = audio_value if isinstance(audio_value, (bytes, bytearray)) else audio_value.read()
-        with open(output_path, "wb") as f:
-            f.write(data)
+        with telemetry.span("audio_save") as span:
+            os.makedirs("./audio", exist_ok=True)
+            output_path = os.path.join("./audio", "recorded.wav")
+            data = audio_value if isinstance(audio_value, (bytes, bytearray)) else audio_value.read()
+            with open(output_path, "wb") as f:
+                f.write(data)
+            span.set(bytes=len(data))
         logging.info(f"Audio guardado en {output_path}")
 
         # Transcripción con Whisper
-        model_wh, device = load_whisper_model("medium")
-        preprocessed = preprocess_audio_file(output_path)
-        transcript = transcribe_audio_file(model_wh, device, preprocessed)
+        with telemetry.span("preprocess_audio"):
+            preprocessed = preprocess_audio_file(output_path)
+        with registry.use("whisper") as (model_wh, device), telemetry.span("transcription") as span:
+            transcript = transcribe_audio_file(model_wh, device, preprocessed)
+            span.set(chars=len(transcript))
         query = transcript.strip()
         st.audio(audio_value)
         st.markdown(f"**Transcripción:** {query}")
@@ -72,25 +99,40 @@ if text_query:
 # Si hay query de audio o texto, procesar
 if query:
     logging.info(f"User query: {query}")
+    # Una nueva pregunta cancela la generación anterior de la sesión si sigue en curso
+    if "cancel_token" in st.session_state:
+        st.session_state.cancel_token.cancel(STOP_NEW_QUESTION)
+    st.session_state.cancel_token = CancelToken()
     # Mostrar usuario\    
     st.session_state.messages.append({"role": "user", "content": query})
     with st.chat_message("user"):
         st.markdown(query)
 
-    # Cargar modelo y generar respuesta
-    model_name = "llama2"  # Cambia a "gpt2" para usar Llama 2 chat 7b
-    respuesta = answer_query(query, model_name)
-
-    # Mostrar respuesta
-    st.session_state.messages.append({"role": "assistant", "content": respuesta})
+    # Generar y mostrar la respuesta en streaming con los modelos del registro
     with st.chat_message("assistant"):
-        st.markdown(respuesta)
+        stats = {}
+        respuesta = st.write_stream(answer_query_stream(
+            query, model_name, registry=registry, stats=stats, batching=True, cancel_token=st.session_state.cancel_token,
+        ))
+        st.session_state.messages.append({"role": "assistant", "content": respuesta})
         logging.info(f"Respuesta del chatbot: {respuesta}")
+        ruta = " · Sin búsqueda vectorial" if stats.get("retrieval", {}).get("path") == "intent" else ""
+        if stats.get("cascade", {}).get("tier"):
+            ruta += f" · Nivel: {stats['cascade']['tier']}"
+            logging.info(f"Cascada: {stats['cascade']}")
+        if stats.get("truncated"):
+            ruta += " · Respuesta interrumpida"
+            logging.info(f"Respuesta interrumpida: {stats['truncated']}")
+        if stats.get("cache"):
+            st.caption(f"Respuesta desde caché ({stats['cache']}) · Total: {stats['total_s']:.2f} s{ruta}")
+        elif stats.get("ttft_s") is not None:
+            st.caption(f"Primer token: {stats['ttft_s']:.2f} s · Total: {stats['total_s']:.2f} s{ruta}")
+            logging.info(f"Latencia: primer token {stats['ttft_s']:.2f}s, total {stats['total_s']:.2f}s")
 
         # Generar respuesta de audio
         if respuesta is not None:
-            tts = load_tts_model()
-            audio_bytes = obtain_audio_response(respuesta, model=tts)
+            with registry.use("tts") as tts, telemetry.span("tts", chars=len(respuesta)):
+                audio_bytes = obtain_audio_response(respuesta, model=tts)
             st.audio(audio_bytes)
 
         # Guardar respuesta de audio
@@ -28,12 +28,18 @@ except ImportError:
 _tts_model = None
 
 
-def load_tts_model(model_name: str = "tts_models/es/css10/vits"):
+def load_tts_model(model_name: str = "tts_models/es/css10/vits", cache: bool = True):
     """
     Carga el modelo TTS de Coqui por defecto VITS en español (CSS10).
+    - cache: si es False, devuelve una instancia nueva sin guardarla en la variable global
+      (útil cuando la gestiona el registro de modelos).
     Devuelve la instancia de TTS.
     """
     global _tts_model
+    if not cache:
+        return TTS(
+            model_name=model_name, progress_bar=False, gpu=torch.cuda.is_available()
+        )
     if _tts_model is None:
         # Carga el modelo una sola vez (descarga si es necesario)
         _tts_model = TTS(
@@ -0,0 +1,83 @@
+# bench_adaptive_k.py
+"""
+Benchmark del recorte adaptativo del número de fragmentos (`adaptive_cutoff` en `src/utils.py`). Sobre el corpus sintético de fichas técnicas y las consultas etiquetadas de `bench_hybrid_search.py` (con el texto de cada fragmento alargado hasta el tamaño habitual del corpus), compara el k fijo del modelo con cada regla por separado (umbral absoluto, salto relativo al mejor resultado y codo) y con las reglas por defecto combinadas: número medio de fragmentos y de tokens del prompt por consulta, y acierto y recall de los fragmentos relevantes.
+
+Por defecto los fragmentos y las consultas se embeben con el modelo de embeddings del chatbot; con `--no-encoder` se usan los embeddings sintéticos de `bench_hybrid_search.py`.
+
+Uso:
+    python benchmarks/bench_adaptive_k.py [--num-drugs 1000] [--no-encoder] [--hybrid] [--tokenizer NOMBRE]
+"""
+
+# Librerías
+import argparse
+
+import faiss
+import numpy as np
+
+from common import load_tokenizer, synthetic_fragments
+from bench_hybrid_search import synthetic_corpus, synthetic_embeddings
+from sparse_index import BM25Index
+from utils import retrieve_relevant_fragments, format_context, build_prompt, ADAPTIVE_K_RULES, RETRIEVAL_K, EMBEDDING_MODEL_NAME
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del recorte adaptativo del número de fragmentos")
+    parser.add_argument("--num-drugs", type=int, default=1000)
+    parser.add_argument("--num-queries", type=int, default=300)
+    parser.add_argument("--model-name", default="llama2", choices=list(RETRIEVAL_K))
+    parser.add_argument("--no-encoder", action="store_true", help="Usa embeddings sintéticos")
+    parser.add_argument("--hybrid", action="store_true", help="Búsqueda híbrida BM25 + FAISS")
+    parser.add_argument("--tokenizer", default=None, help="Tokenizador de Hugging Face (por defecto, BPE local)")
+    args = parser.parse_args()
+    k = RETRIEVAL_K[args.model_name]
+
+    fragments, queries = synthetic_corpus(args.num_drugs, args.num_queries)
+    relleno = synthetic_fragments(len(fragments), min_words=60, max_words=250)
+    embed_texts = [frag["texto"] for frag in fragments]
+    for frag, extra in zip(fragments, relleno):
+        frag["texto"] = f"{frag['texto']}. {extra['texto']}"
+    tokenizer = load_tokenizer(args.tokenizer, [frag["texto"] for frag in fragments[:2000]])
+
+    if args.no_encoder:
+        embeddings, query_embeddings = synthetic_embeddings(fragments, queries)
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        embeddings = embedding_model.encode(embed_texts, convert_to_numpy=True, batch_size=64)
+        query_embeddings = embedding_model.encode([q[1] for q in queries], convert_to_numpy=True, batch_size=64)
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    sparse = BM25Index.build(fragments) if args.hybrid else None
+
+    politicas = {
+        f"k fijo ({k})": False,
+        "umbral absoluto": {"max_distance": ADAPTIVE_K_RULES["max_distance"]},
+        "salto relativo": {"max_gap": ADAPTIVE_K_RULES["max_gap"]},
+        "codo": {"elbow": ADAPTIVE_K_RULES["elbow"]},
+        "combinadas": ADAPTIVE_K_RULES,
+    }
+    print(f"{len(fragments)} fragmentos, {len(queries)} consultas, búsqueda {'híbrida' if args.hybrid else 'vectorial'}")
+    print(f"{'reglas':>16} | {'fragmentos':>10} | {'tokens prompt':>13} | {'acierto':>7} | {'recall':>6}")
+    for nombre, reglas in politicas.items():
+        num_fragmentos, tokens, aciertos, recall = [], [], [], []
+        for (_, query, relevantes, _), q in zip(queries, query_embeddings):
+            resultados = retrieve_relevant_fragments(
+                query, None, fragments, index, args.model_name, query_embedding=q, sparse=sparse, adaptive=reglas,
+            )
+            prompt = build_prompt(format_context(resultados, max_fragments=k), query, args.model_name)
+            encontrados = len(relevantes & {r["id"] for r in resultados})
+            num_fragmentos.append(len(resultados))
+            tokens.append(len(tokenizer(prompt)["input_ids"]))
+            aciertos.append(encontrados > 0)
+            recall.append(encontrados / min(len(relevantes), k))
+        print(
+            f"{nombre:>16} | {np.mean(num_fragmentos):>10.1f} | {np.mean(tokens):>13.0f} | "
+            f"{np.mean(aciertos):>7.1%} | {np.mean(recall):>6.1%}"
+        )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
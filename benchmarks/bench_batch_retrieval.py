@@ -0,0 +1,87 @@
+# bench_batch_retrieval.py
+"""
+Benchmark de la recuperación por lotes (`retrieve_relevant_fragments_batch` en `src/utils.py`). Compara el tiempo de recuperar N consultas llamando N veces a `retrieve_relevant_fragments` (un embedding, una búsqueda 1 x d y una copia de cada fragmento por consulta) con una sola llamada por lotes (un embedding de N consultas, una búsqueda N x d y vistas sin copia), y comprueba que los resultados coinciden.
+
+Por defecto embebe las consultas con el modelo de embeddings del chatbot; con `--no-encoder` se usan embeddings sintéticos y solo se mide la búsqueda y la construcción de resultados.
+
+La ganancia de la búsqueda en un IndexFlat depende de cuándo FAISS pasa a calcular las distancias con BLAS (`faiss.cvar.distance_compute_blas_threshold`, que cambia entre versiones); `--blas-threshold` permite fijarlo.
+
+Uso:
+    python benchmarks/bench_batch_retrieval.py [--num-fragments 20000] [--batch-sizes 1 8 32 128] [--no-encoder] [--blas-threshold 20]
+"""
+
+# Librerías
+import time
+import argparse
+
+import faiss
+
+from common import clustered_embeddings, synthetic_fragments, percentile
+from utils import retrieve_relevant_fragments, retrieve_relevant_fragments_batch, EMBEDDING_MODEL_NAME
+
+# Consultas de ejemplo (se repiten para formar los lotes)
+PREGUNTAS = [
+    "¿cuáles son las contraindicaciones del ibuprofeno?",
+    "¿qué reacciones adversas tiene el paracetamol?",
+    "¿cuál es la posología de la amoxicilina en niños?",
+    "¿se puede tomar omeprazol durante el embarazo?",
+    "¿afecta el diazepam a la capacidad de conducir?",
+    "¿qué hacer en caso de sobredosis de metformina?",
+]
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la recuperación por lotes")
+    parser.add_argument("--num-fragments", type=int, default=20000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-encoder", action="store_true", help="Usa embeddings sintéticos para las consultas")
+    parser.add_argument("--blas-threshold", type=int, default=None, help="Umbral de FAISS para usar BLAS en la búsqueda")
+    args = parser.parse_args()
+
+    if args.blas_threshold is not None:
+        faiss.cvar.distance_compute_blas_threshold = args.blas_threshold
+
+    fragments = synthetic_fragments(args.num_fragments, max_words=120)
+    if args.no_encoder:
+        embedding_model = None
+        d = 384
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        d = embedding_model.get_sentence_embedding_dimension()
+    index = faiss.IndexFlatL2(d)
+    index.add(clustered_embeddings(args.num_fragments, d))
+
+    print(f"{'lote':>5} | {'N llamadas (ms)':>15} | {'por lotes (ms)':>14} | {'aceleración':>11} | {'consultas/s (lotes)':>19} | iguales")
+    for n in args.batch_sizes:
+        queries = [PREGUNTAS[i % len(PREGUNTAS)] + f" ({i})" for i in range(n)]
+        embeddings = clustered_embeddings(n, d, seed=1) if args.no_encoder else None
+
+        t_uno, t_lote = [], []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            individuales = [
+                retrieve_relevant_fragments(
+                    q, embedding_model, fragments, index, "llama2",
+                    query_embedding=None if embeddings is None else embeddings[i],
+                )
+                for i, q in enumerate(queries)
+            ]
+            t_uno.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            results = retrieve_relevant_fragments_batch(queries, embedding_model, fragments, index, args.k, query_embeddings=embeddings)
+            t_lote.append(time.perf_counter() - start)
+
+        iguales = all([f["id"] for f in uno] == [f["id"] for f in lote] for uno, lote in zip(individuales, results))
+        uno, lote = percentile(t_uno, 50), percentile(t_lote, 50)
+        print(f"{n:>5} | {uno * 1000:>15.2f} | {lote * 1000:>14.2f} | {uno / lote:>10.1f}x | {n / lote:>19.0f} | {'sí' if iguales else 'NO'}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
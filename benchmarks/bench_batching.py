@@ -0,0 +1,77 @@
+# bench_batching.py
+"""
+Benchmark del motor de batching continuo (`src/batching.py`). Lanza 1, 4, 8 y 16 consultas concurrentes contra un modelo Llama pequeño de pesos aleatorios en CPU y mide el throughput (tokens/s) y la latencia por consulta, comparándolo con servirlas una a una con `model.generate`.
+
+Uso:
+    python benchmarks/bench_batching.py [--max-new-tokens 64] [--concurrency 1 4 8 16]
+"""
+
+# Librerías
+import time
+import argparse
+
+import torch
+
+from common import tiny_llama, random_prompts, percentile
+from batching import BatchingEngine
+
+
+# Función para medir el throughput secuencial con model.generate
+def bench_secuencial(model, prompts, max_new_tokens):
+    start = time.perf_counter()
+    tokens = 0
+    for p in prompts:
+        out = model.generate(
+            torch.tensor([p]),
+            attention_mask=torch.ones(1, len(p), dtype=torch.long),
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=0,
+        )
+        tokens += out.shape[1] - len(p)
+    return tokens / (time.perf_counter() - start)
+
+
+# Función para medir el throughput con el motor de batching continuo
+def bench_engine(model, prompts, max_new_tokens, max_batch_size):
+    engine = BatchingEngine(model, max_batch_size=max_batch_size)
+    try:
+        start = time.perf_counter()
+        requests = [engine.submit(p, max_new_tokens=max_new_tokens, eos_token_id=None) for p in prompts]
+        for r in requests:
+            r.result()
+        wall = time.perf_counter() - start
+        latencias = [r.stats()["total_s"] for r in requests]
+        tokens = sum(len(r.generated) for r in requests)
+        return tokens / wall, latencias, engine.stats()["mean_batch_size"]
+    finally:
+        engine.close()
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de batching continuo")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--threads", type=int, default=None, help="Hilos de torch en CPU")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = tiny_llama()
+    print(f"{'concurrencia':>12} {'secuencial tok/s':>17} {'batching tok/s':>15} {'speedup':>8} {'lote medio':>11} {'p50 s':>7} {'p99 s':>7}")
+    for c in args.concurrency:
+        prompts = random_prompts(c, seed=c)
+        seq = bench_secuencial(model, prompts, args.max_new_tokens)
+        tps, latencias, lote = bench_engine(model, prompts, args.max_new_tokens, max_batch_size=max(args.concurrency))
+        print(
+            f"{c:>12} {seq:>17.1f} {tps:>15.1f} {tps / seq:>7.2f}x {lote:>11.1f} "
+            f"{percentile(latencias, 50):>7.2f} {percentile(latencias, 99):>7.2f}"
+        )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
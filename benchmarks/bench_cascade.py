@@ -0,0 +1,86 @@
+# bench_cascade.py
+"""
+Benchmark del primer nivel de la cascada de modelos (`src/cascade.py`). Sobre las consultas etiquetadas de `bench_hybrid_search.py` (de sección, de dosis y de código ATC), con la frase que responde a cada una dentro del texto de relleno (ver `bench_extractive.py`), más consultas sobre información que no está en las fichas (con embeddings sin relación con el corpus), construye la respuesta extractiva y, para varios umbrales de similitud y de cobertura de la consulta, mide qué parte del tráfico se queda en el nivel extractivo y con qué acierto (la respuesta contiene la frase de un fragmento relevante). El resto de consultas pasaría a GPT-2 o Llama-2.
+
+El acierto de las consultas aceptadas frente al de todas indica cuánto filtran las comprobaciones; bajar el umbral reduce la latencia media (más consultas en milisegundos) a costa del acierto.
+
+Uso:
+    python benchmarks/bench_cascade.py [--num-drugs 500] [--num-queries 600] [--thresholds 0.3,0.45,0.6,0.75] [--coverages 0,0.3,0.6]
+"""
+
+# Librerías
+import random
+import argparse
+
+import faiss
+import numpy as np
+
+from bench_extractive import synthetic_answer_corpus
+from cascade import CascadeRouter, CASCADE_RULES, retrieval_confidence
+from extractive import extractive_answer
+from utils import retrieve_relevant_fragments
+
+# Consultas sobre información que no está en las fichas técnicas
+FUERA_DEL_CORPUS = (
+    "¿cuánto cuesta el {} en la farmacia?",
+    "¿el {} engorda?",
+    "¿dónde se fabrica el {}?",
+    "¿qué opinan los pacientes del {}?",
+)
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del nivel extractivo de la cascada de modelos")
+    parser.add_argument("--num-drugs", type=int, default=500)
+    parser.add_argument("--num-queries", type=int, default=600)
+    parser.add_argument("--thresholds", default="0.3,0.45,0.6,0.75", help="Umbrales de extractive_similarity")
+    parser.add_argument("--coverages", default=f"0,0.3,{CASCADE_RULES['extractive_coverage']}", help="Umbrales de extractive_coverage")
+    parser.add_argument("--out-of-corpus", type=float, default=0.2, help="Proporción de consultas fuera del corpus")
+    args = parser.parse_args()
+
+    fragments, queries, embeddings, query_embeddings = synthetic_answer_corpus(args.num_drugs, args.num_queries, section_only=False)
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+
+    rng, nrng = random.Random(0), np.random.default_rng(0)
+    fuera = [
+        ("fuera del corpus", rng.choice(FUERA_DEL_CORPUS).format(nombre.split(" mg")[0]), set(), None)
+        for _, _, _, (nombre, _) in rng.sample(queries, int(len(queries) * args.out_of_corpus))
+    ]
+    ruido = nrng.normal(size=(len(fuera), embeddings.shape[1])).astype(np.float32)
+    queries += fuera
+    query_embeddings = np.vstack([query_embeddings, ruido / np.linalg.norm(ruido, axis=1, keepdims=True)])
+
+    # Respuesta extractiva y confianza de cada consulta (no dependen del umbral)
+    consultas = []
+    for (tipo, query, relevantes, _), q in zip(queries, query_embeddings):
+        stats = {"path": "dense"}
+        resultados = retrieve_relevant_fragments(query, None, fragments, index, "llama2", query_embedding=q, adaptive=False, stats=stats)
+        respuesta = extractive_answer(query, resultados)
+        acierto = any(fragments[i]["respuesta"] in respuesta for i in relevantes)
+        consultas.append((tipo, query, respuesta, retrieval_confidence(resultados, stats), acierto))
+    print(f"{len(fragments)} fragmentos, {len(consultas)} consultas; acierto extractivo sin filtrar: {np.mean([c[4] for c in consultas]):.1%}")
+
+    tipos = sorted({c[0] for c in consultas})
+    aciertos = np.array([c[4] for c in consultas])
+    print("\nTráfico que se queda en el nivel extractivo (total y por tipo de consulta) y acierto de las consultas aceptadas")
+    print(f"{'similitud':>9} | {'cobertura':>9} | {'extractivo':>10} | {'acierto':>7} | " + " | ".join(f"{t:>16}" for t in tipos))
+    for umbral in (float(x) for x in args.thresholds.split(",")):
+        for cobertura in (float(x) for x in args.coverages.split(",")):
+            router = CascadeRouter(rules={"extractive_similarity": umbral, "extractive_coverage": cobertura})
+            aceptadas = np.array([
+                router.accept_extractive(query, respuesta, confianza, {"path": "dense"})[0]
+                for _, query, respuesta, confianza, _ in consultas
+            ])
+            por_tipo = [np.mean(aceptadas[[c[0] == t for c in consultas]]) for t in tipos]
+            acierto = aciertos[aceptadas].mean() if aceptadas.any() else float("nan")
+            print(
+                f"{umbral:>9.2f} | {cobertura:>9.2f} | {aceptadas.mean():>10.1%} | {acierto:>7.1%} | "
+                + " | ".join(f"{x:>16.1%}" for x in por_tipo)
+            )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# bench_deadline.py
+"""
+Benchmark de los plazos y la cancelación de las generaciones (`src/deadline.py`). Lanza consultas concurrentes con una longitud máxima muy superior a la que cabe en el plazo contra un modelo Llama pequeño de pesos aleatorios en CPU, de dos formas:
+
+- "generate": un hilo por consulta con su propio `model.generate` y `DeadlineStoppingCriteria`.
+- "batching": todas las consultas en el motor de batching continuo (`src/batching.py`), que retira del lote las que vencen.
+
+Para cada plazo mide la latencia p50/p99 desde la llegada de la consulta, el tiempo medio de un paso de decodificación con esa carga (desde el primer token) y el exceso del p99 sobre el plazo, que debe quedar por debajo de un paso. Con `--cancel` la mitad de las consultas se cancelan a mitad de plazo y se mide cuánto tardan en liberar el modelo desde la cancelación.
+
+Uso:
+    python benchmarks/bench_deadline.py [--deadlines 0.5,1,2] [--concurrency 8] [--max-new-tokens 2000] [--cancel]
+"""
+
+# Librerías
+import time
+import argparse
+import threading
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from common import tiny_llama, random_prompts, percentile
+from batching import BatchingEngine
+from deadline import RequestDeadline, DeadlineStoppingCriteria, STOP_DEADLINE
+
+
+class _StepTimer(StoppingCriteria):
+    """Criterio de parada que nunca detiene la generación: anota el instante de cada paso."""
+
+    def __init__(self):
+        self.times = []
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.times.append(time.perf_counter())
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool)
+
+
+# Función para calcular el tiempo medio de un paso de decodificación
+def _decode_step(first_token_at, finished_at, num_tokens):
+    return (finished_at - first_token_at) / (num_tokens - 1) if num_tokens > 1 else float("nan")
+
+
+# Función para lanzar las consultas, cada una con su model.generate en un hilo
+def run_generate(model, prompts, deadlines, max_new_tokens):
+    resultados = [None] * len(prompts)
+
+    def _run(i, prompt, deadline):
+        timer = _StepTimer()
+        model.generate(
+            torch.tensor([prompt]),
+            attention_mask=torch.ones(1, len(prompt), dtype=torch.long),
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=0,
+            stopping_criteria=StoppingCriteriaList([timer, DeadlineStoppingCriteria(deadline)]),
+        )
+        # El criterio se evalúa una vez por token generado, tras cada paso
+        paso = _decode_step(timer.times[0], timer.times[-1], len(timer.times)) if timer.times else float("nan")
+        resultados[i] = (time.perf_counter() - deadline.start, paso)
+
+    hilos = [threading.Thread(target=_run, args=(i, p, d)) for i, (p, d) in enumerate(zip(prompts, deadlines))]
+    for h in hilos:
+        h.start()
+    return lambda: [h.join() for h in hilos] and resultados
+
+
+# Función para lanzar las consultas en el motor de batching continuo
+def run_batching(engine, prompts, deadlines, max_new_tokens):
+    requests = [
+        engine.submit(p, max_new_tokens=max_new_tokens, eos_token_id=None, deadline=d) for p, d in zip(prompts, deadlines)
+    ]
+
+    def _wait():
+        resultados = []
+        for r, d in zip(requests, deadlines):
+            r.result()
+            paso = _decode_step(r.first_token_at, r.finished_at, len(r.generated)) if r.first_token_at else float("nan")
+            resultados.append((r.finished_at - d.start, paso))
+        return resultados
+
+    return _wait
+
+
+# Función para medir un plazo con uno de los modos
+def bench(launch, prompts, seconds, cancel):
+    deadlines = [RequestDeadline(seconds) for _ in prompts]
+    wait = launch(prompts, deadlines)
+    cancelados = {}
+    if cancel:
+        # La mitad de las sesiones envía otra pregunta a mitad de plazo
+        time.sleep(seconds / 2)
+        for d in deadlines[::2]:
+            cancelados[id(d)] = time.perf_counter() - d.start
+            d.cancel()
+    resultados = wait()
+
+    latencias = [r[0] for r, d in zip(resultados, deadlines) if d.reason == STOP_DEADLINE]
+    pasos = [r[1] for r in resultados if r[1] == r[1]]
+    liberacion = [r[0] - cancelados[id(d)] for r, d in zip(resultados, deadlines) if id(d) in cancelados]
+    return latencias, pasos, liberacion
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los plazos y la cancelación de las generaciones")
+    parser.add_argument("--deadlines", default="0.5,1,2", help="Plazos en segundos")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=2000)
+    parser.add_argument("--cancel", action="store_true", help="Cancela la mitad de las consultas a mitad de plazo")
+    parser.add_argument("--threads", type=int, default=None, help="Hilos de torch en CPU")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = tiny_llama()
+    prompts = random_prompts(args.concurrency)
+    engine = BatchingEngine(model, max_batch_size=args.concurrency)
+    modos = {
+        "generate": lambda p, d: run_generate(model, p, d, args.max_new_tokens),
+        "batching": lambda p, d: run_batching(engine, p, d, args.max_new_tokens),
+    }
+
+    print(f"{args.concurrency} consultas concurrentes, max_new_tokens={args.max_new_tokens}")
+    print(
+        f"{'modo':>8} | {'plazo (s)':>9} | {'p50 (s)':>7} | {'p99 (s)':>7} | {'paso p99 (ms)':>13} | "
+        f"{'p99 - plazo (ms)':>16} | {'liberación p99 (ms)':>19}"
+    )
+    try:
+        for seconds in (float(x) for x in args.deadlines.split(",")):
+            for nombre, launch in modos.items():
+                latencias, pasos, liberacion = bench(launch, prompts, seconds, args.cancel)
+                p99 = percentile(latencias, 99)
+                libera = f"{percentile(liberacion, 99) * 1000:.0f}" if liberacion else "-"
+                print(
+                    f"{nombre:>8} | {seconds:>9.2f} | {percentile(latencias, 50):>7.2f} | {p99:>7.2f} | "
+                    f"{percentile(pasos, 99) * 1000:>13.1f} | {(p99 - seconds) * 1000:>16.1f} | {libera:>19}"
+                )
+    finally:
+        engine.close()
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# bench_drug_names.py
+"""
+Benchmark del índice de nombres de medicamentos (`src/drug_names.py`). Genera nombres sintéticos (principio activo + laboratorio + dosis y forma, como los de las fichas técnicas) y consultas que los mencionan sin cambios, sin la dosis y la forma, abreviados o con una errata, y mide el acierto del mejor candidato, la latencia por consulta y el tiempo de arranque del índice (construcción frente a apertura con mmap).
+
+Uso:
+    python benchmarks/bench_drug_names.py [--num-drugs 5000] [--num-queries 1000]
+"""
+
+# Librerías
+import time
+import random
+import argparse
+import tempfile
+
+from common import percentile
+from drug_names import DrugNameIndex, normalize_text
+
+SILABAS = ["pa", "ra", "ce", "ta", "mol", "ibu", "pro", "fe", "no", "lo", "ra", "ze", "pam", "di", "am", "xi", "ci", "li", "na", "tra", "ma", "dol", "sar", "tan", "me", "for", "mi"]
+LABORATORIOS = ["normon", "cinfa", "kern", "sandoz", "teva", "stada", "mylan", "aurobindo", "pensa", "ratiopharm"]
+FORMAS = ["comprimidos efg", "comprimidos recubiertos con pelicula", "capsulas duras", "solucion oral", "granulado para solucion oral"]
+
+
+# Función para generar los medicamentos sintéticos
+def synthetic_drugs(num_drugs, seed=0):
+    rng = random.Random(seed)
+    principios = sorted({"".join(rng.choice(SILABAS) for _ in range(rng.randint(3, 5))) for _ in range(num_drugs // 5)})
+    fragments = []
+    for _ in range(num_drugs):
+        medicamento = f"{rng.choice(principios)} {rng.choice(LABORATORIOS)}"
+        completo = f"{medicamento} {rng.choice([5, 10, 20, 40, 400, 600])} mg {rng.choice(FORMAS)}"
+        fragments.append({"medicamento": medicamento, "nombre_medicamento_completo": completo.upper().replace(" ", "_")})
+    return fragments
+
+
+# Función para introducir una errata en una palabra
+def typo(palabra, rng):
+    i = rng.randrange(len(palabra) - 1)
+    cambio = rng.choice(["swap", "drop", "replace"])
+    if cambio == "swap":
+        return palabra[:i] + palabra[i + 1] + palabra[i] + palabra[i + 2:]
+    if cambio == "drop":
+        return palabra[:i] + palabra[i + 1:]
+    return palabra[:i] + rng.choice("aeiou") + palabra[i + 1:]
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del índice de nombres de medicamentos")
+    parser.add_argument("--num-drugs", type=int, default=5000)
+    parser.add_argument("--num-queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    fragments = synthetic_drugs(args.num_drugs)
+    start = time.perf_counter()
+    names = DrugNameIndex.build(fragments)
+    build_s = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp:
+        names.save(tmp)
+        start = time.perf_counter()
+        names = DrugNameIndex.load(tmp)
+        load_s = time.perf_counter() - start
+        print(f"{len(names)} nombres de {len(names.drugs)} medicamentos: construcción {build_s * 1000:.0f} ms, apertura con mmap {load_s * 1000:.1f} ms")
+
+        rng = random.Random(1)
+        variantes = {
+            "nombre completo": lambda f: normalize_text(f["nombre_medicamento_completo"]),
+            "sin dosis ni forma": lambda f: f["medicamento"],
+            "principio activo": lambda f: f["medicamento"].split()[0],
+            "abreviado": lambda f: f["medicamento"].split()[0][:max(5, len(f["medicamento"].split()[0]) - 3)],
+            "con errata": lambda f: typo(f["medicamento"].split()[0], rng),
+        }
+        print(f"{'consulta':>18} | {'acierto':>7} | {'p50 (ms)':>8} | {'p99 (ms)':>8}")
+        for nombre, variante in variantes.items():
+            tiempos, aciertos = [], 0
+            for _ in range(args.num_queries):
+                frag = rng.choice(fragments)
+                query = f"¿cuáles son las reacciones adversas del {variante(frag)}?"
+                start = time.perf_counter()
+                candidatos = names.candidates(query)
+                tiempos.append(time.perf_counter() - start)
+                aciertos += bool(candidatos) and frag["medicamento"] in candidatos[0].drugs
+            print(
+                f"{nombre:>18} | {aciertos / args.num_queries:>7.1%} | {percentile(tiempos, 50) * 1000:>8.3f} | "
+                f"{percentile(tiempos, 99) * 1000:>8.3f}"
+            )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench_extractive.py
+"""
+Benchmark de las respuestas extractivas (`src/extractive.py`). Sobre el corpus sintético de fichas técnicas y las consultas de sección de `bench_hybrid_search.py`, con el texto de cada fragmento alargado con frases de relleno, recupera los fragmentos de cada consulta y mide la latencia de construir la respuesta extractiva, la proporción de respuestas que contienen la frase de la ficha que responde a la consulta y la que cita el fragmento relevante.
+
+Por defecto las frases se ordenan por los términos de la consulta; con `--encoder` también se mide la ordenación por similitud con el modelo de embeddings del chatbot.
+
+Uso:
+    python benchmarks/bench_extractive.py [--num-drugs 500] [--num-queries 300] [--encoder]
+"""
+
+# Librerías
+import random
+import argparse
+
+import faiss
+import numpy as np
+
+from common import synthetic_fragments, percentile
+from bench_hybrid_search import synthetic_corpus, synthetic_embeddings
+from extractive import extractive_answer
+from utils import retrieve_relevant_fragments, EMBEDDING_MODEL_NAME
+
+
+# Función para convertir un texto sin puntuación en frases
+def _as_sentences(texto, rng, min_words=8, max_words=20):
+    palabras, frases = texto.split(), []
+    while palabras:
+        n = rng.randint(min_words, max_words)
+        frase = " ".join(palabras[:n])
+        frases.append(frase[0].upper() + frase[1:] + ".")
+        palabras = palabras[n:]
+    return " ".join(frases)
+
+
+# Función para generar el corpus con la frase que responde a cada consulta de sección
+def synthetic_answer_corpus(num_drugs, num_queries, section_only=True, seed=0):
+    """
+    Corpus de `synthetic_corpus` con el texto de cada fragmento alargado con frases de relleno; la
+    frase de la ficha que responde a la consulta se guarda en "respuesta".
+
+    Retorna:
+    - tuple: (fragmentos, consultas, embeddings de los fragmentos, embeddings de las consultas)
+    """
+    fragments, queries = synthetic_corpus(num_drugs, num_queries, seed)
+    # En las consultas de sección, la respuesta es una frase concreta de la ficha
+    if section_only:
+        queries = [q for q in queries if q[0] == "sección"]
+    embeddings, query_embeddings = synthetic_embeddings(fragments, queries, seed=seed)
+    rng = random.Random(seed)
+    for frag, extra in zip(fragments, synthetic_fragments(len(fragments), min_words=60, max_words=250, seed=seed)):
+        # La frase que responde a la consulta queda en medio del texto de relleno
+        relleno = _as_sentences(extra["texto"], rng).split(". ")
+        corte = rng.randint(0, len(relleno))
+        frag["respuesta"] = frag["texto"][0].upper() + frag["texto"][1:] + "."
+        frag["texto"] = " ".join([". ".join(relleno[:corte]) + "." if corte else "", frag["respuesta"], ". ".join(relleno[corte:])]).strip()
+    return fragments, queries, embeddings, query_embeddings
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las respuestas extractivas")
+    parser.add_argument("--num-drugs", type=int, default=500)
+    parser.add_argument("--num-queries", type=int, default=300)
+    parser.add_argument("--encoder", action="store_true", help="Mide también la ordenación con embeddings")
+    args = parser.parse_args()
+
+    fragments, queries, embeddings, query_embeddings = synthetic_answer_corpus(args.num_drugs, args.num_queries)
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+
+    ordenaciones = {"términos": (None, [None] * len(queries))}
+    if args.encoder:
+        from sentence_transformers import SentenceTransformer
+
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        ordenaciones["embeddings"] = (
+            embedding_model, embedding_model.encode([q[1] for q in queries], convert_to_numpy=True, batch_size=64),
+        )
+
+    print(f"{len(fragments)} fragmentos, {len(queries)} consultas de sección")
+    print(f"{'ordenación':>10} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'frases':>6} | {'caracteres':>10} | {'frase clave':>11} | {'cita':>6}")
+    for nombre, (embedding_model, ordenacion_embeddings) in ordenaciones.items():
+        tiempos, frases, caracteres, aciertos, citas = [], [], [], [], []
+        for (_, query, relevantes, (medicamento, categoria)), q, qo in zip(queries, query_embeddings, ordenacion_embeddings):
+            resultados = retrieve_relevant_fragments(query, None, fragments, index, "llama2", query_embedding=q, adaptive=False)
+            stats = {}
+            respuesta = extractive_answer(query, resultados, embedding_model=embedding_model, query_embedding=qo, stats=stats)
+            tiempos.append(stats["s"])
+            frases.append(stats["sentences"])
+            caracteres.append(len(respuesta))
+            clave = fragments[next(iter(relevantes))]["respuesta"]
+            aciertos.append(clave in respuesta)
+            citas.append(f"{medicamento} — {categoria}" in respuesta)
+        print(
+            f"{nombre:>10} | {percentile(tiempos, 50) * 1000:>8.2f} | {percentile(tiempos, 99) * 1000:>8.2f} | "
+            f"{np.mean(frases):>6.1f} | {np.mean(caracteres):>10.0f} | {np.mean(aciertos):>11.1%} | {np.mean(citas):>6.1%}"
+        )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# bench_filtered_search.py
+"""
+Benchmark de la búsqueda filtrada por metadatos (`src/metadata_filter.py`). Sobre un corpus sintético de fragmentos agrupados por medicamento (con categoría y código ATC) compara la latencia de la búsqueda sin filtros con la filtrada por medicamento (subconjunto pequeño: búsqueda exacta), por subgrupo ATC y por grupo anatómico ATC (subconjuntos grandes: selector de ids de FAISS), y mide qué fracción de los k resultados sin filtrar son de otro medicamento y el recall de la búsqueda filtrada frente a la exacta sobre el subconjunto.
+
+Uso:
+    python benchmarks/bench_filtered_search.py [--num-fragments 50000] [--fragments-per-drug 40] [--factories Flat IVF{nlist},Flat HNSW32]
+"""
+
+# Librerías
+import time
+import random
+import argparse
+
+import numpy as np
+
+from common import clustered_embeddings, percentile
+from index_factory import build_index
+from metadata_filter import MetadataIndex, filtered_search
+
+CATEGORIAS = ["Indicaciones", "Contraindicaciones", "Posología", "Reacciones adversas", "Advertencias", "Interacciones"]
+GRUPOS_ATC = "ABCDGHJLMNPRSV"
+
+
+# Función para generar fragmentos con medicamento, categoría y código ATC
+def synthetic_corpus(n, fragments_per_drug, seed=0):
+    rng = random.Random(seed)
+    fragments = []
+    for i in range(n):
+        farmaco = i // fragments_per_drug
+        atc_rng = random.Random(farmaco // 3)  # cada principio activo tiene varios medicamentos
+        atc = f"{atc_rng.choice(GRUPOS_ATC)}{atc_rng.randint(1, 9):02d}{atc_rng.choice('ABC')}{atc_rng.choice('ABCDE')}{atc_rng.randint(1, 20):02d}"
+        fragments.append({
+            "id": i,
+            "medicamento": f"MEDICAMENTO {farmaco} 10 mg comprimidos",
+            "categoria": rng.choice(CATEGORIAS),
+            "ATC": atc,
+            "texto": "",
+        })
+    return fragments
+
+
+# Función para medir la latencia de una búsqueda
+def _medir(fn, repeats):
+    tiempos = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        resultado = fn()
+        tiempos.append(time.perf_counter() - start)
+    return resultado, tiempos
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la búsqueda filtrada por metadatos")
+    parser.add_argument("--num-fragments", type=int, default=50000)
+    parser.add_argument("--fragments-per-drug", type=int, default=40)
+    parser.add_argument("--factories", nargs="+", default=["Flat", "IVF{nlist},Flat", "HNSW32"])
+    parser.add_argument("--num-queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    fragments = synthetic_corpus(args.num_fragments, args.fragments_per_drug)
+    embeddings = clustered_embeddings(args.num_fragments)
+    start = time.perf_counter()
+    metadata = MetadataIndex(fragments)
+    print(f"{len(fragments)} fragmentos; listas de filtrado construidas en {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    # Cada consulta pregunta por un medicamento concreto: su embedding es el de uno de sus fragmentos con ruido
+    rng = np.random.default_rng(1)
+    objetivo = rng.choice(len(fragments), args.num_queries, replace=False)
+    queries = embeddings[objetivo] + rng.normal(0, 0.1, (args.num_queries, embeddings.shape[1])).astype(np.float32)
+
+    filtros = {
+        "medicamento": lambda frag: {"medicamento": frag["medicamento"]},
+        "ATC nivel 3": lambda frag: {"atc": frag["ATC"][:4]},
+        "ATC nivel 1": lambda frag: {"atc": frag["ATC"][:1]},
+    }
+
+    for factory in args.factories:
+        index, _ = build_index(embeddings, factory)
+        print(f"\n{factory}")
+        print(f"{'búsqueda':>14} | {'candidatos':>10} | {'estrategia':>14} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'recall':>6} | {'de otro medicamento':>19}")
+
+        tiempos, otros, recall = [], [], []
+        for q, o in zip(queries, objetivo):
+            (_, ids), t = _medir(lambda: index.search(q[None, :], args.k), args.repeats)
+            tiempos += t
+            otros.append(np.mean([fragments[i]["medicamento"] != fragments[o]["medicamento"] for i in ids[0] if i >= 0]))
+            recall.append(len(np.intersect1d(ids[0], np.argsort(((embeddings - q) ** 2).sum(1))[:args.k])) / args.k)
+        print(
+            f"{'sin filtros':>14} | {len(fragments):>10} | {'-':>14} | {percentile(tiempos, 50) * 1000:>8.2f} | "
+            f"{percentile(tiempos, 99) * 1000:>8.2f} | {np.mean(recall):>6.2f} | {np.mean(otros):>18.0%}"
+        )
+
+        for nombre, filtro in filtros.items():
+            tiempos, candidatos, estrategias, recall = [], [], set(), []
+            for q, o in zip(queries, objetivo):
+                positions = metadata.positions(filtro(fragments[o]))
+                stats = {}
+                (_, ids), t = _medir(lambda: filtered_search(index, q[None, :], args.k, positions, stats=stats), args.repeats)
+                tiempos += t
+                candidatos.append(stats["candidates"])
+                estrategias.add(stats["strategy"])
+                # Vecinos exactos dentro del subconjunto filtrado
+                exactos = positions[np.argsort(((embeddings[positions] - q) ** 2).sum(1))[:args.k]]
+                recall.append(len(np.intersect1d(ids[0], exactos)) / len(exactos))
+            print(
+                f"{nombre:>14} | {np.mean(candidatos):>10.0f} | {'/'.join(sorted(estrategias)):>14} | "
+                f"{percentile(tiempos, 50) * 1000:>8.2f} | {percentile(tiempos, 99) * 1000:>8.2f} | "
+                f"{np.mean(recall):>6.2f} | {'-':>19}"
+            )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
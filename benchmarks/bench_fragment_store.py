@@ -0,0 +1,108 @@
+# bench_fragment_store.py
+"""
+Benchmark del almacén columnar de fragmentos (`src/fragment_store.py`) frente al JSON con indent=4. Escribe un corpus sintético en los dos formatos y, en un proceso nuevo para cada uno (para que la memoria de uno no afecte al otro), mide el tiempo de apertura, el aumento de la memoria residente del proceso tras abrirlo y tras leer fragmentos (la propia del proceso, RssAnon, y la total, que con mmap incluye las páginas del fichero, compartidas entre procesos), y la latencia de leer un fragmento por posición y los k fragmentos de una consulta.
+
+Uso:
+    python benchmarks/bench_fragment_store.py [--num-fragments 100000] [--lookups 10000]
+"""
+
+# Librerías
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+from common import percentile, synthetic_fragments
+from fragment_store import FragmentStore, write_fragment_store
+
+
+# Función para obtener la memoria residente del proceso (MB): (propia, total)
+def rss_mb():
+    memoria = {}
+    with open("/proc/self/status", "r") as f:
+        for linea in f:
+            campo, _, valor = linea.partition(":")
+            if campo in ("RssAnon", "VmRSS"):
+                memoria[campo] = int(valor.split()[0]) / 1024
+    return memoria["RssAnon"], memoria["VmRSS"]
+
+
+# Función que abre los fragmentos y mide las lecturas (se ejecuta en un proceso nuevo)
+def _measure(formato, path, lookups, k, queue):
+    base = rss_mb()
+    crecimiento = lambda: "/".join(f"{a - b:.0f}" for a, b in zip(rss_mb(), base))
+    start = time.perf_counter()
+    if formato == "json":
+        with open(path, "r", encoding="utf-8") as f:
+            fragments = json.load(f)
+    else:
+        fragments = FragmentStore(path)
+    open_s = time.perf_counter() - start
+    rss_open = crecimiento()
+
+    rng = random.Random(0)
+    n = len(fragments)
+    uno, consulta = [], []
+    for _ in range(lookups):
+        i = rng.randrange(n)
+        start = time.perf_counter()
+        fragments[i]["texto"]
+        uno.append(time.perf_counter() - start)
+    for _ in range(lookups // k):
+        ids = [rng.randrange(n) for _ in range(k)]
+        start = time.perf_counter()
+        [fragments[i] for i in ids]
+        consulta.append(time.perf_counter() - start)
+    queue.put((open_s, rss_open, crecimiento(), uno, consulta))
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del almacén columnar de fragmentos frente al JSON")
+    parser.add_argument("--num-fragments", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--k", type=int, default=10, help="Fragmentos por consulta")
+    args = parser.parse_args()
+
+    fragments = synthetic_fragments(args.num_fragments, min_words=40, max_words=200)
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "fragments.json")
+        store_path = os.path.join(tmp, "fragment_store")
+        start = time.perf_counter()
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(fragments, f, ensure_ascii=False, indent=4)
+        json_s = time.perf_counter() - start
+        start = time.perf_counter()
+        write_fragment_store(fragments, store_path)
+        store_s = time.perf_counter() - start
+        store_mb = sum(os.path.getsize(os.path.join(store_path, x)) for x in os.listdir(store_path)) / 2**20
+        print(
+            f"{len(fragments)} fragmentos: JSON {os.path.getsize(json_path) / 2**20:.0f} MB (escrito en {json_s:.1f} s), "
+            f"almacén columnar {store_mb:.0f} MB (escrito en {store_s:.1f} s)"
+        )
+        del fragments
+
+        ctx = multiprocessing.get_context("spawn")
+        print(
+            f"{'formato':>9} | {'apertura (ms)':>13} | {'RSS apertura (MB, propia/total)':>31} | {'RSS final (MB, propia/total)':>28} | "
+            f"{'1 fragmento p50/p99 (µs)':>24} | {f'{args.k} fragmentos p50/p99 (µs)':>25}"
+        )
+        for formato, path in (("json", json_path), ("columnar", store_path)):
+            queue = ctx.Queue()
+            proceso = ctx.Process(target=_measure, args=(formato, path, args.lookups, args.k, queue))
+            proceso.start()
+            open_s, rss_open, rss_final, uno, consulta = queue.get()
+            proceso.join()
+            print(
+                f"{formato:>9} | {open_s * 1000:>13.1f} | {rss_open:>31} | {rss_final:>28} | "
+                f"{percentile(uno, 50) * 1e6:>11.1f} / {percentile(uno, 99) * 1e6:>10.1f} | "
+                f"{percentile(consulta, 50) * 1e6:>12.1f} / {percentile(consulta, 99) * 1e6:>10.1f}"
+            )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# bench_hybrid_search.py
+"""
+Benchmark de la búsqueda híbrida BM25 + FAISS (`src/sparse_index.py`). Genera un corpus sintético de fichas técnicas (una sección por fragmento, con el nombre del medicamento, su dosis y, en las propiedades farmacológicas, su código ATC) y un conjunto de consultas etiquetadas con los fragmentos relevantes: sección de un medicamento concreto, medicamento y dosis, y código ATC. Compara el acierto (algún fragmento relevante entre los k primeros) y el recall@k de la búsqueda vectorial, de BM25 y de su fusión (RRF), y la latencia de BM25 y de la búsqueda híbrida completa.
+
+Por defecto los fragmentos y las consultas se embeben con el modelo de embeddings del chatbot. Con `--no-encoder` se usan embeddings sintéticos que, como all-MiniLM-L6-v2 con el español, distinguen bien la sección pero poco el medicamento.
+
+Uso:
+    python benchmarks/bench_hybrid_search.py [--num-drugs 2000] [--no-encoder]
+"""
+
+# Librerías
+import time
+import random
+import argparse
+
+import faiss
+import numpy as np
+
+from common import percentile
+from sparse_index import BM25Index
+from utils import retrieve_relevant_fragments, RETRIEVAL_K, EMBEDDING_MODEL_NAME
+
+SILABAS = ["pa", "ra", "ce", "ta", "mol", "ibu", "pro", "fe", "no", "lo", "ze", "pam", "di", "am", "xi", "ci", "li", "na", "tra", "ma", "dol", "sar", "tan"]
+LABORATORIOS = ["normon", "cinfa", "kern", "sandoz", "teva", "stada", "mylan", "aurobindo", "pensa", "ratiopharm"]
+SECCIONES = {
+    "indicaciones": "{} está indicado para el tratamiento sintomático del dolor leve o moderado y la fiebre en adultos",
+    "posologia": "la dosis recomendada de {} es de un comprimido cada ocho horas con o sin alimentos",
+    "contraindicaciones": "no se debe administrar {} en pacientes con insuficiencia hepática grave o hipersensibilidad",
+    "reacciones_adversas": "las reacciones adversas más frecuentes de {} son cefalea náuseas mareo y dolor abdominal",
+    "excipientes": "cada comprimido de {} contiene lactosa monohidrato celulosa microcristalina y estearato de magnesio",
+    "propiedades_farmacodinamicas": "{} pertenece al grupo farmacoterapéutico con código ATC {}",
+}
+PREGUNTAS = {
+    "indicaciones": "¿para qué sirve el {}?",
+    "posologia": "¿qué dosis de {} debo tomar?",
+    "contraindicaciones": "¿cuándo no debo tomar {}?",
+    "reacciones_adversas": "¿qué efectos secundarios tiene el {}?",
+    "excipientes": "¿qué excipientes lleva el {}?",
+}
+
+
+# Función para generar el corpus de fichas técnicas y las consultas etiquetadas
+def synthetic_corpus(num_drugs, num_queries, seed=0):
+    """
+    Retorna:
+    - tuple: (fragmentos, consultas) con consultas = [(tipo, texto, posiciones relevantes,
+      (medicamento, sección) por la que se pregunta)].
+    """
+    rng = random.Random(seed)
+    principios = sorted({"".join(rng.choice(SILABAS) for _ in range(rng.randint(3, 5))) for _ in range(num_drugs // 4)})
+    atc = {p: f"{rng.choice('ABCDGHJLMNR')}{rng.randint(1, 9):02d}{rng.choice('ABC')}{rng.choice('ABCDE')}{rng.randint(1, 20):02d}" for p in principios}
+    fragments, medicamentos = [], []
+    for _ in range(num_drugs):
+        principio = rng.choice(principios)
+        nombre = f"{principio} {rng.choice(LABORATORIOS)} {rng.choice([5, 10, 20, 40, 400, 600])} mg comprimidos"
+        medicamentos.append((nombre, principio, len(fragments)))
+        for categoria, plantilla in SECCIONES.items():
+            fragments.append({"medicamento": nombre, "categoria": categoria, "texto": plantilla.format(nombre, atc[principio])})
+
+    por_seccion = {(f["medicamento"], f["categoria"]): i for i, f in enumerate(fragments)}
+    queries = []
+    for i in range(num_queries):
+        nombre, principio, _ = rng.choice(medicamentos)
+        tipo = i % 3
+        if tipo == 0:
+            categoria = rng.choice(list(PREGUNTAS))
+            queries.append(("sección", PREGUNTAS[categoria].format(nombre.split(" mg")[0]), {por_seccion[(nombre, categoria)]}, (nombre, categoria)))
+        elif tipo == 1:
+            dosis = " ".join(nombre.split()[2:4])
+            relevantes = {
+                por_seccion[(n, "posologia")] for n, p, _ in medicamentos if p == principio and dosis in n
+            }
+            queries.append(("dosis", f"posología de {principio} {dosis}", relevantes, (nombre, "posologia")))
+        else:
+            relevantes = {por_seccion[(n, "propiedades_farmacodinamicas")] for n, p, _ in medicamentos if atc[p] == atc[principio]}
+            queries.append(("código ATC", f"¿qué medicamentos tienen el código {atc[principio]}?", relevantes, (nombre, "propiedades_farmacodinamicas")))
+    return fragments, queries
+
+
+# Función para generar embeddings sintéticos: la sección pesa mucho más que el medicamento
+def synthetic_embeddings(fragments, queries, d=384, seed=0):
+    """
+    Cada vector es el de su sección más una parte pequeña del de su medicamento (más pequeña aún
+    en las consultas, que nombran el medicamento de forma abreviada) y ruido.
+
+    Retorna:
+    - tuple: (embeddings de los fragmentos, embeddings de las consultas)
+    """
+    rng = np.random.default_rng(seed)
+    secciones = {c: rng.normal(size=d) for c in SECCIONES}
+    medicamentos = {m: rng.normal(size=d) for m in sorted({f["medicamento"] for f in fragments})}
+
+    def embed(pares, peso):
+        x = np.stack([secciones[c] + peso * medicamentos[m] + 0.3 * rng.normal(size=d) for m, c in pares])
+        return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+    return embed([(f["medicamento"], f["categoria"]) for f in fragments], 0.3), embed([q[3] for q in queries], 0.15)
+
+
+# Función para calcular el acierto y el recall de una lista de resultados
+def _metricas(ids, relevantes, k):
+    encontrados = len(relevantes & set(int(i) for i in ids[:k]))
+    return encontrados > 0, encontrados / min(len(relevantes), k)
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la búsqueda híbrida BM25 + FAISS")
+    parser.add_argument("--num-drugs", type=int, default=2000)
+    parser.add_argument("--num-queries", type=int, default=600)
+    parser.add_argument("--model-name", default="llama2", choices=list(RETRIEVAL_K))
+    parser.add_argument("--no-encoder", action="store_true", help="Usa embeddings sintéticos")
+    args = parser.parse_args()
+    k = RETRIEVAL_K[args.model_name]
+
+    fragments, queries = synthetic_corpus(args.num_drugs, args.num_queries)
+    start = time.perf_counter()
+    sparse = BM25Index.build(fragments)
+    print(f"{len(fragments)} fragmentos, {len(sparse.terms)} términos; índice BM25 construido en {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    if args.no_encoder:
+        embeddings, query_embeddings = synthetic_embeddings(fragments, queries)
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        embeddings = embedding_model.encode([f["texto"] for f in fragments], convert_to_numpy=True, batch_size=64)
+        query_embeddings = embedding_model.encode([q[1] for q in queries], convert_to_numpy=True, batch_size=64)
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+
+    metricas = {}
+    tiempos = {"BM25": [], "vectorial": [], "híbrida": []}
+    for (tipo, query, relevantes, _), q in zip(queries, query_embeddings):
+        start = time.perf_counter()
+        densos = retrieve_relevant_fragments(query, None, fragments, index, args.model_name, query_embedding=q)
+        tiempos["vectorial"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        _, lexicos = sparse.search(query, k)
+        tiempos["BM25"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        hibridos = retrieve_relevant_fragments(query, None, fragments, index, args.model_name, query_embedding=q, sparse=sparse)
+        tiempos["híbrida"].append(time.perf_counter() - start)
+
+        for metodo, ids in (("vectorial", [r["id"] for r in densos]), ("BM25", lexicos), ("híbrida", [r["id"] for r in hibridos])):
+            for grupo in (tipo, "todas"):
+                metricas.setdefault((grupo, metodo), []).append(_metricas(ids, relevantes, k))
+
+    print(f"\n{'consultas':>10} | {'búsqueda':>9} | {f'acierto@{k}':>10} | {f'recall@{k}':>9}")
+    for (grupo, metodo), valores in sorted(metricas.items(), key=lambda x: x[0][0] == "todas"):
+        aciertos, recall = np.mean(valores, axis=0)
+        print(f"{grupo:>10} | {metodo:>9} | {aciertos:>10.1%} | {recall:>9.1%}")
+
+    print(f"\n{'búsqueda':>9} | {'p50 (ms)':>8} | {'p99 (ms)':>8}")
+    for metodo, valores in tiempos.items():
+        print(f"{metodo:>9} | {percentile(valores, 50) * 1000:>8.3f} | {percentile(valores, 99) * 1000:>8.3f}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
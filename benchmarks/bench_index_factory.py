@@ -0,0 +1,44 @@
+# bench_index_factory.py
+"""
+Benchmark de las configuraciones de índice FAISS (`src/index_factory.py`) a medida que crece el corpus. Genera embeddings sintéticos agrupados (como los de fragmentos de un mismo medicamento) de la dimensión de all-MiniLM-L6-v2 para varios tamaños y compara cada configuración con la búsqueda exacta: recall@k, consultas por segundo, tiempo de construcción y tamaño del índice.
+
+Con `--embeddings` se usan los embeddings reales del corpus en lugar de los sintéticos.
+
+Uso:
+    python benchmarks/bench_index_factory.py [--sizes 10000 50000] [--embeddings RUTA] [--param nprobe=1,8,32]
+"""
+
+# Librerías
+import argparse
+
+import numpy as np
+
+from common import clustered_embeddings
+from index_factory import compare_indexes, print_report, sample_queries, parse_param_grid
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de configuraciones de índice FAISS")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--embeddings", default=None, help="Embeddings reales (.npy); por defecto, sintéticos")
+    parser.add_argument(
+        "--factories", nargs="+",
+        default=["Flat", "IVF{nlist},Flat", "IVF{nlist},PQ48", "OPQ48,IVF{nlist},PQ48", "HNSW32", "SQ8"],
+    )
+    parser.add_argument("--param", action="append", default=None, help="Valores a probar, ej. nprobe=1,8,32")
+    parser.add_argument("--num-queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    grid = parse_param_grid(args.param or ["nprobe=4,16,64", "efSearch=32,128"])
+    corpora = [np.load(args.embeddings).astype(np.float32)] if args.embeddings else [clustered_embeddings(n) for n in args.sizes]
+    for embeddings in corpora:
+        print(f"\nCorpus de {len(embeddings)} vectores de dimensión {embeddings.shape[1]}")
+        queries = sample_queries(embeddings, args.num_queries)
+        print_report(compare_indexes(embeddings, args.factories, grid, queries, args.k), args.k)
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
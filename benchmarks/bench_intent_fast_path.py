@@ -0,0 +1,112 @@
+# bench_intent_fast_path.py
+"""
+Benchmark de la ruta directa para consultas "<sección> de <medicamento>" (`src/query_intent.py`). Sobre un corpus sintético con nombres de medicamentos y las secciones de `extract_secciones`, mide qué fracción de un conjunto de preguntas típicas sigue la ruta directa y compara su latencia de recuperación (reconocimiento + índice hash) con la de la ruta vectorial (embedding de la consulta + búsqueda en FAISS).
+
+Por defecto las consultas se embeben con el modelo de embeddings del chatbot; con `--no-encoder` solo se mide la búsqueda vectorial con embeddings sintéticos.
+
+Uso:
+    python benchmarks/bench_intent_fast_path.py [--num-drugs 2000] [--no-encoder]
+"""
+
+# Librerías
+import time
+import random
+import argparse
+
+import faiss
+
+from common import clustered_embeddings, percentile
+from metadata_filter import MetadataIndex
+from drug_names import DrugNameIndex
+from query_intent import IntentParser, SECTION_PATTERNS
+from utils import retrieve_by_intent, retrieve_relevant_fragments, EMBEDDING_MODEL_NAME
+
+PRINCIPIOS = [
+    "ibuprofeno", "paracetamol", "amoxicilina", "omeprazol", "metformina", "diazepam", "enalapril",
+    "simvastatina", "atorvastatina", "lorazepam", "tramadol", "sertralina", "losartan", "furosemida",
+]
+LABORATORIOS = ["normon", "cinfa", "kern", "sandoz", "teva", "stada", "mylan", "aurobindo", "pensa", "ratiopharm"]
+
+# Preguntas de ejemplo: (plantilla, ¿se espera ruta directa?)
+PREGUNTAS = [
+    ("¿cuáles son las reacciones adversas del {}?", True),
+    ("¿puedo conducir si tomo {}?", True),
+    ("¿qué dosis de {} debo tomar?", True),
+    ("¿se puede tomar {} durante el embarazo?", True),
+    ("¿cuáles son las contraindicaciones de {}?", True),
+    ("¿qué hacer en caso de sobredosis de {}?", True),
+    ("¿cómo se conserva el {}?", False),
+    ("¿es mejor el {} o el {}?", False),
+    ("me duele la cabeza, ¿qué puedo tomar?", False),
+]
+
+
+# Función para generar fragmentos con nombres de medicamentos y secciones
+def synthetic_corpus(num_drugs, seed=0):
+    rng = random.Random(seed)
+    nombres = sorted({f"{rng.choice(PRINCIPIOS)} {rng.choice(LABORATORIOS)} {rng.choice([10, 20, 40, 400, 600])}" for _ in range(num_drugs)})
+    return [
+        {"medicamento": nombre, "categoria": categoria, "texto": f"{categoria} de {nombre}"}
+        for nombre in nombres
+        for categoria in SECTION_PATTERNS
+    ]
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la ruta directa por intención")
+    parser.add_argument("--num-drugs", type=int, default=2000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--no-encoder", action="store_true", help="Usa embeddings sintéticos para las consultas")
+    args = parser.parse_args()
+
+    fragments = synthetic_corpus(args.num_drugs)
+    start = time.perf_counter()
+    intents = IntentParser(MetadataIndex(fragments), DrugNameIndex.build(fragments))
+    print(f"{len(fragments)} fragmentos; reconocedor construido en {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    if args.no_encoder:
+        embedding_model = None
+        d = 384
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        d = embedding_model.get_sentence_embedding_dimension()
+    index = faiss.IndexFlatL2(d)
+    index.add(clustered_embeddings(len(fragments), d))
+    sinteticos = clustered_embeddings(args.num_queries, d, seed=1)
+
+    rng = random.Random(1)
+    directa, vectorial, aciertos = [], [], 0
+    for i in range(args.num_queries):
+        plantilla, esperada = PREGUNTAS[i % len(PREGUNTAS)]
+        fragmento = rng.choice(fragments)
+        query = plantilla.format(*rng.sample([fragmento["medicamento"], fragmento["medicamento"].split()[0], rng.choice(PRINCIPIOS)], plantilla.count("{}")))
+
+        start = time.perf_counter()
+        intent = intents.parse(query)
+        resultados = retrieve_by_intent(intent, fragments, intents, "llama2") if intent else []
+        t_directa = time.perf_counter() - start
+        aciertos += bool(resultados) == esperada
+
+        start = time.perf_counter()
+        retrieve_relevant_fragments(
+            query, embedding_model, fragments, index, "llama2",
+            query_embedding=sinteticos[i] if args.no_encoder else None,
+        )
+        t_vectorial = time.perf_counter() - start
+        if resultados:
+            directa.append(t_directa)
+            vectorial.append(t_vectorial)
+
+    print(f"Ruta directa: {len(directa)}/{args.num_queries} consultas; {aciertos}/{args.num_queries} con la ruta esperada")
+    print(f"{'ruta':>10} | {'p50 (ms)':>8} | {'p99 (ms)':>8}")
+    for nombre, tiempos in (("directa", directa), ("vectorial", vectorial)):
+        if tiempos:
+            print(f"{nombre:>10} | {percentile(tiempos, 50) * 1000:>8.3f} | {percentile(tiempos, 99) * 1000:>8.3f}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
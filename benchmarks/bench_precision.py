@@ -0,0 +1,154 @@
+# bench_precision.py
+"""
+Benchmark de los modos de precisión en CPU (`src/precision.py`). Para cada modo carga el modelo en un proceso nuevo y mide la memoria residente añadida por el modelo, el tiempo de carga, los tokens/s de generación greedy y la concordancia de las respuestas con las de float32 sobre un conjunto fijo de preguntas:
+
+- exactas: fracción de respuestas idénticas a las de float32.
+- concordancia: fracción media de tokens generados antes de la primera divergencia.
+
+Por defecto usa un Llama pequeño de pesos aleatorios (mide memoria y velocidad, la concordancia no es representativa); con `--model meta-llama/Llama-2-7b-chat-hf` usa el modelo real.
+
+Uso:
+    python benchmarks/bench_precision.py [--model NOMBRE] [--modes float32 bfloat16 int8 int4] [--max-new-tokens 64]
+"""
+
+# Librerías
+import gc
+import os
+import ctypes
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+
+from common import tiny_llama, load_tokenizer
+from precision import CPU_PRECISIONS
+
+# Conjunto fijo de preguntas
+PREGUNTAS = [
+    "¿Para qué se utiliza el ibuprofeno?",
+    "¿Cuáles son las contraindicaciones del omeprazol?",
+    "¿Qué reacciones adversas tiene el paracetamol?",
+    "¿Se puede tomar amoxicilina durante el embarazo?",
+    "¿Cuál es la dosis recomendada de metformina?",
+    "¿Qué interacciones tiene la warfarina con otros medicamentos?",
+    "¿Cómo se debe conservar la insulina?",
+    "¿Qué hacer en caso de sobredosis de diazepam?",
+]
+
+
+# Función para obtener la memoria residente del proceso (en bytes)
+def rss_bytes():
+    """
+    Memoria residente del proceso. Antes de medir se devuelve al sistema la memoria liberada
+    (malloc_trim en Linux), para no contar los buffers temporales de la conversión de pesos.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+# Función que se ejecuta en un proceso nuevo para cada modo
+def _run_mode(model_id, precision, prompts, max_new_tokens, queue):
+    import torch
+    import transformers  # noqa: F401 (importado antes de medir la memoria base)
+    from precision import load_cpu_model
+
+    torch.manual_seed(0)
+    base = rss_bytes()
+    start = time.perf_counter()
+    model = load_cpu_model(model_id, precision)
+    load_s = time.perf_counter() - start
+
+    salidas, nuevos, gen_s = [], 0, 0.0
+    with torch.no_grad():
+        for ids in prompts:
+            input_ids = torch.tensor([ids])
+            start = time.perf_counter()
+            out = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=model.config.eos_token_id,
+            )
+            gen_s += time.perf_counter() - start
+            generados = out[0, input_ids.shape[1]:].tolist()
+            salidas.append(generados)
+            nuevos += len(generados)
+    # Se mide tras generar: los pesos abiertos con mmap solo son residentes una vez usados
+    rss = rss_bytes() - base
+    queue.put({"rss_gb": rss / 1e9, "load_s": load_s, "tokens_s": nuevos / gen_s, "salidas": salidas})
+
+
+# Función para comparar las respuestas con las de referencia
+def agreement(salidas, referencia):
+    """Devuelve (fracción de respuestas idénticas, fracción media de tokens antes de divergir)."""
+    exactas, prefijos = 0, []
+    for out, ref in zip(salidas, referencia):
+        exactas += out == ref
+        comun = 0
+        for a, b in zip(out, ref):
+            if a != b:
+                break
+            comun += 1
+        prefijos.append(comun / max(len(ref), 1))
+    return exactas / len(referencia), sum(prefijos) / len(prefijos)
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los modos de precisión en CPU")
+    parser.add_argument("--model", default=None, help="Modelo de Hugging Face (por defecto, Llama pequeño aleatorio)")
+    parser.add_argument("--modes", nargs="+", default=list(CPU_PRECISIONS), choices=list(CPU_PRECISIONS))
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    from utils import build_prompt
+
+    tmp = None
+    if args.model:
+        model_id = args.model
+        tokenizer = load_tokenizer(args.model)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        model_id = tmp.name
+        tiny_llama(hidden_size=1024, num_layers=8, num_heads=16).save_pretrained(model_id)
+        tokenizer = load_tokenizer(texts=PREGUNTAS)
+    prompts = [tokenizer(build_prompt("", q, "llama2"))["input_ids"] for q in PREGUNTAS]
+
+    # Cada modo en un proceso nuevo para medir su memoria sin interferencias
+    ctx = mp.get_context("spawn")
+    resultados = {}
+    for precision in ["float32"] + [m for m in args.modes if m != "float32"]:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_mode, args=(model_id, precision, prompts, args.max_new_tokens, queue))
+        proc.start()
+        try:
+            resultados[precision] = queue.get()
+        finally:
+            proc.join()
+
+    referencia = resultados["float32"]["salidas"]
+    print(f"\n{'modo':>9} | {'RSS (GB)':>8} | {'carga (s)':>9} | {'tokens/s':>8} | {'exactas':>7} | {'concordancia':>12}")
+    for precision, r in resultados.items():
+        exactas, concordancia = agreement(r["salidas"], referencia)
+        print(
+            f"{precision:>9} | {r['rss_gb']:>8.2f} | {r['load_s']:>9.2f} | {r['tokens_s']:>8.1f} | "
+            f"{exactas:>7.0%} | {concordancia:>12.0%}"
+        )
+    if tmp is not None:
+        tmp.cleanup()
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# bench_prefix_cache.py
+"""
+Benchmark de la caché KV del prefijo fijo del prompt (`src/prefix_cache.py`). Mide en CPU la latencia de prefill (hasta obtener los logits del primer token) con y sin la caché del prefijo, para varios tamaños del contexto recuperado.
+
+Por defecto usa un Llama pequeño de pesos aleatorios y longitudes de prompt sintéticas; con `--model meta-llama/Llama-2-7b-chat-hf` usa el modelo real y el prefijo real de `build_prompt_parts`.
+
+Uso:
+    python benchmarks/bench_prefix_cache.py [--prefix-tokens 700] [--suffix-tokens 200 800 1600]
+"""
+
+# Librerías
+import random
+import argparse
+
+import torch
+
+from common import tiny_llama, timeit, percentile
+from prefix_cache import PrefixKVCache
+
+
+# Función para medir el prefill con y sin la caché del prefijo
+def bench(model, prefix_cache, suffix_ids, repeats):
+    prompt = torch.tensor([prefix_cache.prefix_ids + suffix_ids])
+    suffix = torch.tensor([suffix_ids])
+    n = prompt.shape[1]
+
+    def sin_cache():
+        with torch.no_grad():
+            model(input_ids=prompt, use_cache=True)
+
+    def con_cache():
+        # La copia de la caché forma parte del coste real de cada consulta
+        past = prefix_cache.copy()
+        with torch.no_grad():
+            model(
+                input_ids=suffix,
+                attention_mask=torch.ones(1, n, dtype=torch.long),
+                past_key_values=past,
+                use_cache=True,
+            )
+
+    sin_cache(), con_cache()  # Calentamiento
+    return timeit(sin_cache, repeats), timeit(con_cache, repeats)
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la caché KV del prefijo del prompt")
+    parser.add_argument("--model", default=None, help="Modelo de Hugging Face (por defecto, Llama pequeño aleatorio)")
+    parser.add_argument("--prefix-tokens", type=int, default=700, help="Tokens del prefijo sintético")
+    parser.add_argument("--suffix-tokens", type=int, nargs="+", default=[200, 800, 1600])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    if args.model:
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+        from utils import LLAMA2_PROMPT_PREFIX
+
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32).eval()
+        prefix_cache = PrefixKVCache(model, tokenizer, LLAMA2_PROMPT_PREFIX)
+        vocab = tokenizer.vocab_size
+    else:
+        model = tiny_llama()
+        vocab = model.config.vocab_size
+
+        class _Tok:
+            # Tokenizador mínimo que devuelve un prefijo sintético de la longitud pedida
+            def __call__(self, text, add_special_tokens=True):
+                return {"input_ids": [1] + [rng.randrange(3, vocab) for _ in range(args.prefix_tokens - 1)]}
+
+        prefix_cache = PrefixKVCache(model, _Tok(), "prefijo")
+
+    print(f"Tokens del prefijo: {len(prefix_cache)}")
+    print(f"{'tokens sufijo':>14} {'sin caché ms':>13} {'con caché ms':>13} {'speedup':>8}")
+    for n in args.suffix_tokens:
+        suffix_ids = [rng.randrange(3, vocab) for _ in range(n)]
+        sin, con = bench(model, prefix_cache, suffix_ids, args.repeats)
+        p50_sin, p50_con = percentile(sin, 50) * 1000, percentile(con, 50) * 1000
+        print(f"{n:>14} {p50_sin:>13.1f} {p50_con:>13.1f} {p50_sin / p50_con:>7.2f}x")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
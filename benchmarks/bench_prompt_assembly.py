@@ -0,0 +1,79 @@
+# bench_prompt_assembly.py
+"""
+Benchmark del ensamblado del prompt (`src/fragment_tokens.py`). Compara, por consulta, el tiempo de construir los ids del prompt por el camino actual (formatear el contexto en texto dentro del presupuesto de tokens y tokenizar el prompt completo) con el camino pre-tokenizado (concatenar los ids guardados de cada fragmento).
+
+Por defecto usa fragmentos sintéticos y un tokenizador BPE local; con `--tokenizer meta-llama/Llama-2-7b-chat-hf` y `--fragments` usa el tokenizador y el corpus reales.
+
+Uso:
+    python benchmarks/bench_prompt_assembly.py [--tokenizer NOMBRE] [--fragments RUTA] [--k 10]
+"""
+
+# Librerías
+import random
+import argparse
+
+from common import load_tokenizer, synthetic_fragments, timeit, percentile
+from fragment_tokens import FragmentTokenStore, PromptAssembler
+from prefix_cache import encode_prompt_parts
+from utils import (
+    load_json,
+    format_context,
+    build_prompt_parts,
+    pack_context_ids,
+    build_prompt_ids,
+    MODEL_MAX_CONTEXT,
+)
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del ensamblado del prompt")
+    parser.add_argument("--tokenizer", default=None, help="Tokenizador de Hugging Face (por defecto, BPE local)")
+    parser.add_argument("--fragments", default=None, help="JSON de fragmentos (por defecto, sintéticos)")
+    parser.add_argument("--num-fragments", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10, help="Fragmentos recuperados por consulta")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--model-name", default="llama2", choices=list(MODEL_MAX_CONTEXT))
+    args = parser.parse_args()
+
+    fragments = load_json(args.fragments) if args.fragments else synthetic_fragments(args.num_fragments)
+    for i, frag in enumerate(fragments):
+        frag["id"] = i
+    tokenizer = load_tokenizer(args.tokenizer, texts=[f["texto"] for f in fragments[:500]])
+    budget = MODEL_MAX_CONTEXT[args.model_name] - 1200  # presupuesto aproximado para el contexto
+
+    store = FragmentTokenStore.build([f["texto"] for f in fragments], tokenizer)
+    assembler = PromptAssembler(tokenizer, store)
+    print(f"Almacén: {len(store)} fragmentos, {len(store.ids)} tokens, {store.nbytes / 1e6:.1f} MB")
+
+    rng = random.Random(0)
+    consultas = [
+        (f"¿Cuáles son las contraindicaciones del medicamento {rng.randrange(100)}?", rng.sample(fragments, args.k))
+        for _ in range(args.queries)
+    ]
+
+    def texto():
+        for query, retrieved in consultas:
+            context = format_context(retrieved, tokenizer=tokenizer, token_budget=budget)
+            prefix, suffix = build_prompt_parts(context, query, args.model_name)
+            encode_prompt_parts(tokenizer, prefix, suffix)
+
+    def ids():
+        for query, retrieved in consultas:
+            context_ids = pack_context_ids(retrieved, assembler, budget, max_fragments=10)
+            build_prompt_ids(assembler, context_ids, query, args.model_name)
+
+    texto(), ids()  # Calentamiento
+    resultados = {"texto (actual)": timeit(texto), "ids pre-tokenizados": timeit(ids)}
+
+    print(f"\n{'camino':>22} | {'ms/consulta p50':>15} | {'p95':>8}")
+    for nombre, tiempos in resultados.items():
+        por_consulta = [t / args.queries * 1000 for t in tiempos]
+        print(f"{nombre:>22} | {percentile(por_consulta, 50):>15.2f} | {percentile(por_consulta, 95):>8.2f}")
+    base, nuevo = (percentile([t / args.queries for t in v], 50) for v in resultados.values())
+    print(f"\nAceleración: {base / nuevo:.1f}x")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# bench_prompt_lookup.py
+"""
+Benchmark de la decodificación especulativa por búsqueda en el prompt (`src/speculative.py`). Para cada pregunta genera la respuesta con `model.generate` voraz y con `prompt_lookup_generate`, comprueba que las salidas son idénticas y mide la tasa de aceptación del borrador, los tokens por pasada del modelo y la aceleración real de la decodificación.
+
+Por defecto usa un Llama pequeño de pesos aleatorios, que no copia el contexto como un modelo entrenado: las tasas de aceptación solo son representativas con `--model meta-llama/Llama-2-7b-chat-hf` y `--fragments` (corpus real).
+
+Uso:
+    python benchmarks/bench_prompt_lookup.py [--model NOMBRE] [--fragments RUTA] [--max-new-tokens 128]
+"""
+
+# Librerías
+import time
+import random
+import argparse
+
+import torch
+
+from common import tiny_llama, load_tokenizer, synthetic_fragments
+from speculative import prompt_lookup_generate
+from utils import load_json, format_context, build_prompt
+
+# Preguntas de ejemplo
+PREGUNTAS = [
+    "¿Cuáles son las contraindicaciones de este medicamento?",
+    "¿Qué reacciones adversas se han descrito?",
+    "¿Cuál es la posología recomendada?",
+    "¿Está indicado durante el embarazo?",
+]
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la decodificación por búsqueda en el prompt")
+    parser.add_argument("--model", default=None, help="Modelo de Hugging Face (por defecto, Llama pequeño aleatorio)")
+    parser.add_argument("--fragments", default=None, help="JSON de fragmentos (por defecto, sintéticos)")
+    parser.add_argument("--k", type=int, default=3, help="Fragmentos en el contexto de cada pregunta")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--ngram-size", type=int, default=3)
+    parser.add_argument("--num-draft-tokens", type=int, default=10)
+    parser.add_argument("--repetition-penalty", type=float, default=1.2)
+    args = parser.parse_args()
+
+    fragments = load_json(args.fragments) if args.fragments else synthetic_fragments(200, max_words=150)
+    if args.model:
+        from transformers import AutoModelForCausalLM
+
+        tokenizer = load_tokenizer(args.model)
+        model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.bfloat16).eval()
+    else:
+        tokenizer = load_tokenizer(texts=[f["texto"] for f in fragments])
+        model = tiny_llama(vocab_size=len(tokenizer))
+
+    rng = random.Random(0)
+    print(f"{'pregunta':>8} | {'tokens':>6} | {'aceptación':>10} | {'tokens/pasada':>13} | {'voraz (s)':>9} | {'lookup (s)':>10} | {'aceleración':>11} | idéntica")
+    total_ref = total_pl = 0.0
+    for i, pregunta in enumerate(PREGUNTAS):
+        context = format_context(rng.sample(fragments, args.k))
+        input_ids = torch.tensor([tokenizer(build_prompt(context, pregunta, "llama2"))["input_ids"]])
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            ref = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=args.max_new_tokens,
+                do_sample=False,
+                repetition_penalty=args.repetition_penalty,
+                eos_token_id=tokenizer.eos_token_id,
+                pad_token_id=tokenizer.eos_token_id,
+            )
+        t_ref = time.perf_counter() - start
+
+        stats = {}
+        start = time.perf_counter()
+        out = prompt_lookup_generate(
+            model,
+            input_ids,
+            max_new_tokens=args.max_new_tokens,
+            eos_token_id=tokenizer.eos_token_id,
+            repetition_penalty=args.repetition_penalty,
+            ngram_size=args.ngram_size,
+            num_draft_tokens=args.num_draft_tokens,
+            stats=stats,
+        )
+        t_pl = time.perf_counter() - start
+        total_ref += t_ref
+        total_pl += t_pl
+
+        print(
+            f"{i:>8} | {stats['new_tokens']:>6} | {stats['accept_rate']:>10.0%} | {stats['tokens_per_pass']:>13.2f} | "
+            f"{t_ref:>9.2f} | {t_pl:>10.2f} | {t_ref / t_pl:>10.2f}x | {torch.equal(ref, out)}"
+        )
+    print(f"\nAceleración total: {total_ref / total_pl:.2f}x")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
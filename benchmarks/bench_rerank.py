@@ -0,0 +1,120 @@
+# bench_rerank.py
+"""
+Benchmark de la reordenación con cross-encoder (`src/reranker.py`). Compara el tiempo que añade puntuar RERANK_POOL candidatos en una pasada por lotes (sin caché y con las puntuaciones en caché) con el tiempo de prefill que ahorra enviar al LLM RERANK_TOP_N fragmentos en lugar de los 10 habituales, y mide el acierto (algún fragmento relevante en el contexto) de cada opción sobre las consultas etiquetadas de `bench_hybrid_search.py`.
+
+Por defecto se usan el cross-encoder del chatbot y un Llama pequeño de pesos aleatorios con la arquitectura de Llama-2 (el prefill escala igual con el número de tokens); con `--llm` se mide el prefill de un modelo real. Con `--random-reranker` el cross-encoder es un BERT pequeño de pesos aleatorios, que no sirve para medir el acierto. Con los dos modelos aleatorios, que tienen un tamaño parecido, los tiempos solo prueban el camino del código: la comparación que importa es la del cross-encoder real frente al prefill del LLM real (`--llm`), que es mucho más caro por token.
+
+Uso:
+    python benchmarks/bench_rerank.py [--reranker NOMBRE | --random-reranker] [--llm meta-llama/Llama-2-7b-chat-hf] [--num-queries 30]
+"""
+
+# Librerías
+import time
+import argparse
+
+import faiss
+import numpy as np
+import torch
+
+from common import load_tokenizer, tiny_llama, synthetic_fragments, percentile
+from bench_hybrid_search import synthetic_corpus, synthetic_embeddings
+from reranker import CrossEncoderReranker, RERANK_MODEL, RERANK_POOL, RERANK_TOP_N
+from utils import retrieve_relevant_fragments, format_context, build_prompt, RETRIEVAL_K
+
+
+# Función para crear un cross-encoder BERT pequeño con pesos aleatorios
+def tiny_cross_encoder(tokenizer, hidden_size=128, num_layers=2, seed=0):
+    from transformers import BertConfig, BertForSequenceClassification
+
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, num_hidden_layers=num_layers, num_attention_heads=4,
+        intermediate_size=hidden_size * 4, max_position_embeddings=512, num_labels=1,
+    )
+    return BertForSequenceClassification(config)
+
+
+# Función para medir el prefill de un prompt
+def _prefill(model, tokenizer, prompt, repeats):
+    ids = tokenizer(prompt, return_tensors="pt")["input_ids"].to(model.device)
+    tiempos = []
+    with torch.inference_mode():
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(ids, use_cache=True)
+            tiempos.append(time.perf_counter() - start)
+    return percentile(tiempos, 50), ids.shape[-1]
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la reordenación con cross-encoder")
+    parser.add_argument("--reranker", default=RERANK_MODEL)
+    parser.add_argument("--random-reranker", action="store_true", help="BERT pequeño de pesos aleatorios (solo tiempos)")
+    parser.add_argument("--llm", default=None, help="LLM de Hugging Face para el prefill (por defecto, Llama pequeño aleatorio)")
+    parser.add_argument("--num-drugs", type=int, default=500)
+    parser.add_argument("--num-queries", type=int, default=30)
+    parser.add_argument("--pool", type=int, default=RERANK_POOL)
+    parser.add_argument("--top-n", type=int, default=RERANK_TOP_N)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    k = RETRIEVAL_K["llama2"]
+
+    fragments, queries = synthetic_corpus(args.num_drugs, args.num_queries)
+    embeddings, query_embeddings = synthetic_embeddings(fragments, queries)
+    for frag, extra in zip(fragments, synthetic_fragments(len(fragments), min_words=60, max_words=250)):
+        frag["texto"] = f"{frag['texto']}. {extra['texto']}"
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+
+    if args.random_reranker:
+        tokenizer = load_tokenizer(None, [frag["texto"] for frag in fragments[:2000]])
+        tokenizer.pad_token = tokenizer.eos_token
+        reranker = CrossEncoderReranker("aleatorio", model=tiny_cross_encoder(tokenizer), tokenizer=tokenizer)
+    else:
+        reranker = CrossEncoderReranker(args.reranker)
+    if args.llm:
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        llm_tokenizer = AutoTokenizer.from_pretrained(args.llm)
+        llm = AutoModelForCausalLM.from_pretrained(args.llm, torch_dtype="auto", device_map="auto").eval()
+    else:
+        llm_tokenizer = load_tokenizer(None, [frag["texto"] for frag in fragments[:2000]], vocab_size=32000)
+        llm = tiny_llama(vocab_size=len(llm_tokenizer))
+
+    medidas = {"rerank": [], "rerank (caché)": [], "prefill top-10": [], "prefill rerank": []}
+    tokens = {"prefill top-10": [], "prefill rerank": []}
+    aciertos = {"FAISS top-10": [], f"FAISS top-{args.top_n}": [], f"rerank top-{args.top_n}": []}
+    for (_, query, relevantes, _), q in zip(queries, query_embeddings):
+        candidatos = retrieve_relevant_fragments(query, None, fragments, index, "llama2", query_embedding=q, k=args.pool, adaptive=False)
+        reranker.clear()
+        for nombre in ("rerank", "rerank (caché)"):
+            stats = {}
+            mejores = reranker.rerank(query, candidatos, args.top_n, stats)
+            medidas[nombre].append(stats["s"])
+
+        for nombre, contexto in (("prefill top-10", candidatos[:k]), ("prefill rerank", mejores)):
+            prefill_s, n_tokens = _prefill(llm, llm_tokenizer, build_prompt(format_context(contexto), query), args.repeats)
+            medidas[nombre].append(prefill_s)
+            tokens[nombre].append(n_tokens)
+        for nombre, contexto in zip(aciertos, (candidatos[:k], candidatos[:args.top_n], mejores)):
+            aciertos[nombre].append(bool(relevantes & {f["id"] for f in contexto}))
+
+    print(f"{len(fragments)} fragmentos, {len(queries)} consultas; {args.pool} candidatos -> {args.top_n} fragmentos")
+    print(f"{'etapa':>15} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'tokens':>6}")
+    for nombre, tiempos in medidas.items():
+        n_tokens = f"{np.mean(tokens[nombre]):.0f}" if nombre in tokens else "-"
+        print(f"{nombre:>15} | {percentile(tiempos, 50) * 1000:>8.1f} | {percentile(tiempos, 99) * 1000:>8.1f} | {n_tokens:>6}")
+    ahorro = np.median(np.array(medidas["prefill top-10"]) - np.array(medidas["prefill rerank"]))
+    print(
+        f"\nReordenación: +{np.median(medidas['rerank']) * 1000:.1f} ms (+{np.median(medidas['rerank (caché)']) * 1000:.2f} ms con caché); "
+        f"prefill ahorrado: {ahorro * 1000:.1f} ms"
+    )
+    print(f"\n{'contexto':>15} | {'acierto':>7}")
+    for nombre, valores in aciertos.items():
+        print(f"{nombre:>15} | {np.mean(valores):>7.1%}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# common.py
+"""
+Utilidades compartidas por los benchmarks: acceso a los módulos de `src`, modelos Llama de pesos aleatorios (para medir rendimiento sin descargar Llama-2) y cálculo de percentiles.
+"""
+
+# Librerías
+import os
+import sys
+import time
+import random
+
+# Agrega la ruta del directorio donde están las funciones del chatbot
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+
+
+# Función para crear un modelo Llama pequeño con pesos aleatorios
+def tiny_llama(hidden_size=256, num_layers=4, num_heads=8, vocab_size=32000, seed=0):
+    """
+    Crea un LlamaForCausalLM con pesos aleatorios y la misma arquitectura que Llama-2
+    (a escala reducida) para medir el rendimiento del código de generación en CPU.
+
+    Retorna:
+    - LlamaForCausalLM: modelo en modo evaluación.
+    """
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 4,
+        num_hidden_layers=num_layers,
+        num_attention_heads=num_heads,
+        num_key_value_heads=num_heads,
+        max_position_embeddings=4096,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+# Función para generar prompts aleatorios (ids de tokens)
+def random_prompts(n, min_len=32, max_len=128, vocab_size=32000, seed=0):
+    """Devuelve n listas de ids de tokens de longitud aleatoria."""
+    rng = random.Random(seed)
+    return [[rng.randrange(3, vocab_size) for _ in range(rng.randint(min_len, max_len))] for _ in range(n)]
+
+
+# Función para calcular un percentil de una lista de valores
+def percentile(values, q):
+    """Percentil q (0-100) por interpolación lineal."""
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    pos = (len(values) - 1) * q / 100
+    lo, hi = int(pos), min(int(pos) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+# Función para medir el tiempo de una función
+def timeit(fn, repeats=5):
+    """Ejecuta fn `repeats` veces y devuelve la lista de tiempos en segundos."""
+    tiempos = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - start)
+    return tiempos
+
+
+# Palabras para generar fragmentos sintéticos con el aspecto de los del corpus
+_PALABRAS = (
+    "el medicamento está indicado para el tratamiento de la hipertensión arterial en adultos "
+    "no debe administrarse durante el embarazo ni en pacientes con insuficiencia renal grave "
+    "las reacciones adversas más frecuentes son cefalea náuseas mareo y dolor abdominal "
+    "la dosis recomendada es de un comprimido al día con o sin alimentos"
+).split()
+
+
+# Función para generar fragmentos sintéticos
+def synthetic_fragments(n, min_words=80, max_words=400, seed=0):
+    """Devuelve n fragmentos con la estructura de `contexto_medicamentos_chatbot.json`."""
+    rng = random.Random(seed)
+    categorias = ["Indicaciones", "Contraindicaciones", "Posología", "Reacciones adversas"]
+    return [
+        {
+            "id": i,
+            "medicamento": f"MEDICAMENTO {i} 10 mg comprimidos",
+            "categoria": rng.choice(categorias),
+            "texto": " ".join(rng.choice(_PALABRAS) for _ in range(rng.randint(min_words, max_words))),
+        }
+        for i in range(n)
+    ]
+
+
+# Función para cargar un tokenizador rápido
+def load_tokenizer(name=None, texts=None, vocab_size=8000):
+    """
+    Carga el tokenizador `name` de Hugging Face. Si no se indica (o no está disponible sin
+    conexión), entrena un tokenizador BPE local sobre `texts` para poder medir sin descargas.
+
+    Retorna:
+    - PreTrainedTokenizerFast: tokenizador con BOS/EOS.
+    """
+    from transformers import AutoTokenizer, PreTrainedTokenizerFast
+
+    if name:
+        try:
+            return AutoTokenizer.from_pretrained(name, use_fast=True)
+        except OSError as e:
+            print(f"No se pudo cargar {name} ({e}); se usa un tokenizador BPE local")
+
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers, processors
+
+    tok = Tokenizer(models.BPE(unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.Metaspace()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=["<unk>", "<s>", "</s>"])
+    tok.train_from_iterator(texts or _PALABRAS, trainer=trainer)
+    tok.post_processor = processors.TemplateProcessing(
+        single="<s> $A", special_tokens=[("<s>", tok.token_to_id("<s>"))]
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tok, bos_token="<s>", eos_token="</s>", unk_token="<unk>", name_or_path="bpe-local"
+    )
+
+
+# Función para generar embeddings sintéticos agrupados
+def clustered_embeddings(n, d=384, num_clusters=None, spread=2.0, seed=0):
+    """Embeddings normalizados alrededor de centros aleatorios (~un centro por cada 50 vectores)."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    num_clusters = num_clusters or max(n // 50, 1)
+    centros = rng.normal(size=(num_clusters, d))
+    x = centros[rng.integers(0, num_clusters, n)] + spread * rng.normal(size=(n, d))
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x.astype(np.float32)
@@ -0,0 +1,392 @@
+# answer_cache.py
+"""
+Caché de respuestas del chatbot en dos niveles, delante de la generación con el LLM:
+
+1. Exacto: clave = consulta normalizada + modelo + ids de los fragmentos recuperados.
+2. Semántico: vecino más cercano entre los embeddings de consultas anteriores, aceptado si la similitud coseno supera un umbral configurable y los fragmentos recuperados para la consulta coinciden con los de la respuesta guardada (mismo fragmento más cercano o índice de Jaccard suficiente). Así dos consultas casi iguales sobre medicamentos distintos ("dosis de ibuprofeno" / "dosis de paracetamol") no comparten respuesta.
+
+Ambos niveles tienen caducidad (TTL) y tamaño máximo con expulsión LRU, se guardan en disco en segundo plano para sobrevivir a reinicios y se vacían si cambia la versión del índice FAISS o del corpus de fragmentos.
+"""
+
+# Librerías
+import os
+import re
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# Ruta por defecto de la caché en disco
+ANSWER_CACHE_DIR = "./data/outputs/5_chatbot/answer_cache"
+
+# Filas iniciales de la matriz de embeddings del nivel semántico (crece al doble al llenarse)
+_INITIAL_CAPACITY = 256
+
+
+# Función para normalizar una consulta
+def normalize_query(query):
+    """
+    Normaliza una consulta para la comparación exacta: minúsculas, sin tildes, sin signos
+    de puntuación y con los espacios colapsados.
+    """
+    query = unicodedata.normalize("NFKD", query.lower())
+    query = "".join(c for c in query if not unicodedata.combining(c))
+    query = re.sub(r"[^\w\s]", " ", query)
+    return re.sub(r"\s+", " ", query).strip()
+
+
+# Función para comprobar que dos consultas se responden con los mismos fragmentos
+def fragments_overlap(cached_ids, fragment_ids, min_overlap=0.5):
+    """
+    Indica si los fragmentos de una respuesta guardada sirven para la consulta actual: mismo
+    fragmento más cercano o índice de Jaccard de los dos conjuntos de ids >= min_overlap.
+    """
+    if not cached_ids or not fragment_ids:
+        return False
+    if cached_ids[0] == fragment_ids[0]:
+        return True
+    a, b = set(cached_ids), set(fragment_ids)
+    return len(a & b) / len(a | b) >= min_overlap
+
+
+# Función para calcular la versión del corpus a partir de los ficheros de recuperación
+def corpus_version(*paths):
+    """
+    Huella de la versión del corpus: ruta, tamaño y fecha de modificación de cada fichero.
+    Si se reconstruye el índice o el JSON de fragmentos, la huella cambia.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        st = os.stat(path) if os.path.exists(path) else None
+        h.update(f"{path}:{st.st_size if st else -1}:{st.st_mtime_ns if st else -1}".encode())
+    return h.hexdigest()[:16]
+
+
+class AnswerCache:
+    """
+    Caché de respuestas exacta + semántica.
+
+    Parámetros:
+    - cache_dir (str): carpeta donde se persiste la caché (None para no persistir).
+    - version (str): versión del corpus; si no coincide con la guardada, se descarta.
+    - similarity_threshold (float): similitud coseno mínima para un acierto semántico.
+    - min_fragment_overlap (float): índice de Jaccard mínimo entre los fragmentos de la consulta
+      y los de la respuesta guardada para un acierto semántico (ver fragments_overlap).
+    - ttl_seconds (float): caducidad de cada entrada.
+    - max_entries (int): tamaño máximo de cada nivel (expulsión LRU).
+    - save_interval (float): segundos mínimos entre escrituras a disco (en un hilo en segundo plano).
+    """
+
+    def __init__(
+        self,
+        cache_dir=ANSWER_CACHE_DIR,
+        version="",
+        similarity_threshold=0.95,
+        min_fragment_overlap=0.5,
+        ttl_seconds=7 * 24 * 3600,
+        max_entries=10000,
+        save_interval=5.0,
+    ):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.similarity_threshold = similarity_threshold
+        self.min_fragment_overlap = min_fragment_overlap
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+
+        self._lock = threading.RLock()
+        self._exact = OrderedDict()  # clave -> {"answer", "created"}
+        self._semantic = OrderedDict()  # clave -> {"answer", "created", "model_name", "fragment_ids"}
+        # Embeddings normalizados en una matriz reservada por adelantado: cada inserción escribe
+        # una fila; las filas borradas quedan a cero hasta que se compacta la matriz
+        self._sem_matrix = None  # capacidad x d
+        self._sem_keys = []  # clave de cada fila usada (None si está borrada)
+        self._sem_rows = {}  # clave -> fila
+        self._sem_free = 0
+        self._dirty = False
+        self._last_save = 0.0
+        self._saving = False
+        self._save_lock = threading.Lock()
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+        if cache_dir:
+            self._load()
+            atexit.register(self.flush)
+
+    # -------- Claves --------
+
+    @staticmethod
+    def exact_key(query, model_name, fragment_ids):
+        """Clave del nivel exacto: consulta normalizada + modelo + ids de los fragmentos."""
+        ids = ",".join(str(int(i)) for i in fragment_ids)
+        return hashlib.sha256(f"{model_name}|{normalize_query(query)}|{ids}".encode()).hexdigest()
+
+    @staticmethod
+    def _semantic_key(query, model_name):
+        return hashlib.sha256(f"{model_name}|{normalize_query(query)}".encode()).hexdigest()
+
+    # -------- Consulta --------
+
+    def _expired(self, entry, now):
+        return now - entry["created"] > self.ttl_seconds
+
+    def get_exact(self, query, model_name, fragment_ids):
+        """Devuelve la respuesta cacheada para la consulta y fragmentos exactos, o None."""
+        key = self.exact_key(query, model_name, fragment_ids)
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry, time.time()):
+                del self._exact[key]
+                self._dirty = True
+                return None
+            self._exact.move_to_end(key)
+            self.hits["exact"] += 1
+            return entry["answer"]
+
+    def get_semantic(self, query_embedding, model_name, fragment_ids=None):
+        """
+        Busca la consulta anterior más parecida (similitud coseno) del mismo modelo.
+
+        Parámetros:
+        - fragment_ids (list): ids de los fragmentos recuperados para la consulta, por orden; si se
+          indican, solo se aceptan respuestas generadas con fragmentos coincidentes.
+
+        Retorna:
+        - tuple: (respuesta, similitud) si supera el umbral, o (None, mejor similitud).
+        """
+        with self._lock:
+            if not self._sem_rows:
+                return None, 0.0
+            q = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+            q = q / (np.linalg.norm(q) + 1e-12)
+            sims = self._sem_matrix[: len(self._sem_keys)] @ q
+            now = time.time()
+            for row in np.argsort(-sims):
+                sim = float(sims[row])
+                if sim < self.similarity_threshold:
+                    return None, sim
+                key = self._sem_keys[row]
+                if key is None:
+                    continue
+                entry = self._semantic[key]
+                if entry["model_name"] != model_name or self._expired(entry, now):
+                    continue
+                if fragment_ids is not None and not fragments_overlap(
+                    entry.get("fragment_ids"), list(fragment_ids), self.min_fragment_overlap
+                ):
+                    continue
+                self._semantic.move_to_end(key)
+                self.hits["semantic"] += 1
+                return entry["answer"], sim
+            return None, float(sims.max()) if len(sims) else 0.0
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    # -------- Inserción --------
+
+    def put(self, query, model_name, fragment_ids, query_embedding, answer):
+        """Guarda una respuesta en los dos niveles."""
+        now = time.time()
+        with self._lock:
+            key = self.exact_key(query, model_name, fragment_ids)
+            self._exact[key] = {"answer": answer, "created": now}
+            self._exact.move_to_end(key)
+
+            if query_embedding is not None:
+                skey = self._semantic_key(query, model_name)
+                self._semantic[skey] = {
+                    "answer": answer,
+                    "created": now,
+                    "model_name": model_name,
+                    "fragment_ids": [int(i) for i in fragment_ids],
+                }
+                self._semantic.move_to_end(skey)
+                self._set_row(skey, query_embedding)
+
+            self._evict(now)
+            self._dirty = True
+        self._maybe_save()
+
+    def _evict(self, now):
+        """Elimina entradas caducadas y, si se supera el tamaño máximo, las menos usadas."""
+        for key in [k for k, e in self._exact.items() if self._expired(e, now)]:
+            del self._exact[key]
+        while len(self._exact) > self.max_entries:
+            self._exact.popitem(last=False)
+        for key in [k for k, e in self._semantic.items() if self._expired(e, now)]:
+            del self._semantic[key]
+            self._drop_row(key)
+        while len(self._semantic) > self.max_entries:
+            key, _ = self._semantic.popitem(last=False)
+            self._drop_row(key)
+        self._maybe_compact()
+
+    # -------- Matriz del nivel semántico --------
+
+    def _set_row(self, key, embedding):
+        """Escribe el embedding normalizado de `key` en su fila (o en una nueva al final)."""
+        v = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        v = v / (np.linalg.norm(v) + 1e-12)
+        row = self._sem_rows.get(key)
+        if row is None:
+            if self._sem_matrix is None:
+                self._sem_matrix = np.zeros((_INITIAL_CAPACITY, v.shape[0]), dtype=np.float32)
+            elif len(self._sem_keys) == len(self._sem_matrix):
+                grown = np.zeros((2 * len(self._sem_matrix), v.shape[0]), dtype=np.float32)
+                grown[: len(self._sem_keys)] = self._sem_matrix
+                self._sem_matrix = grown
+            row = len(self._sem_keys)
+            self._sem_keys.append(key)
+            self._sem_rows[key] = row
+        self._sem_matrix[row] = v
+
+    def _drop_row(self, key):
+        row = self._sem_rows.pop(key, None)
+        if row is not None:
+            self._sem_keys[row] = None
+            self._sem_matrix[row] = 0.0
+            self._sem_free += 1
+
+    def _maybe_compact(self):
+        """Elimina las filas borradas cuando son más de la mitad (coste amortizado por inserción)."""
+        if self._sem_free <= max(len(self._sem_keys) // 2, _INITIAL_CAPACITY // 4):
+            return
+        rows = [self._sem_rows[k] for k in self._semantic]
+        matrix = self._sem_matrix
+        self._sem_matrix = np.zeros((max(_INITIAL_CAPACITY, 2 * len(rows)), matrix.shape[1]), dtype=np.float32)
+        self._sem_matrix[: len(rows)] = matrix[rows]
+        self._sem_keys = list(self._semantic)
+        self._sem_rows = {k: i for i, k in enumerate(self._sem_keys)}
+        self._sem_free = 0
+
+    def _reset_matrix(self):
+        self._sem_matrix = None
+        self._sem_keys = []
+        self._sem_rows = {}
+        self._sem_free = 0
+
+    # -------- Versión del corpus --------
+
+    def set_version(self, version):
+        """Vacía la caché si cambia la versión del índice o del corpus."""
+        with self._lock:
+            if version != self.version:
+                logging.info(f"Versión del corpus cambiada ({self.version} -> {version}): se vacía la caché de respuestas")
+                self.clear()
+                self.version = version
+
+    def clear(self):
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+            self._reset_matrix()
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "exact_entries": len(self._exact),
+                "semantic_entries": len(self._semantic),
+                "hits": dict(self.hits),
+                "misses": self.misses,
+            }
+
+    # -------- Persistencia --------
+
+    def _paths(self):
+        return os.path.join(self.cache_dir, "answers.json"), os.path.join(self.cache_dir, "embeddings.npy")
+
+    def _maybe_save(self):
+        """Lanza la escritura a disco en segundo plano, como mucho una cada save_interval segundos."""
+        if not self.cache_dir:
+            return
+        with self._lock:
+            if self._saving or not self._dirty or time.time() - self._last_save < self.save_interval:
+                return
+            self._saving = True
+            self._last_save = time.time()
+        threading.Thread(target=self._background_flush, name="answer-cache-flush", daemon=True).start()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        except OSError as e:
+            logging.warning(f"No se pudo guardar la caché de respuestas: {e}")
+        finally:
+            self._saving = False
+
+    def flush(self):
+        """Escribe la caché en disco de forma atómica (fichero temporal + rename)."""
+        if not self.cache_dir:
+            return
+        with self._save_lock:
+            # Bajo el lock solo se copia el estado; la serialización no bloquea las consultas
+            with self._lock:
+                if not self._dirty:
+                    return
+                keys = list(self._semantic)
+                data = {
+                    "version": self.version,
+                    "exact": dict(self._exact),
+                    "semantic": {k: dict(self._semantic[k]) for k in keys},
+                    "semantic_keys": keys,
+                }
+                embeddings = (
+                    self._sem_matrix[[self._sem_rows[k] for k in keys]]
+                    if keys
+                    else np.zeros((0, 0), dtype=np.float32)
+                )
+                self._dirty = False
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                json_path, npy_path = self._paths()
+                # Se escriben primero los embeddings: el JSON es el que marca una caché válida
+                with open(npy_path + ".tmp", "wb") as f:
+                    np.save(f, embeddings)
+                os.replace(npy_path + ".tmp", npy_path)
+                with open(json_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(json_path + ".tmp", json_path)
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def _load(self):
+        """Carga la caché de disco si existe y corresponde a la versión actual del corpus."""
+        json_path, npy_path = self._paths()
+        if not os.path.isfile(json_path):
+            return
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != self.version:
+                logging.info("Caché de respuestas de otra versión del corpus: se descarta")
+                return
+            embeddings = np.load(npy_path) if os.path.isfile(npy_path) else None
+            self._exact = OrderedDict(data["exact"])
+            keys = data.get("semantic_keys", [])
+            if embeddings is not None and len(embeddings) == len(keys):
+                for row, key in enumerate(keys):
+                    entry = data["semantic"][key]
+                    entry.pop("embedding", None)
+                    self._semantic[key] = entry
+                    self._set_row(key, embeddings[row])
+            self._evict(time.time())
+        except (ValueError, KeyError, OSError) as e:
+            logging.warning(f"No se pudo cargar la caché de respuestas: {e}")
+            self._exact.clear()
+            self._semantic.clear()
+            self._reset_matrix()
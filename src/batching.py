@@ -0,0 +1,498 @@
+# batching.py
+"""
+Motor de generación con batching continuo para servir varias sesiones de chat con un único modelo residente en CPU. Las consultas entrantes se encolan, se agrupan en lotes con padding a la izquierda y se decodifican paso a paso de forma conjunta: cuando una secuencia termina sale del lote y su hueco lo ocupa la siguiente consulta en cola, sin esperar a que acabe el resto. Cada consulta recibe sus tokens en streaming a través de su propio manejador.
+"""
+
+# Librerías
+import time
+import queue
+import logging
+import threading
+
+import torch
+from transformers import DynamicCache
+
+
+##-------OPERACIONES SOBRE LA CACHÉ KV-----------------------------------------------------##
+
+# Función para añadir padding a la izquierda de una caché KV (formato legacy)
+def _left_pad_cache(cache, pad):
+    """Añade `pad` posiciones vacías a la izquierda del eje temporal de cada (k, v)."""
+    if pad == 0:
+        return cache
+    padded = []
+    for k, v in cache:
+        zeros_k = k.new_zeros(k.shape[:2] + (pad,) + k.shape[3:])
+        zeros_v = v.new_zeros(v.shape[:2] + (pad,) + v.shape[3:])
+        padded.append((torch.cat([zeros_k, k], dim=2), torch.cat([zeros_v, v], dim=2)))
+    return tuple(padded)
+
+
+# Función para concatenar dos cachés KV en el eje del lote
+def _concat_caches(cache_a, mask_a, cache_b, mask_b):
+    """
+    Une dos lotes (caché + máscara de atención) alineándolos a la derecha.
+
+    Retorna:
+    - tuple: (caché unida, máscara unida)
+    """
+    len_a, len_b = mask_a.shape[1], mask_b.shape[1]
+    length = max(len_a, len_b)
+    cache_a = _left_pad_cache(cache_a, length - len_a)
+    cache_b = _left_pad_cache(cache_b, length - len_b)
+    mask_a = torch.nn.functional.pad(mask_a, (length - len_a, 0), value=0)
+    mask_b = torch.nn.functional.pad(mask_b, (length - len_b, 0), value=0)
+    cache = tuple(
+        (torch.cat([ka, kb], dim=0), torch.cat([va, vb], dim=0))
+        for (ka, va), (kb, vb) in zip(cache_a, cache_b)
+    )
+    return cache, torch.cat([mask_a, mask_b], dim=0)
+
+
+# Función para quedarse con algunas filas del lote y recortar el padding sobrante
+def _select_rows(cache, mask, rows):
+    """
+    Selecciona las filas `rows` del lote y elimina las columnas iniciales que ya
+    solo contienen padding.
+
+    Retorna:
+    - tuple: (caché, máscara)
+    """
+    idx = torch.tensor(rows, dtype=torch.long, device=mask.device)
+    mask = mask.index_select(0, idx)
+    cache = tuple((k.index_select(0, idx), v.index_select(0, idx)) for k, v in cache)
+
+    # Primera columna con algún token real
+    used = mask.any(dim=0).nonzero()
+    start = int(used[0]) if len(used) else 0
+    if start > 0:
+        mask = mask[:, start:]
+        cache = tuple((k[:, :, start:], v[:, :, start:]) for k, v in cache)
+    return cache, mask
+
+
+##-------SELECCIÓN DEL SIGUIENTE TOKEN-----------------------------------------------------##
+
+# Función para aplicar la penalización por repetición a todo el lote
+def _apply_repetition_penalty(logits, seen, requests):
+    """
+    Penaliza en una sola operación los tokens ya vistos (prompt + generados) de cada fila.
+
+    Parámetros:
+    - logits (Tensor): logits del último paso, forma (lote, vocab).
+    - seen (Tensor): máscara booleana de tokens vistos por fila, forma (lote, vocab).
+    - requests (list): GenerationRequest de cada fila.
+
+    Retorna:
+    - Tensor: logits en float32 con la penalización aplicada.
+    """
+    logits = logits.float()
+    penalties = [r.repetition_penalty for r in requests]
+    if all(p == 1.0 for p in penalties):
+        return logits
+    penalty = torch.tensor(penalties, dtype=logits.dtype, device=logits.device).unsqueeze(-1)
+    score = torch.where(logits < 0, logits * penalty, logits / penalty)
+    return torch.where(seen, score, logits)
+
+
+# Función para elegir el siguiente token de una secuencia
+def _next_token(logits, request):
+    """
+    Aplica temperatura y top-p a los logits de una fila (ya penalizados por repetición) y
+    elige el siguiente token (voraz o muestreado).
+
+    Parámetros:
+    - logits (Tensor): logits del último paso, forma (vocab,).
+    - request (GenerationRequest): consulta con sus parámetros de generación.
+
+    Retorna:
+    - int: id del siguiente token.
+    """
+    if not request.do_sample:
+        return int(torch.argmax(logits))
+
+    logits = logits / max(request.temperature, 1e-5)
+
+    # Top-p (nucleus): se descartan los tokens fuera de la masa acumulada top_p
+    if request.top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, descending=True)
+        cum_probs = torch.softmax(sorted_logits, dim=-1).cumsum(dim=-1)
+        remove = cum_probs > request.top_p
+        remove[1:] = remove[:-1].clone()
+        remove[0] = False
+        logits = logits.index_fill(0, sorted_idx[remove], float("-inf"))
+
+    probs = torch.softmax(logits, dim=-1)
+    return int(torch.multinomial(probs, 1, generator=request.generator))
+
+
+##-------CONSULTAS Y MOTOR-----------------------------------------------------------------##
+
+class GenerationRequest:
+    """
+    Consulta encolada en el motor. Se itera sobre ella para recibir los tokens (ids) según
+    se generan, o sobre `stream_text()` para recibir fragmentos de texto.
+    """
+
+    _DONE = object()
+
+    def __init__(
+        self,
+        prompt_ids,
+        max_new_tokens=256,
+        do_sample=False,
+        temperature=1.0,
+        top_p=1.0,
+        repetition_penalty=1.0,
+        eos_token_id=None,
+        seed=None,
+        tokenizer=None,
+        deadline=None,
+    ):
+        if not prompt_ids:
+            raise ValueError("El prompt no puede estar vacío.")
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.eos_token_id = eos_token_id
+        self.tokenizer = tokenizer
+        # Plazo y cancelación (RequestDeadline): el motor retira la consulta del lote al vencer
+        self.deadline = deadline
+        self.stop_reason = None
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator().manual_seed(seed)
+
+        self.generated = []
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self._queue = queue.Queue()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def _push(self, token_id):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.generated.append(token_id)
+        self._queue.put(token_id)
+
+    def _finish(self, error=None):
+        self.error = error
+        self.finished_at = time.perf_counter()
+        self._queue.put(self._DONE)
+
+    def _should_stop(self):
+        """Comprueba el plazo y la cancelación; el motivo queda en `stop_reason`."""
+        if self.deadline is not None and self.stop_reason is None:
+            self.stop_reason = self.deadline.check()
+        return self.stop_reason is not None
+
+    def __iter__(self):
+        """Devuelve los ids de los tokens generados según llegan."""
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    def stream_text(self):
+        """Devuelve fragmentos de texto decodificados de forma incremental."""
+        if self.tokenizer is None:
+            raise ValueError("Se necesita un tokenizador para decodificar el texto.")
+        ids, emitted = [], ""
+        for token_id in self:
+            ids.append(token_id)
+            text = self.tokenizer.decode(ids, skip_special_tokens=True)
+            # Se espera a completar caracteres multibyte partidos entre tokens
+            if text.endswith("�"):
+                continue
+            if len(text) > len(emitted):
+                yield text[len(emitted):]
+                emitted = text
+
+    def result(self):
+        """Espera a que termine la generación y devuelve los ids generados."""
+        for _ in self:
+            pass
+        return list(self.generated)
+
+    def stats(self):
+        """Tiempos de la consulta: espera en cola + primer token y latencia total."""
+        return {
+            "ttft_s": None if self.first_token_at is None else self.first_token_at - self.submitted_at,
+            "total_s": None if self.finished_at is None else self.finished_at - self.submitted_at,
+            "num_tokens": len(self.generated),
+        }
+
+
+class BatchingEngine:
+    """
+    Planificador de generación con batching continuo sobre un único modelo causal.
+
+    Parámetros:
+    - model: modelo causal de Hugging Face (ej. Llama-2 o GPT-2).
+    - tokenizer: tokenizador del modelo (opcional, necesario para `submit_text`).
+    - max_batch_size (int): número máximo de secuencias decodificadas a la vez.
+    - pad_token_id (int): token de padding (por defecto, el del tokenizador o 0).
+    - prefix_cache (PrefixKVCache): caché KV del prefijo fijo del prompt. Las consultas que
+      empiezan por él solo hacen el prefill del resto del prompt.
+    """
+
+    def __init__(self, model, tokenizer=None, max_batch_size=16, pad_token_id=None, prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        if pad_token_id is None and tokenizer is not None:
+            pad_token_id = tokenizer.pad_token_id
+            if pad_token_id is None:
+                pad_token_id = tokenizer.eos_token_id
+        self.pad_token_id = pad_token_id or 0
+        self.device = next(model.parameters()).device
+
+        self._pending = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Estado del lote activo
+        self._active = []  # GenerationRequest por fila
+        self._cache = None  # Caché KV en formato legacy: tupla de (k, v) por capa
+        self._mask = None  # Máscara de atención (lote x longitud)
+        self._last_tokens = None  # Último token de cada fila
+        self._seen = None  # Tokens ya vistos por fila (lote x vocab), para la penalización por repetición
+
+        # Estadísticas
+        self.steps = 0
+        self.tokens_generated = 0
+        self.batch_size_sum = 0
+
+    # -------- API pública --------
+
+    def start(self):
+        """Arranca el hilo de planificación (se llama automáticamente al enviar una consulta)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, name="batching-engine", daemon=True)
+                self._thread.start()
+
+    def close(self):
+        """Detiene el hilo de planificación y cancela las consultas pendientes."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        error = RuntimeError("Motor de generación detenido.")
+        for request in self._active:
+            request._finish(error)
+        while not self._pending.empty():
+            self._pending.get_nowait()._finish(error)
+        self._active, self._cache, self._mask, self._last_tokens, self._seen = [], None, None, None, None
+
+    def submit(self, prompt_ids, **gen_params):
+        """
+        Encola una consulta a partir de los ids del prompt.
+
+        Parámetros:
+        - prompt_ids (list): ids de los tokens del prompt.
+        - **gen_params: max_new_tokens, do_sample, temperature, top_p, repetition_penalty,
+          eos_token_id, seed, deadline (RequestDeadline: la consulta se retira del lote al vencer
+          el plazo o al cancelarse, con `stop_reason` indicando el motivo).
+
+        Retorna:
+        - GenerationRequest: manejador para recibir los tokens en streaming.
+        """
+        if "eos_token_id" not in gen_params and self.tokenizer is not None:
+            gen_params["eos_token_id"] = self.tokenizer.eos_token_id
+        request = GenerationRequest(prompt_ids, tokenizer=self.tokenizer, **gen_params)
+        self._pending.put(request)
+        self.start()
+        return request
+
+    def submit_text(self, prompt, **gen_params):
+        """Encola una consulta a partir del texto del prompt."""
+        if self.tokenizer is None:
+            raise ValueError("Se necesita un tokenizador para enviar texto.")
+        prompt_ids = self.tokenizer(prompt)["input_ids"]
+        return self.submit(prompt_ids, **gen_params)
+
+    @property
+    def busy(self):
+        """Indica si hay consultas en curso o en cola (el registro de modelos no expulsa el motor ni su LLM)."""
+        return bool(self._active) or not self._pending.empty()
+
+    def stats(self):
+        """Estadísticas acumuladas del motor."""
+        return {
+            "steps": self.steps,
+            "tokens_generated": self.tokens_generated,
+            "mean_batch_size": self.batch_size_sum / self.steps if self.steps else 0.0,
+            "active": len(self._active),
+            "pending": self._pending.qsize(),
+        }
+
+    # -------- Bucle de planificación --------
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                # Sin secuencias activas se bloquea hasta que llegue una consulta
+                if not self._active:
+                    try:
+                        first = self._pending.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    self._admit([first] + self._drain(self.max_batch_size - 1))
+                else:
+                    free = self.max_batch_size - len(self._active)
+                    if free > 0:
+                        nuevas = self._drain(free)
+                        if nuevas:
+                            self._admit(nuevas)
+                if self._active:
+                    self._decode_step()
+            except Exception as e:
+                logging.exception("Error en el motor de generación")
+                for request in self._active:
+                    request._finish(e)
+                self._active, self._cache, self._mask, self._last_tokens, self._seen = [], None, None, None, None
+
+    def _drain(self, n):
+        """Saca hasta n consultas de la cola sin bloquear."""
+        requests = []
+        while len(requests) < n:
+            try:
+                requests.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return requests
+
+    def _forward(self, input_ids, attention_mask, position_ids, cache):
+        past = DynamicCache.from_legacy_cache(cache) if cache is not None else None
+        with torch.no_grad():
+            out = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past,
+                use_cache=True,
+            )
+        past = out.past_key_values
+        legacy = past.to_legacy_cache() if hasattr(past, "to_legacy_cache") else past
+        return out.logits[:, -1, :], legacy
+
+    def _admit(self, requests):
+        """Une las nuevas consultas al lote, separando las que pueden reutilizar la caché del prefijo."""
+        # Las consultas canceladas o con el plazo vencido mientras esperaban en la cola no se procesan
+        for request in requests:
+            if request._should_stop():
+                request._finish()
+        requests = [r for r in requests if not r.finished]
+        if not requests:
+            return
+        if self.prefix_cache is None:
+            self._prefill(requests, use_prefix=False)
+            return
+        con_prefijo = [r for r in requests if self.prefix_cache.matches(r.prompt_ids)]
+        sin_prefijo = [r for r in requests if not self.prefix_cache.matches(r.prompt_ids)]
+        if con_prefijo:
+            self._prefill(con_prefijo, use_prefix=True)
+        if sin_prefijo:
+            self._prefill(sin_prefijo, use_prefix=False)
+
+    def _prefill(self, requests, use_prefix):
+        """
+        Hace el prefill de las nuevas consultas (con padding a la izquierda) y las une al lote.
+
+        Con `use_prefix`, el lote parte de la caché del prefijo y solo se procesa el resto del
+        prompt; el padding queda entre el prefijo y el resto ([prefijo | pad | resto]), y las
+        posiciones se calculan a partir de la máscara, así que el resultado es el mismo.
+        """
+        offset = len(self.prefix_cache) if use_prefix else 0
+        prompts = [r.prompt_ids[offset:] for r in requests]
+        length = max(len(p) for p in prompts)
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(requests), length), dtype=torch.long)
+        for i, p in enumerate(prompts):
+            input_ids[i, length - len(p):] = torch.tensor(p)
+            mask[i, length - len(p):] = 1
+        input_ids, mask = input_ids.to(self.device), mask.to(self.device)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0) + offset
+
+        past = None
+        if use_prefix:
+            past = self.prefix_cache.expand(len(requests))
+            mask = torch.cat([torch.ones((len(requests), offset), dtype=torch.long, device=self.device), mask], dim=1)
+
+        logits, cache = self._forward(input_ids, mask, position_ids, past)
+        # Tokens vistos de cada fila nueva: el prompt completo (incluido el prefijo)
+        seen = torch.zeros(logits.shape, dtype=torch.bool, device=self.device)
+        for i, r in enumerate(requests):
+            seen[i, torch.tensor(r.prompt_ids, device=self.device)] = True
+        logits = _apply_repetition_penalty(logits, seen, requests)
+        next_tokens = [_next_token(logits[i], r) for i, r in enumerate(requests)]
+
+        if self._active:
+            self._cache, self._mask = _concat_caches(self._cache, self._mask, cache, mask)
+            self._seen = torch.cat([self._seen, seen])
+        else:
+            self._cache, self._mask, self._seen = cache, mask, seen
+        self._active.extend(requests)
+        self._emit(next_tokens, offset=len(self._active) - len(requests))
+
+    def _decode_step(self):
+        """Genera un token para todas las secuencias activas."""
+        input_ids = self._last_tokens.unsqueeze(-1)
+        position_ids = self._mask.sum(-1, keepdim=True)
+        self._mask = torch.nn.functional.pad(self._mask, (0, 1), value=1)
+
+        logits, self._cache = self._forward(input_ids, self._mask, position_ids, self._cache)
+        logits = _apply_repetition_penalty(logits, self._seen, self._active)
+        next_tokens = [_next_token(logits[i], r) for i, r in enumerate(self._active)]
+
+        self.steps += 1
+        self.batch_size_sum += len(self._active)
+        self._emit(next_tokens, offset=0)
+
+    def _emit(self, next_tokens, offset):
+        """
+        Entrega los nuevos tokens a sus consultas (desde la fila `offset`), retira las que
+        han terminado y actualiza el último token de cada fila.
+        """
+        previous = self._last_tokens.tolist() if self._last_tokens is not None else []
+        last = previous[:offset] + list(next_tokens)
+        # Los nuevos tokens pasan a contar como vistos en su fila
+        self._seen[offset:].scatter_(1, torch.tensor(last[offset:], device=self.device).unsqueeze(-1), True)
+        keep = []
+        for row, request in enumerate(self._active):
+            if row >= offset:
+                token = last[row]
+                if token == request.eos_token_id:
+                    request._finish()
+                    continue
+                request._push(token)
+                self.tokens_generated += 1
+                if len(request.generated) >= request.max_new_tokens or request._should_stop():
+                    request._finish()
+                    continue
+            keep.append(row)
+
+        if len(keep) < len(self._active):
+            self._active = [self._active[r] for r in keep]
+            if keep:
+                self._cache, self._mask = _select_rows(self._cache, self._mask, keep)
+                self._seen = self._seen[keep]
+            else:
+                self._cache, self._mask, self._seen = None, None, None
+        self._last_tokens = (
+            torch.tensor([last[r] for r in keep], dtype=torch.long, device=self.device) if keep else None
+        )
@@ -0,0 +1,190 @@
+# cascade.py
+"""
+Cascada de modelos: cada consulta se responde con el nivel más barato cuya respuesta pasa las comprobaciones.
+
+1. "extractive": la respuesta extractiva (`extractive.py`, milisegundos). Se acepta si la consulta se reconoció por la ruta directa con confianza alta, o si el mejor fragmento es muy parecido a la consulta y las frases extraídas cubren sus términos.
+2. "gpt2": GPT-2 con los mismos fragmentos. Solo se intenta si la recuperación es suficientemente fiable, y se acepta si la respuesta tiene una longitud mínima, no se repite y sus términos están en el contexto.
+3. "llama2": el resto de consultas.
+
+Las reglas (CASCADE_RULES) y los niveles activos (CASCADE_TIERS) son configurables. `CascadeRouter` cuenta las consultas que resuelve cada nivel y su latencia, y cada respuesta se registra en la telemetría como la etapa "cascade_<nivel>". Así se puede elegir el equilibrio entre latencia y calidad.
+
+Uso:
+    python src/cascade.py "¿qué dosis de ibuprofeno puedo tomar?" "¿puedo conducir si tomo lorazepam?"
+    python src/cascade.py --queries consultas.txt [--tiers extractive,llama2]
+"""
+
+# Librerías
+import os
+import time
+import argparse
+import threading
+from collections import Counter, defaultdict
+
+from sparse_index import tokenize
+
+# Niveles de la cascada, del más barato al más caro
+CASCADE_LEVELS = ("extractive", "gpt2", "llama2")
+CASCADE_TIERS = tuple(t.strip() for t in os.environ.get("PHARMAI_CASCADE_TIERS", ",".join(CASCADE_LEVELS)).split(","))
+
+# Umbrales de cada nivel. Las similitudes son cosenos entre embeddings normalizados (1 - d/2
+# con las distancias L2 al cuadrado de FAISS); cobertura y anclaje son proporciones de términos
+CASCADE_RULES = {
+    # Nivel extractivo
+    "intent_confidence": float(os.environ.get("PHARMAI_CASCADE_INTENT_CONFIDENCE", "0.9")),
+    "extractive_similarity": float(os.environ.get("PHARMAI_CASCADE_EXTRACTIVE_SIMILARITY", "0.6")),
+    "extractive_coverage": float(os.environ.get("PHARMAI_CASCADE_EXTRACTIVE_COVERAGE", "0.3")),
+    # Nivel GPT-2
+    "gpt2_similarity": float(os.environ.get("PHARMAI_CASCADE_GPT2_SIMILARITY", "0.45")),
+    "gpt2_grounding": float(os.environ.get("PHARMAI_CASCADE_GPT2_GROUNDING", "0.6")),
+    "gpt2_min_words": 8,
+    "gpt2_max_repetition": 0.3,
+}
+
+
+# Función para calcular la confianza de la recuperación
+def retrieval_confidence(retrieved_fragments, retrieval_stats):
+    """
+    Confianza (0-1) en los fragmentos recuperados: la del reconocimiento en la ruta directa y, en
+    la búsqueda vectorial o híbrida, la similitud coseno del fragmento más cercano de FAISS (los
+    resultados solo de BM25 no tienen distancia).
+    """
+    if retrieval_stats.get("path") == "intent":
+        return float(retrieval_stats.get("confidence", 0.0))
+    distancias = [f["distance"] for f in retrieved_fragments if f.get("distance") is not None]
+    return max(0.0, 1.0 - min(distancias) / 2) if distancias else 0.0
+
+
+# Función para calcular la proporción de términos de un texto presentes en otro
+def term_coverage(texto, referencia):
+    """Proporción de los términos de `texto` (sin palabras vacías) que aparecen en `referencia`."""
+    terminos = set(tokenize(texto))
+    return len(terminos & set(tokenize(referencia))) / len(terminos) if terminos else 0.0
+
+
+# Función para medir la repetición de una respuesta
+def repetition(texto, n=3):
+    """Proporción de trigramas de palabras repetidos (0 sin repeticiones)."""
+    palabras = texto.lower().split()
+    ngramas = [tuple(palabras[i:i + n]) for i in range(len(palabras) - n + 1)]
+    return 1 - len(set(ngramas)) / len(ngramas) if ngramas else 0.0
+
+
+class CascadeRouter:
+    """
+    Decide en qué nivel de la cascada se queda cada consulta y lleva la cuenta de cada nivel.
+
+    Parámetros:
+    - tiers (tuple): niveles activos, en orden (subconjunto de CASCADE_LEVELS que termina en el
+      nivel que siempre responde).
+    - rules (dict): umbrales (por defecto, CASCADE_RULES; las claves que falten toman su valor).
+    """
+
+    def __init__(self, tiers=CASCADE_TIERS, rules=None):
+        desconocidos = [t for t in tiers if t not in CASCADE_LEVELS]
+        if desconocidos or not tiers:
+            raise ValueError(f"Niveles de la cascada no válidos: {', '.join(tiers)} (válidos: {', '.join(CASCADE_LEVELS)})")
+        self.tiers = tuple(tiers)
+        self.rules = {**CASCADE_RULES, **(rules or {})}
+        self._lock = threading.Lock()
+        self._count = Counter()
+        self._seconds = defaultdict(float)
+
+    def accept_extractive(self, query, answer, confidence, retrieval_stats):
+        """
+        Indica si la respuesta extractiva es suficiente.
+
+        Retorna:
+        - tuple: (aceptada, comprobaciones)
+        """
+        checks = {"confidence": round(confidence, 3), "coverage": round(term_coverage(query, answer), 3)}
+        if retrieval_stats.get("path") == "intent":
+            return confidence >= self.rules["intent_confidence"], checks
+        return (
+            confidence >= self.rules["extractive_similarity"] and checks["coverage"] >= self.rules["extractive_coverage"],
+            checks,
+        )
+
+    def try_gpt2(self, confidence):
+        """Indica si merece la pena generar con GPT-2 (con una recuperación poco fiable se pasa a Llama-2)."""
+        return confidence >= self.rules["gpt2_similarity"]
+
+    def accept_gpt2(self, answer, context):
+        """
+        Indica si la respuesta de GPT-2 es suficiente: longitud mínima, sin repeticiones y con sus
+        términos presentes en el contexto.
+
+        Retorna:
+        - tuple: (aceptada, comprobaciones)
+        """
+        checks = {
+            "words": len(answer.split()),
+            "repetition": round(repetition(answer), 3),
+            "grounding": round(term_coverage(answer, context), 3),
+        }
+        return (
+            checks["words"] >= self.rules["gpt2_min_words"]
+            and checks["repetition"] <= self.rules["gpt2_max_repetition"]
+            and checks["grounding"] >= self.rules["gpt2_grounding"],
+            checks,
+        )
+
+    def record(self, tier, seconds):
+        """Registra una consulta resuelta en `tier`."""
+        with self._lock:
+            self._count[tier] += 1
+            self._seconds[tier] += seconds
+
+    def report(self):
+        """
+        Retorna:
+        - dict: por nivel, número de consultas, proporción del tráfico y latencia media (s).
+        """
+        with self._lock:
+            total = sum(self._count.values())
+            return {
+                tier: {
+                    "count": self._count[tier],
+                    "share": self._count[tier] / total if total else 0.0,
+                    "mean_s": self._seconds[tier] / self._count[tier] if self._count[tier] else None,
+                }
+                for tier in self.tiers
+            }
+
+
+# Función principal
+def main():
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import answer_query, get_chatbot_registry
+
+    parser = argparse.ArgumentParser(description="Responde consultas con la cascada de modelos y muestra qué nivel resuelve cada una")
+    parser.add_argument("queries", nargs="*")
+    parser.add_argument("--queries", dest="queries_path", default=None, help="Fichero con una consulta por línea")
+    parser.add_argument("--tiers", default=",".join(CASCADE_TIERS))
+    args = parser.parse_args()
+    queries = list(args.queries)
+    if args.queries_path:
+        with open(args.queries_path, "r", encoding="utf-8") as f:
+            queries += [linea.strip() for linea in f if linea.strip()]
+
+    registry = get_chatbot_registry()
+    router = CascadeRouter(tuple(args.tiers.split(",")))
+    registry.replace("cascade", router)
+    for query in queries:
+        stats = {}
+        start = time.perf_counter()
+        answer_query(query, "cascade", registry=registry, use_cache=False, stats=stats)
+        # Con PHARMAI_ANSWER_MODE=extractive (o "auto" sin el LLM cargado) la cascada no se recorre
+        cascade = stats.get("cascade", {"tier": stats.get("answer_mode"), "checks": {}})
+        print(f"{cascade['tier']:>10} | {time.perf_counter() - start:7.2f} s | {query}  {cascade['checks']}")
+
+    print(f"\n{'nivel':>10} | {'consultas':>9} | {'tráfico':>7} | {'media (s)':>9}")
+    for tier, fila in router.report().items():
+        media = f"{fila['mean_s']:.2f}" if fila["mean_s"] is not None else "-"
+        print(f"{tier:>10} | {fila['count']:>9} | {fila['share']:>7.1%} | {media:>9}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# deadline.py
+"""
+Plazos de tiempo y cancelación de las generaciones.
+
+Una generación de Llama-2 con max_new_tokens=2000 y repetition_penalty=1.2 puede ocupar la CPU durante minutos mientras el resto de sesiones esperan. Cada consulta tiene un plazo (`RequestDeadline`, medido desde su llegada) y, opcionalmente, un `CancelToken` que se activa cuando el usuario envía otra pregunta o deja de leer la respuesta. Los bucles de generación comprueban el plazo después de cada token:
+
+- `model.generate`, con `DeadlineStoppingCriteria`.
+- La decodificación especulativa (`speculative.py`), con el parámetro `should_stop`.
+- El motor de batching continuo (`batching.py`), que retira la fila de la consulta del lote.
+
+Así la latencia de una consulta queda acotada por el plazo más un paso de decodificación. La respuesta parcial se devuelve con una marca de truncado (`truncation_marker`).
+"""
+
+# Librerías
+import os
+import time
+import threading
+
+import torch
+from transformers import StoppingCriteria
+
+# Plazo por defecto de cada consulta en segundos (0 para no limitarla)
+GENERATION_DEADLINE_S = float(os.environ.get("PHARMAI_GENERATION_DEADLINE_S", "60"))
+
+# Motivos por los que se interrumpe una generación
+STOP_DEADLINE = "deadline"
+STOP_CANCELLED = "cancelled"
+STOP_NEW_QUESTION = "new_question"
+STOP_DISCONNECTED = "disconnected"
+
+# Marca que se añade a las respuestas interrumpidas
+TRUNCATION_MARKERS = {
+    STOP_DEADLINE: "[Respuesta interrumpida: se ha alcanzado el tiempo máximo de respuesta]",
+    STOP_CANCELLED: "[Respuesta interrumpida]",
+}
+
+
+class CancelToken:
+    """
+    Señal de cancelación compartida entre la sesión y la generación en curso.
+
+    Uso:
+        token = CancelToken()
+        answer_query_stream(query, cancel_token=token)   # en otro hilo
+        token.cancel("new_question")
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason=STOP_CANCELLED):
+        """Cancela la generación (el motivo queda en `reason`; solo cuenta la primera vez)."""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class RequestDeadline:
+    """
+    Plazo de una consulta y su token de cancelación.
+
+    Parámetros:
+    - seconds (float): segundos desde la creación (None o 0 para no limitarla).
+    - cancel_token (CancelToken): token de la sesión (opcional; si no se indica se crea uno).
+    """
+
+    def __init__(self, seconds=None, cancel_token=None):
+        self.start = time.perf_counter()
+        self.seconds = seconds or None
+        self.cancel_token = cancel_token or CancelToken()
+        self.reason = None
+
+    def remaining(self):
+        """Segundos que quedan (None sin plazo)."""
+        return None if self.seconds is None else self.seconds - (time.perf_counter() - self.start)
+
+    def check(self):
+        """
+        Comprueba el plazo y la cancelación. El primer motivo de parada queda fijado en `reason`.
+
+        Retorna:
+        - str o None: STOP_DEADLINE, el motivo de la cancelación o None si la generación sigue.
+        """
+        if self.reason is None:
+            if self.cancel_token.cancelled:
+                self.reason = self.cancel_token.reason or STOP_CANCELLED
+            elif self.seconds is not None and time.perf_counter() - self.start >= self.seconds:
+                self.reason = STOP_DEADLINE
+        return self.reason
+
+    def cancel(self, reason=STOP_CANCELLED):
+        self.cancel_token.cancel(reason)
+
+
+class DeadlineStoppingCriteria(StoppingCriteria):
+    """Criterio de parada de model.generate: detiene todas las secuencias al vencer el plazo o al cancelar."""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def __call__(self, input_ids, scores, **kwargs):
+        stop = self.deadline.check() is not None
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+
+# Función para obtener la marca de una respuesta interrumpida
+def truncation_marker(reason):
+    return TRUNCATION_MARKERS.get(reason, TRUNCATION_MARKERS[STOP_CANCELLED])
@@ -0,0 +1,337 @@
+# drug_names.py
+"""
+Índice de nombres de medicamentos para detectar en las consultas a qué medicamento se refieren, aunque el nombre esté mal escrito, abreviado o sin la dosis y la forma farmacéutica.
+
+Se indexan los valores de "medicamento" (ej. "paracetamol normon") y "nombre_medicamento_completo" (ej. "paracetamol normon 650 mg comprimidos efg") de los fragmentos, y las primeras palabras de cada "medicamento" (ej. "paracetamol", que abarca todos sus medicamentos). Para buscarlos en una consulta:
+
+1. Cada palabra de la consulta que no está en el vocabulario de los nombres se corrige con la palabra más parecida: por prefijo, para las abreviaturas (ej. "paracet" -> "paracetamol"), o por trigramas de caracteres con listas invertidas, para las erratas (ej. "ibuprofneo" -> "ibuprofeno").
+2. Los fragmentos de la consulta corregida se buscan de forma exacta en un trie (marisa-trie) de los nombres normalizados. La puntuación de cada nombre es 1.0 (nombre completo) o 0.9 (primeras palabras), multiplicada por la de la peor palabra corregida.
+
+El índice se guarda en la carpeta `names/` de cada paquete de recuperación y se abre con mmap (los tries y las listas de trigramas en .npy), así que arranca sin reconstruirse y lo comparten los procesos que sirven el mismo paquete.
+
+Uso:
+    python src/drug_names.py build [--fragments RUTA] [--output CARPETA]
+    python src/drug_names.py query "efectos secundarios del ibuprofneo" [--index CARPETA]
+"""
+
+# Librerías
+import os
+import re
+import json
+import time
+import argparse
+import unicodedata
+from difflib import SequenceMatcher
+from collections import defaultdict
+
+import marisa_trie
+import numpy as np
+
+# Ficheros del índice
+NAMES_TRIE = "names.marisa"
+WORDS_TRIE = "words.marisa"
+TRIGRAMS_TRIE = "trigrams.marisa"
+DRUGS_FILE = "drugs.json"
+ARRAYS = ("name_kind", "drug_offsets", "drug_ids", "word_ntri", "tri_offsets", "tri_postings")
+
+# Tipos de nombre: completo (medicamento o nombre completo) o primeras palabras del medicamento
+NAME_FULL, NAME_PREFIX = 0, 1
+
+# Número máximo de palabras de un nombre que se prueban en la consulta
+MAX_NAME_WORDS = 6
+
+# Longitud mínima de las palabras que se corrigen
+MIN_FUZZY_LENGTH = 4
+
+# Palabras candidatas (las de más trigramas en común) comparadas en detalle al corregir una palabra
+FUZZY_CANDIDATES = 5
+
+# Palabras que no identifican un medicamento por sí solas aunque sean la primera de su nombre
+GENERIC_WORDS = {"acido", "agua", "sodio", "potasio", "calcio", "magnesio", "hierro", "solucion", "complejo", "vitamina"}
+
+# Palabras de la consulta que no forman parte de un nombre de medicamento
+STOPWORDS = {
+    "a", "al", "con", "cual", "cuales", "cuando", "de", "del", "el", "en", "es", "esta", "la", "las", "lo", "los",
+    "me", "mi", "o", "para", "por", "puedo", "que", "se", "si", "sin", "son", "su", "tiene", "tomar", "tomo",
+    "un", "una", "y",
+}
+
+# Número máximo de correcciones de palabras guardadas en memoria
+MAX_CACHED_CORRECTIONS = 10000
+
+# Puntuación de los nombres encontrados por prefijo: base + el resto según la fracción escrita
+PREFIX_BASE_SCORE = 0.7
+
+
+# Función para normalizar un texto (minúsculas, sin tildes y solo letras y números)
+def normalize_text(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", texto).split())
+
+
+# Función para obtener los trigramas de caracteres de un texto
+def trigrams(texto):
+    texto = f" {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class DrugMatch:
+    """
+    Nombre de medicamento encontrado en una consulta.
+
+    Atributos:
+    - name (str): nombre normalizado del índice.
+    - score (float): puntuación (1.0 exacta; menos para los prefijos, abreviaturas y erratas).
+    - span (tuple): palabras de la consulta (inicio, fin) donde se encontró.
+    - drugs (list): valores de "medicamento" a los que se refiere.
+    """
+
+    __slots__ = ("name", "score", "span", "drugs")
+
+    def __init__(self, name, score, span, drugs):
+        self.name = name
+        self.score = score
+        self.span = span
+        self.drugs = drugs
+
+    def __repr__(self):
+        return f"DrugMatch({self.name!r}, score={self.score:.2f}, drugs={len(self.drugs)})"
+
+
+class DrugNameIndex:
+    """
+    Índice de nombres de medicamentos (ver la descripción del módulo).
+
+    Uso:
+        names = DrugNameIndex.build(fragments)      # o DrugNameIndex.load(carpeta)
+        names.candidates("reacciones del ibuprofneo")   # [DrugMatch("ibuprofeno", 0.81, ...), ...]
+        names.detect("reacciones del ibuprofneo")       # menciones sin solaparse
+    """
+
+    def __init__(self, names, words, trigram_trie, drugs, arrays):
+        self.names = names
+        self.words = words
+        self.trigram_trie = trigram_trie
+        self.drugs = drugs
+        for nombre in ARRAYS:
+            setattr(self, nombre, arrays[nombre])
+        # Correcciones ya calculadas (las palabras de las preguntas se repiten mucho entre consultas)
+        self._corrections = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def build(cls, fragments):
+        """Construye el índice en memoria a partir de los fragmentos (y de las fuentes de los deduplicados)."""
+        entradas = defaultdict(lambda: [NAME_PREFIX, set()])
+        for frag in fragments:
+            for fuente in frag.get("fuentes") or [frag]:
+                medicamento = fuente.get("medicamento")
+                if not medicamento:
+                    continue
+                palabras = normalize_text(medicamento).split()
+                completos = [" ".join(palabras), normalize_text(fuente.get("nombre_medicamento_completo", ""))]
+                for nombre in completos:
+                    if nombre:
+                        entradas[nombre][0] = NAME_FULL
+                        entradas[nombre][1].add(medicamento)
+                for n in range(1, min(len(palabras), MAX_NAME_WORDS)):
+                    if n == 1 and (palabras[0] in GENERIC_WORDS or len(palabras[0]) < 4):
+                        continue
+                    entradas[" ".join(palabras[:n])][1].add(medicamento)
+
+        # Nombres -> tipo y medicamentos (listas concatenadas con desplazamientos)
+        names = marisa_trie.Trie(entradas)
+        drugs = sorted({m for _, meds in entradas.values() for m in meds})
+        drug_pos = {m: i for i, m in enumerate(drugs)}
+        name_kind = np.zeros(len(names), dtype=np.int8)
+        por_nombre = [None] * len(names)
+        for nombre, (kind, meds) in entradas.items():
+            name_kind[names[nombre]] = kind
+            por_nombre[names[nombre]] = sorted(drug_pos[m] for m in meds)
+
+        # Vocabulario de palabras de los nombres y sus trigramas (listas invertidas)
+        words = marisa_trie.Trie({p for nombre in entradas for p in nombre.split()})
+        word_ntri = np.zeros(len(words), dtype=np.int16)
+        por_trigrama = defaultdict(list)
+        for palabra, i in words.items():
+            tris = trigrams(palabra)
+            word_ntri[i] = len(tris)
+            for t in tris:
+                por_trigrama[t].append(i)
+        trigram_trie = marisa_trie.Trie(por_trigrama)
+        tri_listas = [None] * len(trigram_trie)
+        for t, ids in por_trigrama.items():
+            tri_listas[trigram_trie[t]] = sorted(ids)
+
+        arrays = {
+            "name_kind": name_kind,
+            "drug_offsets": np.cumsum([0] + [len(x) for x in por_nombre]).astype(np.int64),
+            "drug_ids": np.asarray([d for x in por_nombre for d in x], dtype=np.int32),
+            "word_ntri": word_ntri,
+            "tri_offsets": np.cumsum([0] + [len(x) for x in tri_listas]).astype(np.int64),
+            "tri_postings": np.asarray([i for x in tri_listas for i in x], dtype=np.int32),
+        }
+        return cls(names, words, trigram_trie, drugs, arrays)
+
+    def save(self, path):
+        """Escribe el índice en la carpeta `path`."""
+        os.makedirs(path, exist_ok=True)
+        self.names.save(os.path.join(path, NAMES_TRIE))
+        self.words.save(os.path.join(path, WORDS_TRIE))
+        self.trigram_trie.save(os.path.join(path, TRIGRAMS_TRIE))
+        with open(os.path.join(path, DRUGS_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.drugs, f, ensure_ascii=False)
+        for nombre in ARRAYS:
+            np.save(os.path.join(path, f"{nombre}.npy"), getattr(self, nombre))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Abre el índice de la carpeta `path` (con mmap, salvo la lista de medicamentos)."""
+        tries = []
+        for fichero in (NAMES_TRIE, WORDS_TRIE, TRIGRAMS_TRIE):
+            trie = marisa_trie.Trie()
+            (trie.mmap if mmap else trie.load)(os.path.join(path, fichero))
+            tries.append(trie)
+        with open(os.path.join(path, DRUGS_FILE), "r", encoding="utf-8") as f:
+            drugs = json.load(f)
+        # np.asarray quita la subclase memmap (más lenta al indexar) sin copiar los datos
+        arrays = {nombre: np.asarray(np.load(os.path.join(path, f"{nombre}.npy"), mmap_mode="r" if mmap else None)) for nombre in ARRAYS}
+        return cls(*tries, drugs, arrays)
+
+    def _drugs(self, i):
+        return [self.drugs[d] for d in self.drug_ids[self.drug_offsets[i]:self.drug_offsets[i + 1]]]
+
+    def correct(self, palabra):
+        """
+        Palabra del vocabulario de los nombres más parecida a `palabra`.
+
+        Retorna:
+        - tuple: (palabra corregida, puntuación 0-1) o (None, 0.0) si no hay ninguna parecida.
+        """
+        if palabra in self._corrections:
+            return self._corrections[palabra]
+        mejor, score = None, 0.0
+
+        # Abreviatura: la palabra es el principio de una del vocabulario (se toma la más corta)
+        completadas = self.words.keys(palabra)
+        if completadas:
+            mejor = min(completadas, key=len)
+            score = PREFIX_BASE_SCORE + (1 - PREFIX_BASE_SCORE) * len(palabra) / len(mejor)
+
+        # Errata: candidatas por trigramas en común y comparación en detalle de las mejores
+        tris = trigrams(palabra)
+        listas = []
+        for t in tris:
+            if t in self.trigram_trie:
+                j = self.trigram_trie[t]
+                listas.append(self.tri_postings[self.tri_offsets[j]:self.tri_offsets[j + 1]])
+        if listas:
+            ids, comunes = np.unique(np.concatenate(listas), return_counts=True)
+            dice = 2 * comunes / (len(tris) + self.word_ntri[ids])
+            for i in ids[np.argsort(-dice)[:FUZZY_CANDIDATES]]:
+                matcher = SequenceMatcher(None, palabra, self.words.restore_key(int(i)))
+                if matcher.quick_ratio() > score and matcher.ratio() > score:
+                    mejor, score = matcher.b, matcher.ratio()
+
+        if len(self._corrections) >= MAX_CACHED_CORRECTIONS:
+            self._corrections.clear()
+        self._corrections[palabra] = (mejor, score)
+        return mejor, score
+
+    def candidates(self, query, limit=5, min_score=0.6):
+        """
+        Nombres de medicamentos que aparecen en la consulta, de mayor a menor puntuación.
+
+        Parámetros:
+        - query (str): consulta del usuario.
+        - limit (int): número máximo de candidatos.
+        - min_score (float): puntuación mínima.
+
+        Retorna:
+        - list: DrugMatch ordenados por puntuación.
+        """
+        # 1. Corrección de las palabras que no están en el vocabulario de los nombres
+        palabras, scores = [], []
+        for palabra in normalize_text(query).split():
+            score = 1.0
+            if palabra not in STOPWORDS and len(palabra) >= MIN_FUZZY_LENGTH and palabra not in self.words:
+                corregida, score = self.correct(palabra)
+                if score >= min_score:
+                    palabra = corregida
+            palabras.append(palabra)
+            scores.append(score)
+
+        # 2. Búsqueda exacta de los fragmentos de la consulta corregida
+        mejores = {}
+        for inicio in range(len(palabras)):
+            if palabras[inicio] in STOPWORDS or scores[inicio] < min_score:
+                continue
+            for n in range(1, min(MAX_NAME_WORDS, len(palabras) - inicio) + 1):
+                if scores[inicio + n - 1] < min_score:
+                    break
+                texto = " ".join(palabras[inicio:inicio + n])
+                if texto not in self.names:
+                    continue
+                i = self.names[texto]
+                score = (1.0 if self.name_kind[i] == NAME_FULL else 0.9) * min(scores[inicio:inicio + n])
+                if score >= min_score and (i not in mejores or score > mejores[i][0]):
+                    mejores[i] = (score, (inicio, inicio + n))
+
+        orden = sorted(mejores.items(), key=lambda x: (-x[1][0], x[1][1][0] - x[1][1][1]))[:limit]
+        return [DrugMatch(self.names.restore_key(i), score, span, self._drugs(i)) for i, (score, span) in orden]
+
+    def detect(self, query, min_score=0.6):
+        """
+        Menciones de medicamentos en la consulta: el mejor candidato de cada fragmento de la
+        consulta, sin solaparse, en el orden en que aparecen.
+
+        Retorna:
+        - list: DrugMatch.
+        """
+        menciones = []
+        for match in self.candidates(query, limit=20, min_score=min_score):
+            if all(match.span[1] <= m.span[0] or match.span[0] >= m.span[1] for m in menciones):
+                menciones.append(match)
+        return sorted(menciones, key=lambda m: m.span)
+
+
+# Función principal
+def main():
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import load_json, FRAGMENTS_PATH
+    from retrieval_bundle import current_bundle_path, NAMES_DIR
+
+    parser = argparse.ArgumentParser(description="Índice de nombres de medicamentos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Construye el índice a partir de los fragmentos")
+    build.add_argument("--fragments", default=FRAGMENTS_PATH)
+    build.add_argument("--output", required=True)
+    query = sub.add_parser("query", help="Muestra los candidatos de una o varias consultas")
+    query.add_argument("queries", nargs="+")
+    query.add_argument("--index", default=None, help="Carpeta del índice (por defecto, la del paquete activo)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        names = DrugNameIndex.build(load_json(args.fragments))
+        names.save(args.output)
+        print(f"{len(names)} nombres ({len(names.drugs)} medicamentos) en {args.output} ({time.perf_counter() - start:.1f} s)")
+        return
+
+    names = DrugNameIndex.load(args.index or os.path.join(current_bundle_path(), NAMES_DIR))
+    for q in args.queries:
+        start = time.perf_counter()
+        candidatos = names.candidates(q)
+        print(f"{q!r} ({(time.perf_counter() - start) * 1000:.2f} ms)")
+        for c in candidatos:
+            print(f"    {c.score:.2f}  {c.name}  ({len(c.drugs)} medicamentos)")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# embedding_store.py
+"""
+Almacén persistente de embeddings indexado por (modelo de embeddings, hash del texto). Los vectores se guardan en un fichero float32 al que solo se añaden filas y que se lee con mmap; una tabla de ids (JSON) relaciona el hash de cada texto con su fila.
+
+Así, al reconstruir el índice solo se embeben los textos nuevos o modificados (ver `retrieval_bundle.py update`).
+
+Estructura en disco:
+    embedding_store/
+        all-MiniLM-L6-v2/
+            vectors.f32     # matriz n x d en float32, fila a fila
+            ids.json        # {"model", "dim", "hashes": [hash de la fila 0, hash de la fila 1, ...]}
+"""
+
+# Librerías
+import os
+import json
+import time
+import logging
+
+import numpy as np
+
+from fragment_dedup import text_hash
+
+# Carpeta por defecto del almacén
+EMBEDDING_STORE_DIR = "./data/outputs/5_chatbot/embedding_store"
+
+VECTORS_FILE = "vectors.f32"
+IDS_FILE = "ids.json"
+
+
+class EmbeddingStore:
+    """
+    Embeddings de un modelo guardados por hash de texto.
+
+    Parámetros:
+    - store_dir (str): carpeta raíz del almacén.
+    - model_name (str): modelo de embeddings (cada modelo tiene su propia subcarpeta).
+    """
+
+    def __init__(self, store_dir, model_name):
+        self.model_name = model_name
+        self.path = os.path.join(store_dir, model_name.replace("/", "__"))
+        self.dim = None
+        self.hashes = []
+        self.rows = {}
+        self._vectors = None
+
+        ids_path = os.path.join(self.path, IDS_FILE)
+        if os.path.isfile(ids_path):
+            with open(ids_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["model"] != model_name:
+                raise ValueError(f"El almacén {self.path} es del modelo {meta['model']}, no de {model_name}")
+            self.dim = meta["dim"]
+            self.hashes = meta["hashes"]
+            self.rows = {h: i for i, h in enumerate(self.hashes)}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, texto_hash):
+        return texto_hash in self.rows
+
+    @property
+    def vectors(self):
+        """Matriz n x d de embeddings (mmap de solo lectura)."""
+        if self._vectors is None and self.hashes:
+            self._vectors = np.memmap(
+                os.path.join(self.path, VECTORS_FILE), dtype=np.float32, mode="r", shape=(len(self.hashes), self.dim)
+            )
+        return self._vectors
+
+    def get(self, hashes):
+        """Embeddings de los hashes indicados (todos deben estar en el almacén)."""
+        return np.asarray(self.vectors[[self.rows[h] for h in hashes]], dtype=np.float32)
+
+    def add(self, hashes, vectors):
+        """
+        Añade embeddings al final del almacén. Primero se escriben los vectores y después la
+        tabla de ids (de forma atómica), así que una escritura interrumpida no deja filas
+        sin vector: como mucho, vectores sobrantes al final del fichero, que se sobrescriben.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        nuevos = [(h, v) for h, v in zip(hashes, vectors) if h not in self.rows]
+        if not nuevos:
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Dimensión {vectors.shape[1]} distinta de la del almacén ({self.dim})")
+
+        os.makedirs(self.path, exist_ok=True)
+        self._vectors = None
+        with open(os.path.join(self.path, VECTORS_FILE), "ab") as f:
+            f.truncate(len(self.hashes) * self.dim * 4)
+            f.write(np.stack([v for _, v in nuevos]).tobytes())
+        for h, _ in nuevos:
+            self.rows[h] = len(self.hashes)
+            self.hashes.append(h)
+
+        ids_path = os.path.join(self.path, IDS_FILE)
+        with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "hashes": self.hashes}, f)
+        os.replace(ids_path + ".tmp", ids_path)
+
+    def encode(self, texts, embed, batch_size=256, stats=None):
+        """
+        Embeddings de una lista de textos: se leen del almacén y solo se embeben (y se
+        guardan) los que faltan.
+
+        Parámetros:
+        - texts (list): textos.
+        - embed (callable): función lista de textos -> matriz de embeddings.
+        - batch_size (int): textos nuevos embebidos (y guardados) por lote.
+        - stats (dict): se rellena con "hits", "misses" y "embedding_s".
+
+        Retorna:
+        - np.ndarray: matriz len(texts) x d en el orden de `texts`.
+        """
+        stats = {} if stats is None else stats
+        hashes = [text_hash(t) for t in texts]
+        pendientes = {}
+        for h, t in zip(hashes, texts):
+            if h not in self.rows and h not in pendientes:
+                pendientes[h] = t
+
+        start = time.perf_counter()
+        items = list(pendientes.items())
+        for i in range(0, len(items), batch_size):
+            lote = items[i:i + batch_size]
+            self.add([h for h, _ in lote], embed([t for _, t in lote]))
+            logging.info(f"Embebidos {min(i + batch_size, len(items))}/{len(items)} textos nuevos")
+        stats.update(hits=len(texts) - len(pendientes), misses=len(pendientes), embedding_s=time.perf_counter() - start)
+        return self.get(hashes) if hashes else np.zeros((0, self.dim or 0), dtype=np.float32)
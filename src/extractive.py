@@ -0,0 +1,177 @@
+# extractive.py
+"""
+Respuestas extractivas: se construyen con las frases de los fragmentos recuperados, sin pasar por el LLM.
+
+En muchas consultas de sección ("posología del ibuprofeno") la mejor respuesta es el propio texto de la ficha técnica, y generarla con un modelo de 7B en CPU tarda decenas de segundos. La respuesta extractiva divide en frases los primeros fragmentos recuperados, las ordena por su similitud con la consulta (coseno entre embeddings si se pasa el modelo de embeddings; si no, términos de la consulta ponderados por IDF) y devuelve las mejores en el orden en que aparecen en la ficha, con la cita (medicamento y sección) de cada fragmento. Tarda milisegundos.
+
+Uso:
+    python src/extractive.py "¿qué dosis de ibuprofeno puedo tomar?" [--model-name llama2]
+"""
+
+# Librerías
+import os
+import re
+import math
+import time
+import argparse
+
+import numpy as np
+
+from fragment_dedup import fragment_citation
+from sparse_index import tokenize
+
+# Fragmentos de los que se extraen frases y número máximo de frases de la respuesta
+EXTRACTIVE_MAX_FRAGMENTS = 3
+EXTRACTIVE_MAX_SENTENCES = 5
+
+# Longitud máxima (en caracteres) de cada frase y de la respuesta
+EXTRACTIVE_MAX_SENTENCE_CHARS = 400
+EXTRACTIVE_MAX_CHARS = 1500
+
+# Frases con menos palabras (ej. títulos o restos de viñetas) no se extraen
+MIN_SENTENCE_WORDS = 4
+
+# Peso de la posición (fragmento y frase) frente a la similitud con la consulta
+POSITION_WEIGHT = 0.1
+
+# Las frases de los fragmentos que no son el primero solo se extraen si su similitud con la
+# consulta es al menos esta fracción de la mejor
+MIN_RELATIVE_SCORE = 0.5
+
+# Texto de la respuesta cuando no hay fragmentos
+NO_ANSWER = "No he encontrado información sobre esta consulta en las fichas técnicas disponibles."
+
+# Final de frase: signo de puntuación seguido de mayúscula, número o viñeta, o salto de línea
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+(?=[A-ZÁÉÍÓÚÑ¿¡0-9•\-])|\s*\n+\s*")
+
+
+# Función para dividir un texto en frases
+def split_sentences(texto):
+    """Frases del texto con al menos MIN_SENTENCE_WORDS palabras, recortadas a EXTRACTIVE_MAX_SENTENCE_CHARS."""
+    frases = []
+    for frase in _SENTENCE_END.split(texto):
+        frase = " ".join(frase.strip(" •-").split())
+        if len(frase.split()) < MIN_SENTENCE_WORDS:
+            continue
+        if len(frase) > EXTRACTIVE_MAX_SENTENCE_CHARS:
+            frase = frase[:EXTRACTIVE_MAX_SENTENCE_CHARS].rsplit(" ", 1)[0] + "..."
+        frases.append(frase)
+    return frases
+
+
+# Función para puntuar las frases por los términos de la consulta
+def _lexical_scores(query, frases):
+    """Suma del IDF (sobre las frases candidatas) de los términos de la consulta que aparecen en cada frase."""
+    terminos = set(tokenize(query))
+    conjuntos = [set(tokenize(frase)) for frase in frases]
+    n = len(frases)
+    idf = {t: math.log(1 + (n + 1) / (1 + sum(t in c for c in conjuntos))) for t in terminos}
+    return np.array(
+        [sum(idf[t] for t in terminos & c) / math.sqrt(len(c) + 1) for c in conjuntos], dtype=np.float32,
+    )
+
+
+# Función para puntuar las frases por similitud de embeddings
+def _embedding_scores(query_embedding, frases, embedding_model):
+    """Similitud coseno entre el embedding de la consulta y el de cada frase."""
+    embeddings = embedding_model.encode(frases, convert_to_numpy=True, batch_size=64)
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    return embeddings @ (query_embedding / max(np.linalg.norm(query_embedding), 1e-12))
+
+
+# Función para construir la respuesta extractiva
+def extractive_answer(query, fragments, max_sentences=EXTRACTIVE_MAX_SENTENCES, max_fragments=EXTRACTIVE_MAX_FRAGMENTS, max_chars=EXTRACTIVE_MAX_CHARS, embedding_model=None, query_embedding=None, stats=None):
+    """
+    Responde con las frases de los fragmentos más parecidas a la consulta.
+
+    Parámetros:
+    - query (str): consulta del usuario.
+    - fragments (list): fragmentos recuperados, del más al menos relevante.
+    - max_sentences (int): número máximo de frases de la respuesta.
+    - max_fragments (int): número de fragmentos de los que se extraen frases.
+    - max_chars (int): longitud máxima de las frases de la respuesta.
+    - embedding_model, query_embedding: si se indican, las frases se ordenan por similitud de
+      embeddings; si no, por los términos de la consulta.
+    - stats (dict): se rellena con "candidates", "sentences", "fragments", "scoring" y "s" (segundos).
+
+    Retorna:
+    - str: respuesta con las frases extraídas y las fuentes citadas.
+    """
+    start = time.perf_counter()
+    candidatas, vistas = [], set()  # (posición del fragmento, posición de la frase, frase)
+    for rank, frag in enumerate(fragments[:max_fragments]):
+        for pos, frase in enumerate(split_sentences(frag.get("texto") or "")):
+            # Los genéricos repiten las mismas frases: cada una se extrae una sola vez
+            clave = frase.lower()
+            if clave not in vistas:
+                vistas.add(clave)
+                candidatas.append((rank, pos, frase))
+
+    scoring = "embedding" if embedding_model is not None and query_embedding is not None else "lexical"
+    if not candidatas:
+        if stats is not None:
+            stats.update(candidates=0, sentences=0, fragments=0, scoring=scoring, s=time.perf_counter() - start)
+        return NO_ANSWER
+
+    frases = [frase for _, _, frase in candidatas]
+    if scoring == "embedding":
+        scores = _embedding_scores(query_embedding, frases, embedding_model)
+    else:
+        scores = _lexical_scores(query, frases)
+    minimo = MIN_RELATIVE_SCORE * scores.max() if scores.max() > 0 else np.inf
+    # A igual similitud, mejor los primeros fragmentos y las primeras frases de cada sección
+    ordenacion = scores + POSITION_WEIGHT * np.array([1 / (1 + rank) + 0.5 / (1 + pos) for rank, pos, _ in candidatas])
+
+    elegidas, longitud = [], 0
+    for i in np.argsort(-ordenacion, kind="stable"):
+        if len(elegidas) == max_sentences:
+            break
+        if candidatas[i][0] > 0 and scores[i] < minimo:
+            continue
+        if elegidas and longitud + len(frases[i]) > max_chars:
+            continue
+        elegidas.append(candidatas[i])
+        longitud += len(frases[i])
+    elegidas.sort()
+
+    # Citas numeradas por fragmento, en el orden de la recuperación
+    citas = {}
+    lineas = ["Según las fichas técnicas:", ""]
+    for rank, _, frase in elegidas:
+        n = citas.setdefault(rank, len(citas) + 1)
+        lineas.append(f"- {frase} [{n}]")
+    lineas += ["", "Fuentes:"]
+    for rank, n in citas.items():
+        medicamento, categoria = fragment_citation(fragments[rank])
+        lineas.append(f"- [{n}] {medicamento} — {categoria}")
+
+    if stats is not None:
+        stats.update(
+            candidates=len(candidatas), sentences=len(elegidas), fragments=len(citas), scoring=scoring,
+            s=time.perf_counter() - start,
+        )
+    return "\n".join(lineas)
+
+
+# Función principal
+def main():
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import answer_query
+
+    parser = argparse.ArgumentParser(description="Responde a consultas con frases de los fragmentos recuperados, sin LLM")
+    parser.add_argument("queries", nargs="+")
+    parser.add_argument("--model-name", default="llama2")
+    args = parser.parse_args()
+
+    for query in args.queries:
+        stats = {}
+        respuesta = answer_query(query, args.model_name, use_cache=False, stats=stats, mode="extractive")
+        print(f"{query!r} ({stats['retrieval']['path']}, {stats['extractive']['s'] * 1000:.1f} ms):\n{respuesta}\n")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# fragment_dedup.py
+"""
+Deduplicación de los fragmentos del chatbot por hash de contenido. Los genéricos de un mismo principio activo comparten secciones idénticas palabra por palabra (ej. "ibuprofeno sandoz" e "ibuprofeno normon"), así que cada copia se embebía, ocupaba un vector del índice y podía llenar varios de los k huecos de la recuperación.
+
+Cada texto distinto se guarda una sola vez, identificado por su hash, con la lista de todos los (medicamento, categoría) que lo usan en "fuentes". Los campos "medicamento" y "categoria" del fragmento son los de la primera fuente, así que el resto del código no cambia; la lista completa solo se expande al formatear la cita del fragmento en el contexto (`fragment_citation`).
+
+Uso:
+    python src/fragment_dedup.py build [--fragments RUTA] [--embeddings RUTA] [--factory Flat]
+    python src/fragment_dedup.py report [--fragments RUTA] [--k 10]
+"""
+
+# Librerías
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import functools
+
+import numpy as np
+
+# Rutas por defecto de los fragmentos, embeddings e índice deduplicados
+FRAGMENTS_DEDUP_PATH = "./data/outputs/5_chatbot/contexto_medicamentos_chatbot_dedup.json"
+EMBEDDINGS_DEDUP_PATH = "./data/outputs/5_chatbot/embeddings_all-MiniLM-L6-v2_dedup.npy"
+FAISS_INDEX_DEDUP_PATH = "./data/outputs/5_chatbot/faiss_index_dedup.bin"
+
+# Campos que identifican la procedencia de un fragmento
+SOURCE_FIELDS = ("medicamento", "nombre_medicamento_completo", "categoria")
+
+# Número máximo de medicamentos listados en la cita de un fragmento compartido
+MAX_CITED = 5
+
+
+# Función para calcular el hash del contenido de un fragmento
+def text_hash(texto):
+    """Hash del texto normalizado (espacios colapsados): dos copias literales tienen el mismo hash."""
+    return hashlib.sha256(" ".join(texto.split()).encode("utf-8")).hexdigest()[:16]
+
+
+# Función para deduplicar los fragmentos por contenido
+def dedup_fragments(fragments):
+    """
+    Agrupa los fragmentos con el mismo texto.
+
+    Parámetros:
+    - fragments (list): fragmentos con "medicamento", "categoria" y "texto".
+
+    Retorna:
+    - tuple: (fragmentos únicos con "hash" y "fuentes", posición de la primera aparición de
+      cada fragmento único en la lista original)
+    """
+    unicos = []
+    primera = []
+    por_hash = {}
+    for i, frag in enumerate(fragments):
+        h = text_hash(frag["texto"])
+        fuente = {campo: frag[campo] for campo in SOURCE_FIELDS if campo in frag}
+        if h in por_hash:
+            unico = unicos[por_hash[h]]
+            if fuente not in unico["fuentes"]:
+                unico["fuentes"].append(fuente)
+            continue
+        por_hash[h] = len(unicos)
+        unicos.append({**frag, "hash": h, "fuentes": [fuente]})
+        primera.append(i)
+    return unicos, primera
+
+
+# Función para obtener la cita de un fragmento (medicamentos y categorías que lo usan)
+def fragment_citation(fragment, max_cited=MAX_CITED):
+    """
+    Medicamento y categoría de un fragmento tal y como se citan en el contexto. En los
+    fragmentos compartidos se listan todos los medicamentos (hasta `max_cited`) y categorías.
+
+    Retorna:
+    - tuple: (medicamento, categoría) como texto.
+    """
+    fuentes = fragment.get("fuentes")
+    if not fuentes or len(fuentes) == 1:
+        return fragment["medicamento"], fragment["categoria"]
+    medicamentos = list(dict.fromkeys(f["medicamento"] for f in fuentes))
+    categorias = list(dict.fromkeys(f["categoria"] for f in fuentes))
+    medicamento = ", ".join(medicamentos[:max_cited])
+    if len(medicamentos) > max_cited:
+        medicamento += f" y {len(medicamentos) - max_cited} más"
+    return medicamento, ", ".join(categorias)
+
+
+# Función para contar los fragmentos distintos de cada consulta
+def distinct_per_query(indices, fragments):
+    """Número medio de textos distintos entre los k resultados de cada consulta."""
+    return float(np.mean([len({text_hash(fragments[i]["texto"]) for i in fila if i >= 0}) for fila in indices]))
+
+
+# Función para comparar la recuperación antes y después de deduplicar
+def dedup_report(fragments, embed, queries, k=10, factory="Flat"):
+    """
+    Embebe los fragmentos con y sin deduplicar y compara el tiempo de embedding, el tamaño
+    del índice y el número de fragmentos distintos entre los k resultados de cada consulta.
+
+    Parámetros:
+    - fragments (list): fragmentos originales.
+    - embed (callable): función lista de textos -> matriz de embeddings.
+    - queries (np.ndarray): embeddings de las consultas.
+    - k (int): número de resultados por consulta.
+    - factory (str): cadena de la index_factory de FAISS del índice.
+
+    Retorna:
+    - dict: métricas "before" y "after".
+    """
+    from index_factory import build_index, index_nbytes
+
+    unicos, primera = dedup_fragments(fragments)
+    es_primera = np.zeros(len(fragments), dtype=bool)
+    es_primera[primera] = True
+    duplicados = [frag["texto"] for frag, p in zip(fragments, es_primera) if not p]
+
+    # Los textos únicos se embeben una vez; las copias solo se embebían antes de deduplicar
+    start = time.perf_counter()
+    emb_unicos = np.asarray(embed([frag["texto"] for frag in unicos]), dtype=np.float32)
+    t_unicos = time.perf_counter() - start
+    start = time.perf_counter()
+    emb_duplicados = np.asarray(embed(duplicados), dtype=np.float32) if duplicados else np.zeros((0, emb_unicos.shape[1]), np.float32)
+    t_duplicados = time.perf_counter() - start
+
+    emb_todos = np.empty((len(fragments), emb_unicos.shape[1]), dtype=np.float32)
+    emb_todos[es_primera] = emb_unicos
+    emb_todos[~es_primera] = emb_duplicados
+
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    resultado = {}
+    for nombre, frags, emb, t in (
+        ("before", fragments, emb_todos, t_unicos + t_duplicados),
+        ("after", unicos, emb_unicos, t_unicos),
+    ):
+        index, _ = build_index(emb, factory)
+        resultado[nombre] = {
+            "fragments": len(frags),
+            "embedding_s": t,
+            "index_bytes": index_nbytes(index),
+            "distinct_per_query": distinct_per_query(index.search(queries, k)[1], frags),
+        }
+    return resultado
+
+
+# Función principal
+def main():
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import load_json, FRAGMENTS_PATH, EMBEDDING_MODEL_NAME
+    from index_factory import EMBEDDINGS_PATH, build_index, index_nbytes
+
+    parser = argparse.ArgumentParser(description="Deduplicación de fragmentos por hash de contenido")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Escribe los fragmentos, embeddings e índice deduplicados")
+    build.add_argument("--fragments", default=FRAGMENTS_PATH)
+    build.add_argument("--embeddings", default=EMBEDDINGS_PATH, help="Embeddings de los fragmentos originales (se reutilizan si existen)")
+    build.add_argument("--factory", default="Flat")
+    build.add_argument("--output-fragments", default=FRAGMENTS_DEDUP_PATH)
+    build.add_argument("--output-embeddings", default=EMBEDDINGS_DEDUP_PATH)
+    build.add_argument("--output-index", default=FAISS_INDEX_DEDUP_PATH)
+    report = sub.add_parser("report", help="Compara la recuperación antes y después de deduplicar")
+    report.add_argument("--fragments", default=FRAGMENTS_PATH)
+    report.add_argument("--queries", default=None, help="Embeddings de consultas (.npy); por defecto, del corpus con ruido")
+    report.add_argument("--k", type=int, default=10)
+    report.add_argument("--factory", default="Flat")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    fragments = load_json(args.fragments)
+
+    @functools.lru_cache(maxsize=1)
+    def embedder():
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+    def embed(texts):
+        return embedder().encode(texts, convert_to_numpy=True, batch_size=64)
+
+    if args.command == "build":
+        import faiss
+
+        unicos, primera = dedup_fragments(fragments)
+        if os.path.exists(args.embeddings) and len(np.load(args.embeddings, mmap_mode="r")) == len(fragments):
+            embeddings = np.load(args.embeddings)[primera].astype(np.float32)
+        else:
+            embeddings = np.asarray(embed([frag["texto"] for frag in unicos]), dtype=np.float32)
+        index, build_s = build_index(embeddings, args.factory)
+
+        with open(args.output_fragments, "w", encoding="utf-8") as f:
+            json.dump(unicos, f, ensure_ascii=False, indent=4)
+        np.save(args.output_embeddings, embeddings)
+        faiss.write_index(index, args.output_index)
+        logging.info(
+            f"{len(fragments)} fragmentos -> {len(unicos)} únicos; índice de {index_nbytes(index) / 1024**2:.1f} MB "
+            f"en {args.output_index} (empaquetar con: retrieval_bundle.py build --index {args.output_index} "
+            f"--fragments {args.output_fragments})"
+        )
+    else:
+        from index_factory import sample_queries
+
+        queries = np.load(args.queries) if args.queries else None
+        if queries is None:
+            # Consultas cercanas a fragmentos del corpus (embebidos una sola vez)
+            muestra = np.random.default_rng(0).choice(len(fragments), min(300, len(fragments)), replace=False)
+            queries = sample_queries(np.asarray(embed([fragments[i]["texto"] for i in muestra]), dtype=np.float32))
+        r = dedup_report(fragments, embed, queries, args.k, args.factory)
+        print(f"{'':>7} | {'fragmentos':>10} | {'embedding (s)':>13} | {'índice (MB)':>11} | {f'distintos en top-{args.k}':>16}")
+        for nombre, etiqueta in (("before", "antes"), ("after", "después")):
+            m = r[nombre]
+            print(
+                f"{etiqueta:>7} | {m['fragments']:>10} | {m['embedding_s']:>13.1f} | "
+                f"{m['index_bytes'] / 1024**2:>11.1f} | {m['distinct_per_query']:>16.2f}"
+            )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# fragment_store.py
+"""
+Almacén columnar de fragmentos: alternativa binaria al JSON `contexto_medicamentos_chatbot.json` (lista de diccionarios con indent=4), que hay que parsear entero y ocupa en memoria un diccionario de Python por fragmento.
+
+Cada campo de los fragmentos es una columna con dos ficheros: los desplazamientos de cada fila (`<campo>.offsets.npy`, int64) y los valores concatenados (`<campo>.bin`, UTF-8), salvo los campos enteros (ej. "faiss_id"), que se guardan como un único `<campo>.npy`. Los campos de texto presentes en todos los fragmentos se guardan tal cual; el resto (ej. "fuentes" de los fragmentos deduplicados o campos que faltan en algunos fragmentos) se guardan como JSON, con una fila vacía cuando el fragmento no tiene el campo. `schema.json` indica el número de filas y el tipo de cada columna.
+
+Los ficheros se abren con mmap, así que abrir el almacén no lee los fragmentos: `store[i]` construye solo el diccionario del fragmento i y las páginas se comparten entre los procesos que sirven el mismo paquete. `FragmentStore` se comporta como la lista de fragmentos (len, índices, iteración), así que el resto del código no cambia.
+
+Uso:
+    python src/fragment_store.py build [--fragments RUTA] --output CARPETA
+    python src/fragment_store.py get CARPETA 0 15 42
+"""
+
+# Librerías
+import os
+import json
+import mmap
+import time
+import argparse
+from collections.abc import Sequence
+
+import numpy as np
+
+# Fichero con el número de filas y el tipo de cada columna
+SCHEMA_FILE = "schema.json"
+
+# Tipos de columna
+COLUMN_STR, COLUMN_INT, COLUMN_JSON = "str", "int", "json"
+
+# Marca de los campos que faltan en un fragmento
+_MISSING = object()
+
+
+# Función para deducir el tipo de una columna
+def _column_type(valores):
+    """str si todos los fragmentos tienen el campo como texto, int si es entero y json en otro caso."""
+    if all(isinstance(v, str) for v in valores):
+        return COLUMN_STR
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in valores):
+        return COLUMN_INT
+    return COLUMN_JSON
+
+
+# Función para escribir los fragmentos en formato columnar
+def write_fragment_store(fragments, path):
+    """
+    Escribe los fragmentos en la carpeta `path` (ver la descripción del módulo).
+
+    Retorna:
+    - list: ficheros escritos (relativos a `path`).
+    """
+    os.makedirs(path, exist_ok=True)
+    columnas = list(dict.fromkeys(campo for frag in fragments for campo in frag))
+    schema = {"num_rows": len(fragments), "columns": {}}
+    ficheros = [SCHEMA_FILE]
+    for campo in columnas:
+        valores = [frag.get(campo, _MISSING) for frag in fragments]
+        tipo = _column_type(valores)
+        schema["columns"][campo] = tipo
+        if tipo == COLUMN_INT:
+            np.save(os.path.join(path, f"{campo}.npy"), np.asarray(valores, dtype=np.int64))
+            ficheros.append(f"{campo}.npy")
+            continue
+        if tipo == COLUMN_STR:
+            filas = [v.encode("utf-8") for v in valores]
+        else:
+            filas = [b"" if v is _MISSING else json.dumps(v, ensure_ascii=False).encode("utf-8") for v in valores]
+        with open(os.path.join(path, f"{campo}.bin"), "wb") as f:
+            f.write(b"".join(filas))
+        np.save(os.path.join(path, f"{campo}.offsets.npy"), np.cumsum([0] + [len(x) for x in filas]).astype(np.int64))
+        ficheros += [f"{campo}.bin", f"{campo}.offsets.npy"]
+
+    with open(os.path.join(path, SCHEMA_FILE), "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False, indent=4)
+    return ficheros
+
+
+class FragmentStore(Sequence):
+    """
+    Fragmentos en formato columnar, abiertos con mmap y leídos fila a fila bajo demanda.
+
+    Parámetros:
+    - path (str): carpeta escrita por `write_fragment_store`.
+    - mmap (bool): si es False, las columnas se leen enteras a memoria (como bytes, no como dicts).
+
+    Uso:
+        fragments = FragmentStore(carpeta)
+        fragments[42]                   # dict del fragmento 42
+        fragments.column("categoria")   # lista con el campo de todos los fragmentos
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        with open(os.path.join(path, SCHEMA_FILE), "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        self.num_rows = schema["num_rows"]
+        self.columns = schema["columns"]
+        # Las columnas se leen con memoryview y mmap.mmap: indexarlos devuelve int y bytes de
+        # Python directamente, mucho más rápido que indexar arrays de numpy elemento a elemento
+        self._ints, self._blobs, self._offsets = {}, {}, {}
+        for campo, tipo in self.columns.items():
+            if tipo == COLUMN_INT:
+                self._ints[campo] = self._load_array(os.path.join(path, f"{campo}.npy"))
+                continue
+            self._offsets[campo] = self._load_array(os.path.join(path, f"{campo}.offsets.npy"))
+            self._blobs[campo] = self._load_blob(os.path.join(path, f"{campo}.bin"))
+
+    def _load_array(self, path):
+        return memoryview(np.ascontiguousarray(np.load(path, mmap_mode="r" if self.mmap else None)))
+
+    def _load_blob(self, path):
+        with open(path, "rb") as f:
+            if not self.mmap or os.path.getsize(path) == 0:
+                return f.read()
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def nbytes(self):
+        """Memoria propia del proceso (con mmap, las columnas son páginas compartidas del fichero)."""
+        arrays = [*self._ints.values(), *self._offsets.values(), *self._blobs.values()]
+        return sum(len(a) if isinstance(a, bytes) else a.nbytes for a in arrays) if not self.mmap else 0
+
+    def _value(self, campo, i):
+        """Valor del campo en la fila i, o _MISSING si el fragmento no lo tiene."""
+        if campo in self._ints:
+            return self._ints[campo][i]
+        offsets = self._offsets[campo]
+        inicio, fin = offsets[i], offsets[i + 1]
+        if self.columns[campo] == COLUMN_STR:
+            return self._blobs[campo][inicio:fin].decode("utf-8")
+        return json.loads(self._blobs[campo][inicio:fin]) if fin > inicio else _MISSING
+
+    def _row(self, i):
+        fila = {}
+        for campo in self.columns:
+            valor = self._value(campo, i)
+            if valor is not _MISSING:
+                fila[campo] = valor
+        return fila
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._row(j) for j in range(*i.indices(self.num_rows))]
+        i = int(i)
+        if i < 0:
+            i += self.num_rows
+        if not 0 <= i < self.num_rows:
+            raise IndexError(f"Fragmento {i} fuera de rango ({self.num_rows} fragmentos)")
+        return self._row(i)
+
+    def __iter__(self):
+        return (self._row(i) for i in range(self.num_rows))
+
+    def column(self, campo):
+        """Valores de un campo en todos los fragmentos (None si falta), sin construir las filas."""
+        if campo not in self.columns:
+            return [None] * self.num_rows
+        if campo in self._ints:
+            return self._ints[campo].tolist()
+        offsets = self._offsets[campo].tolist()
+        blob = self._blobs[campo][:]
+        if self.columns[campo] == COLUMN_STR:
+            return [blob[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+        return [json.loads(blob[a:b]) if b > a else None for a, b in zip(offsets, offsets[1:])]
+
+
+# Función para leer un campo de todos los fragmentos
+def fragment_column(fragments, campo):
+    """
+    Valores de un campo en todos los fragmentos (None si falta). Con un FragmentStore se lee
+    solo la columna, sin construir los diccionarios de las filas.
+    """
+    if isinstance(fragments, FragmentStore):
+        return fragments.column(campo)
+    return [frag.get(campo) for frag in fragments]
+
+
+# Función principal
+def main():
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import load_json, FRAGMENTS_PATH
+
+    parser = argparse.ArgumentParser(description="Almacén columnar de fragmentos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Convierte el JSON de fragmentos al formato columnar")
+    build.add_argument("--fragments", default=FRAGMENTS_PATH)
+    build.add_argument("--output", required=True)
+    get = sub.add_parser("get", help="Muestra fragmentos por posición")
+    get.add_argument("store")
+    get.add_argument("ids", nargs="+", type=int)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        fragments = load_json(args.fragments)
+        ficheros = write_fragment_store(fragments, args.output)
+        print(f"{len(fragments)} fragmentos en {args.output} ({len(ficheros)} ficheros, {time.perf_counter() - start:.1f} s)")
+        return
+
+    store = FragmentStore(args.store)
+    for i in args.ids:
+        print(json.dumps(store[i], ensure_ascii=False, indent=4))
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# fragment_tokens.py
+"""
+Almacén de fragmentos pre-tokenizados. Al construir el índice se calculan una sola vez los ids de los tokens del texto de cada fragmento de `contexto_medicamentos_chatbot.json` para cada tokenizador soportado (llama2 y gpt2) y se guardan como un array plano de ids + un array de offsets (.npy, abiertos con mmap). En cada consulta el prompt se ensambla concatenando esos arrays en lugar de tokenizar el texto de los fragmentos.
+
+Cada almacén guarda en sus metadatos la huella del corpus con el que se construyó (sha256 del JSON de fragmentos, también en los paquetes de recuperación) y solo se usa con ese corpus: si se edita el texto de un fragmento, el almacén se descarta en lugar de dar al LLM ids de otro texto. Los paquetes de recuperación (`retrieval_bundle.py`) incluyen sus almacenes en la carpeta tokens/.
+
+Uso (construcción de los almacenes):
+    python src/fragment_tokens.py [--models llama2 gpt2]
+"""
+
+# Librerías
+import os
+import json
+import hashlib
+import logging
+import argparse
+from functools import lru_cache
+
+import numpy as np
+
+from fragment_dedup import fragment_citation
+
+# Carpeta por defecto de los almacenes de tokens
+TOKEN_STORE_DIR = "./data/outputs/5_chatbot/fragment_tokens"
+
+# Tokenizadores soportados
+TOKENIZER_NAMES = {"llama2": "meta-llama/Llama-2-7b-chat-hf", "gpt2": "gpt2-large"}
+
+# Texto ancla para tokenizar piezas que van en mitad del prompt (ver encode_continuation)
+_ANCHOR = ":"
+
+
+# Función para tokenizar textos como continuación de un texto anterior
+def encode_continuation(tokenizer, texts):
+    """
+    Tokeniza cada texto como si fuera precedido por el ancla ":" y elimina los ids del ancla.
+    Así, los tokenizadores que añaden un espacio inicial a cada texto (SentencePiece de
+    Llama-2) producen los mismos ids que al tokenizar el prompt completo de una vez.
+
+    Retorna:
+    - list: lista de listas de ids (una por texto).
+    """
+    anchor = tokenizer(_ANCHOR, add_special_tokens=False)["input_ids"]
+    batch = tokenizer([_ANCHOR + text for text in texts], add_special_tokens=False)["input_ids"]
+    resultado = []
+    for text, ids in zip(texts, batch):
+        if ids[:len(anchor)] == anchor:
+            resultado.append(ids[len(anchor):])
+        else:
+            resultado.append(tokenizer(text, add_special_tokens=False)["input_ids"])
+    return resultado
+
+
+class FragmentTokenStore:
+    """
+    Ids de los tokens del texto de cada fragmento para un tokenizador concreto.
+
+    Parámetros:
+    - ids (np.ndarray): ids de todos los fragmentos concatenados (int32).
+    - offsets (np.ndarray): offsets[i]:offsets[i+1] delimita los ids del fragmento i.
+    - meta (dict): tokenizador usado, número de fragmentos y huella del corpus ("corpus").
+    """
+
+    def __init__(self, ids, offsets, meta):
+        self.ids = ids
+        self.offsets = offsets
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, fragment_id):
+        """Ids de los tokens del texto del fragmento (vista, sin copia)."""
+        return self.ids[self.offsets[fragment_id]:self.offsets[fragment_id + 1]]
+
+    def num_tokens(self, fragment_id):
+        return int(self.offsets[fragment_id + 1] - self.offsets[fragment_id])
+
+    @property
+    def nbytes(self):
+        return int(self.ids.nbytes + self.offsets.nbytes)
+
+    @staticmethod
+    def paths(store_dir, model_name):
+        base = os.path.join(store_dir, model_name)
+        return base + "_ids.npy", base + "_offsets.npy", base + "_meta.json"
+
+    @classmethod
+    def build(cls, texts, tokenizer, batch_size=1000, corpus=None):
+        """
+        Tokeniza los textos de los fragmentos por lotes y construye el almacén en memoria. Cada
+        texto se guarda con el espacio que lo separa de la cabecera "Información:". `corpus` es
+        la huella del corpus de los textos (ver corpus_fingerprint).
+        """
+        all_ids, offsets = [], [0]
+        for start in range(0, len(texts), batch_size):
+            batch = encode_continuation(tokenizer, [" " + text for text in texts[start:start + batch_size]])
+            for ids in batch:
+                all_ids.extend(ids)
+                offsets.append(len(all_ids))
+        meta = {
+            "tokenizer": tokenizer.name_or_path, "vocab_size": len(tokenizer), "num_fragments": len(texts), "corpus": corpus,
+        }
+        return cls(np.asarray(all_ids, dtype=np.int32), np.asarray(offsets, dtype=np.int64), meta)
+
+    def save(self, store_dir, model_name):
+        os.makedirs(store_dir, exist_ok=True)
+        ids_path, offsets_path, meta_path = self.paths(store_dir, model_name)
+        np.save(ids_path, self.ids)
+        np.save(offsets_path, self.offsets)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=4)
+
+    @classmethod
+    def load(cls, store_dir, model_name, tokenizer=None, num_fragments=None, corpus=None):
+        """
+        Abre el almacén con mmap. Devuelve None si no existe o no corresponde al tokenizador
+        o al corpus actuales (en ese caso se tokeniza el texto como antes). Con `corpus`, la
+        huella guardada debe coincidir (los almacenes sin huella se descartan).
+        """
+        ids_path, offsets_path, meta_path = cls.paths(store_dir, model_name)
+        if not all(os.path.isfile(p) for p in (ids_path, offsets_path, meta_path)):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if tokenizer is not None and (
+            meta["tokenizer"] != tokenizer.name_or_path or meta["vocab_size"] != len(tokenizer)
+        ):
+            logging.warning(f"Almacén de tokens de {model_name} construido con otro tokenizador: se ignora")
+            return None
+        if num_fragments is not None and meta["num_fragments"] != num_fragments:
+            logging.warning(f"Almacén de tokens de {model_name} de otra versión del corpus: se ignora")
+            return None
+        if corpus is not None and meta.get("corpus") != corpus:
+            logging.warning(f"Almacén de tokens de {model_name} construido con otro texto de los fragmentos: se ignora")
+            return None
+        return cls(np.load(ids_path, mmap_mode="r"), np.load(offsets_path, mmap_mode="r"), meta)
+
+
+# Función para calcular la huella del JSON de fragmentos
+@lru_cache(maxsize=8)
+def _file_fingerprint(path, size, mtime_ns):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def corpus_fingerprint(fragments_path):
+    """sha256 del JSON de fragmentos (se recalcula solo si cambian su tamaño o su fecha)."""
+    st = os.stat(fragments_path)
+    return _file_fingerprint(os.path.abspath(fragments_path), st.st_size, st.st_mtime_ns)
+
+
+# Función para construir y guardar los almacenes de varios tokenizadores
+def build_token_stores(texts, store_dir, models=None, corpus=None):
+    """
+    Construye y guarda el almacén de tokens de cada modelo. Los tokenizadores que no se pueden
+    cargar (ej. sin acceso al repositorio de Llama-2) se omiten con un aviso.
+
+    Retorna:
+    - list: ficheros escritos (relativos a `store_dir`).
+    """
+    from transformers import AutoTokenizer
+
+    ficheros = []
+    for model_name in models if models is not None else TOKENIZER_NAMES:
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAMES[model_name], use_fast=True)
+        except (OSError, ValueError) as e:
+            logging.warning(f"No se pudo cargar el tokenizador de {model_name}: sin almacén de tokens ({e})")
+            continue
+        store = FragmentTokenStore.build(texts, tokenizer, corpus=corpus)
+        store.save(store_dir, model_name)
+        ficheros += [os.path.relpath(p, store_dir) for p in FragmentTokenStore.paths(store_dir, model_name)]
+        logging.info(f"{model_name}: {len(store)} fragmentos, {len(store.ids)} tokens guardados en {store_dir}")
+    return ficheros
+
+
+class PromptAssembler:
+    """
+    Ensambla los ids del prompt concatenando arrays ya tokenizados: prefijo fijo, cabecera
+    de cada fragmento (memorizada), ids del texto del fragmento y el cierre con la pregunta.
+
+    Parámetros:
+    - tokenizer: tokenizador del modelo.
+    - store (FragmentTokenStore): ids pre-tokenizados de los fragmentos.
+    """
+
+    def __init__(self, tokenizer, store):
+        self.tokenizer = tokenizer
+        self.store = store
+        self._encode = lru_cache(maxsize=65536)(self._encode_uncached)
+
+    def _encode_uncached(self, text, add_special_tokens=False, continuation=False):
+        if continuation:
+            return tuple(encode_continuation(self.tokenizer, [text])[0])
+        return tuple(self.tokenizer(text, add_special_tokens=add_special_tokens)["input_ids"])
+
+    def encode(self, text, add_special_tokens=False, continuation=False):
+        """
+        Tokeniza textos cortos y repetidos (cabeceras, plantillas) con memoria. Con
+        `continuation` se tokenizan como continuación de otro texto (ver encode_continuation).
+        """
+        return self._encode(text, add_special_tokens, continuation)
+
+    def fragment_ids(self, i, fragment, max_text_tokens=None):
+        """
+        Ids del bloque de un fragmento en el contexto (cabecera + texto + salto de línea).
+
+        Parámetros:
+        - i (int): número del fragmento dentro del contexto.
+        - fragment (dict): fragmento recuperado (con su "id" en el índice).
+        - max_text_tokens (int): si se indica, se recorta el texto a ese número de tokens.
+        """
+        # El espacio tras "Información:" va incluido en los ids guardados del texto
+        medicamento, categoria = fragment_citation(fragment)
+        cabecera = self.encode(
+            f"\nFragmento {i}:\nMedicamento: {medicamento}\nCategoría: {categoria}\nInformación:",
+            continuation=True,
+        )
+        texto = self.store.get(fragment["id"])
+        cierre = self.encode("\n", continuation=True)
+        if max_text_tokens is not None and len(texto) > max_text_tokens:
+            texto = texto[:max_text_tokens]
+            cierre = self.encode("...\n", continuation=True)
+        return np.concatenate([np.asarray(cabecera, dtype=np.int64), np.asarray(texto, dtype=np.int64), np.asarray(cierre, dtype=np.int64)])
+
+
+# Función principal
+def main():
+    """Construye los almacenes de tokens de los fragmentos para los tokenizadores indicados."""
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import load_json, FRAGMENTS_PATH
+
+    parser = argparse.ArgumentParser(description="Pre-tokeniza los fragmentos del chatbot")
+    parser.add_argument("--models", nargs="+", default=list(TOKENIZER_NAMES), choices=list(TOKENIZER_NAMES))
+    parser.add_argument("--fragments", default=FRAGMENTS_PATH)
+    parser.add_argument("--output-dir", default=TOKEN_STORE_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    fragments = load_json(args.fragments)
+    build_token_stores(
+        [frag["texto"] for frag in fragments], args.output_dir, args.models, corpus=corpus_fingerprint(args.fragments)
+    )
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# index_factory.py
+"""
+Construcción del índice FAISS del chatbot a partir de una cadena de la index_factory de FAISS (ej. "Flat", "IVF{nlist},Flat", "IVF{nlist},PQ32", "HNSW32", "SQ8", "OPQ32,IVF{nlist},PQ32") y de sus parámetros de búsqueda (nprobe, efSearch), y comparación de configuraciones frente a la búsqueda exacta (IndexFlatL2): recall@k, consultas por segundo, tiempo de construcción y tamaño del índice.
+
+En la cadena, "{nlist}" se sustituye por un número de listas adecuado al tamaño del corpus (~4·sqrt(n)). Los parámetros de búsqueda se guardan con el índice, así que el índice escrito se sirve tal cual (ej. empaquetándolo con `retrieval_bundle.py build --index`).
+
+Uso:
+    python src/index_factory.py build --factory "IVF{nlist},PQ32" --param nprobe=16
+    python src/index_factory.py report --factories Flat "IVF{nlist},Flat" "IVF{nlist},PQ32" HNSW32 SQ8 --param nprobe=1,8,32 --param efSearch=16,64
+"""
+
+# Librerías
+import os
+import time
+import logging
+import argparse
+import itertools
+
+import faiss
+import numpy as np
+
+# Rutas por defecto
+EMBEDDINGS_PATH = "./data/outputs/5_chatbot/embeddings_all-MiniLM-L6-v2.npy"
+INDEX_DIR = "./data/outputs/5_chatbot"
+
+
+# Función para calcular el número de listas de un índice IVF
+def default_nlist(n):
+    """Número de listas para un corpus de n vectores: ~4·sqrt(n), en potencia de 2 y sin superar n/39."""
+    nlist = 2 ** int(round(np.log2(max(4 * np.sqrt(n), 1))))
+    # FAISS necesita al menos 39 vectores de entrenamiento por lista
+    while nlist > 1 and nlist * 39 > n:
+        nlist //= 2
+    return nlist
+
+
+# Función para expandir una cadena de la index_factory
+def resolve_factory(factory, n):
+    """Sustituye "{nlist}" en la cadena de la index_factory según el tamaño del corpus."""
+    return factory.format(nlist=default_nlist(n))
+
+
+# Función para aplicar parámetros de búsqueda a un índice
+def set_search_params(index, **params):
+    """
+    Aplica parámetros de búsqueda (ej. nprobe=16, efSearch=64) a un índice, incluidos los
+    índices envueltos en una transformación (OPQ). Los parámetros que no aplican al tipo de
+    índice se ignoran.
+
+    Retorna:
+    - dict: parámetros aplicados.
+    """
+    space = faiss.ParameterSpace()
+    aplicados = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        try:
+            space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            continue
+        aplicados[name] = value
+    return aplicados
+
+
+# Función para calcular el tamaño serializado de un índice
+def index_nbytes(index):
+    """Bytes que ocupa el índice escrito en disco (y en memoria, salvo estructuras auxiliares)."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+# Función para construir un índice a partir de una cadena de la index_factory
+def build_index(embeddings, factory="Flat", search_params=None, train_size=None, seed=0, ids=None):
+    """
+    Construye un índice FAISS (distancia L2) con los embeddings del corpus.
+
+    Parámetros:
+    - embeddings (np.ndarray): matriz n x d de embeddings.
+    - factory (str): cadena de la index_factory de FAISS; admite "{nlist}".
+    - search_params (dict): parámetros de búsqueda (ej. {"nprobe": 16}).
+    - train_size (int): número máximo de vectores para entrenar (None para todos).
+    - seed (int): semilla del muestreo de entrenamiento.
+    - ids (np.ndarray): ids (int64) de los vectores. Los índices IVF los guardan directamente;
+      el resto se envuelve en un IndexIDMap2. Con ids se pueden borrar vectores (remove_ids).
+
+    Retorna:
+    - tuple: (índice, segundos de construcción)
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, d = embeddings.shape
+    factory = resolve_factory(factory, n)
+
+    start = time.perf_counter()
+    index = faiss.index_factory(d, factory, faiss.METRIC_L2)
+    if not index.is_trained:
+        train = embeddings
+        if train_size is not None and n > train_size:
+            train = embeddings[np.random.default_rng(seed).choice(n, train_size, replace=False)]
+        index.train(train)
+    # Los IVF guardan la posición de cada vector para poder reconstruirlo (búsqueda filtrada exacta)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.set_direct_map_type(faiss.DirectMap.Array if ids is None else faiss.DirectMap.Hashtable)
+    if ids is None:
+        index.add(embeddings)
+    else:
+        if ivf is None:
+            index = faiss.IndexIDMap2(index)
+        index.add_with_ids(embeddings, np.ascontiguousarray(ids, dtype=np.int64))
+    build_s = time.perf_counter() - start
+
+    set_search_params(index, **(search_params or {}))
+    return index, build_s
+
+
+# Función para obtener los vecinos exactos de las consultas
+def exact_neighbors(embeddings, queries, k):
+    """Vecinos exactos (IndexFlatL2) de cada consulta, usados como referencia del recall."""
+    flat = faiss.IndexFlatL2(embeddings.shape[1])
+    flat.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+    return flat.search(queries, k)[1]
+
+
+# Función para medir el recall y la velocidad de un índice
+def evaluate_index(index, queries, ground_truth, k=10):
+    """
+    Busca las consultas de una en una (como el chatbot) y compara con los vecinos exactos.
+
+    Retorna:
+    - dict: recall@k, consultas por segundo y latencia p50/p99 en ms.
+    """
+    latencias = np.empty(len(queries))
+    resultados = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        resultados[i] = index.search(queries[i:i + 1], k)[1][0]
+        latencias[i] = time.perf_counter() - start
+    aciertos = sum(len(np.intersect1d(r, gt)) for r, gt in zip(resultados, ground_truth[:, :k]))
+    return {
+        "recall": aciertos / (len(queries) * k),
+        "qps": len(queries) / latencias.sum(),
+        "p50_ms": float(np.percentile(latencias, 50) * 1000),
+        "p99_ms": float(np.percentile(latencias, 99) * 1000),
+    }
+
+
+# Función para generar consultas a partir del propio corpus
+def sample_queries(embeddings, num_queries=500, noise=0.1, seed=0):
+    """Vectores del corpus con ruido gaussiano (una fracción de la desviación típica) como consultas."""
+    rng = np.random.default_rng(seed)
+    filas = rng.choice(len(embeddings), min(num_queries, len(embeddings)), replace=False)
+    queries = embeddings[filas] + rng.normal(0, noise * embeddings.std(), (len(filas), embeddings.shape[1]))
+    return np.ascontiguousarray(queries, dtype=np.float32)
+
+
+# Función para comparar configuraciones de índice
+def compare_indexes(embeddings, factories, param_grid=None, queries=None, k=10, train_size=None):
+    """
+    Construye cada configuración y la evalúa con cada combinación de parámetros de búsqueda.
+
+    Parámetros:
+    - embeddings (np.ndarray): matriz n x d de embeddings del corpus.
+    - factories (list): cadenas de la index_factory.
+    - param_grid (dict): valores a probar por parámetro (ej. {"nprobe": [1, 8, 32]}).
+    - queries (np.ndarray): consultas (por defecto, `sample_queries`).
+    - k (int): número de vecinos.
+    - train_size (int): número máximo de vectores de entrenamiento.
+
+    Retorna:
+    - list: una fila (dict) por configuración y parámetros de búsqueda.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    queries = sample_queries(embeddings) if queries is None else np.ascontiguousarray(queries, dtype=np.float32)
+    ground_truth = exact_neighbors(embeddings, queries, k)
+    param_grid = param_grid or {}
+
+    filas = []
+    for factory in factories:
+        index, build_s = build_index(embeddings, factory, train_size=train_size)
+        nbytes = index_nbytes(index)
+        # Solo se recorren los parámetros que aplican a este tipo de índice
+        grid = {name: values for name, values in param_grid.items() if set_search_params(index, **{name: values[0]})}
+        for combinacion in itertools.product(*grid.values()):
+            params = dict(zip(grid, combinacion))
+            set_search_params(index, **params)
+            filas.append({
+                "factory": resolve_factory(factory, len(embeddings)),
+                "params": params,
+                "build_s": build_s,
+                "bytes": nbytes,
+                **evaluate_index(index, queries, ground_truth, k),
+            })
+        del index
+    return filas
+
+
+# Función para imprimir el informe de la comparación
+def print_report(filas, k=10):
+    print(f"{'índice':>24} | {'parámetros':>22} | {f'recall@{k}':>9} | {'consultas/s':>11} | {'p99 (ms)':>8} | {'construcción (s)':>16} | {'MB':>8}")
+    for fila in filas:
+        params = ",".join(f"{name}={value}" for name, value in fila["params"].items()) or "-"
+        print(
+            f"{fila['factory']:>24} | {params:>22} | {fila['recall']:>9.3f} | {fila['qps']:>11.0f} | "
+            f"{fila['p99_ms']:>8.2f} | {fila['build_s']:>16.2f} | {fila['bytes'] / 1024**2:>8.1f}"
+        )
+
+
+# Función para interpretar los parámetros de búsqueda de la línea de comandos
+def parse_param_grid(items):
+    """["nprobe=1,8", "efSearch=64"] -> {"nprobe": [1, 8], "efSearch": [64]}"""
+    grid = {}
+    for item in items or []:
+        name, _, values = item.partition("=")
+        grid[name] = [int(v) for v in values.split(",")]
+    return grid
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Construcción y comparación de índices FAISS")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Construye y guarda un índice")
+    build.add_argument("--embeddings", default=EMBEDDINGS_PATH)
+    build.add_argument("--factory", default="Flat", help="Cadena de la index_factory (admite {nlist})")
+    build.add_argument("--param", action="append", help="Parámetro de búsqueda, ej. nprobe=16")
+    build.add_argument("--train-size", type=int, default=None)
+    build.add_argument("--output", default=None, help="Por defecto, faiss_index_<factory>.bin")
+
+    report = sub.add_parser("report", help="Compara configuraciones frente a la búsqueda exacta")
+    report.add_argument("--embeddings", default=EMBEDDINGS_PATH)
+    report.add_argument("--queries", default=None, help="Embeddings de consultas (.npy); por defecto, del corpus con ruido")
+    report.add_argument("--factories", nargs="+", default=["Flat", "IVF{nlist},Flat", "IVF{nlist},PQ32", "HNSW32", "SQ8"])
+    report.add_argument("--param", action="append", help="Valores a probar, ej. nprobe=1,8,32")
+    report.add_argument("--k", type=int, default=10)
+    report.add_argument("--train-size", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    embeddings = np.load(args.embeddings).astype(np.float32)
+    if args.command == "build":
+        params = {name: values[0] for name, values in parse_param_grid(args.param).items()}
+        index, build_s = build_index(embeddings, args.factory, params, args.train_size)
+        factory = resolve_factory(args.factory, len(embeddings))
+        output = args.output or os.path.join(INDEX_DIR, f"faiss_index_{factory.replace(',', '_')}.bin")
+        faiss.write_index(index, output)
+        logging.info(
+            f"Índice {factory} ({len(embeddings)} vectores, {index_nbytes(index) / 1024**2:.1f} MB) "
+            f"construido en {build_s:.2f}s y guardado en {output}"
+        )
+    else:
+        queries = np.load(args.queries) if args.queries else None
+        filas = compare_indexes(embeddings, args.factories, parse_param_grid(args.param), queries, args.k, args.train_size)
+        print_report(filas, args.k)
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
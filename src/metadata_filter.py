@@ -0,0 +1,249 @@
+# metadata_filter.py
+"""
+Búsqueda vectorial filtrada por metadatos de los fragmentos: medicamento, categoría y código ATC (cualquier nivel, por prefijo: "M" grupo anatómico, "M01" subgrupo terapéutico, "M01A", "M01AE", "M01AE01" principio activo).
+
+Para cada campo se precalculan listas invertidas (valor -> posiciones de los fragmentos). Una consulta filtrada se resuelve de dos formas:
+
+1. Si el subconjunto filtrado es pequeño, búsqueda exacta sobre sus vectores (reconstruidos del índice), que es más barata que recorrer el índice y no pierde resultados en los índices aproximados.
+2. Si no, búsqueda en el índice con un selector de ids de FAISS (IDSelectorBatch), que descarta el resto de vectores sin calcular su distancia. En los índices aproximados (IVF, HNSW) se exploran más listas o nodos cuanto más selectivo es el filtro, para no perder recall.
+
+Los códigos ATC se añaden a los fragmentos desde `fichas_tecnicas_mapped_atc.json` (salida de `map_act_codes.ipynb`):
+    python src/metadata_filter.py annotate [--fragments RUTA] [--fichas RUTA] [--output RUTA]
+"""
+
+# Librerías
+import json
+import logging
+import argparse
+from collections import defaultdict
+
+import faiss
+import numpy as np
+
+from fragment_store import fragment_column
+
+# Fichas técnicas con los niveles ATC (salida de map_act_codes.ipynb)
+FICHAS_ATC_PATH = "./data/outputs/2_data_preprocessing/fichas_tecnicas_mapped_atc.json"
+
+# Campos por los que se puede filtrar
+FILTER_FIELDS = ("medicamento", "categoria", "atc")
+
+# Longitud del código ATC en cada nivel (anatómico, subgrupos 2-4 y principio activo)
+ATC_LEVEL_LENGTHS = (1, 3, 4, 5, 7)
+
+# Tamaño máximo del subconjunto filtrado para usar búsqueda exacta sobre sus vectores (por
+# encima, reunir los vectores dispersos cuesta más que buscar con el selector)
+EXACT_SEARCH_MAX = 256
+
+
+# Función para normalizar un valor de filtro
+def _normalize(field, value):
+    value = str(value).strip()
+    return value.upper() if field == "atc" else value.lower()
+
+
+class MetadataIndex:
+    """
+    Listas invertidas de los fragmentos por medicamento, categoría y prefijo del código ATC, y
+    por par (medicamento, categoría) para las consultas que piden una sección de un medicamento.
+
+    Parámetros:
+    - fragments (list o FragmentStore): fragmentos, en el orden del índice. En los fragmentos
+      deduplicados se indexan todas sus fuentes. Solo se leen las columnas de metadatos (con el
+      almacén columnar no se construyen las filas ni se decodifica el texto).
+    """
+
+    def __init__(self, fragments):
+        self.size = len(fragments)
+        listas = {field: defaultdict(list) for field in FILTER_FIELDS}
+        pares = defaultdict(list)
+        columnas = zip(
+            fragment_column(fragments, "medicamento"),
+            fragment_column(fragments, "categoria"),
+            fragment_column(fragments, "fuentes"),
+            fragment_column(fragments, "ATC"),
+        )
+        for pos, (medicamento, categoria, fuentes, atc) in enumerate(columnas):
+            for fuente in fuentes or [{"medicamento": medicamento, "categoria": categoria}]:
+                for field in ("medicamento", "categoria"):
+                    if fuente.get(field):
+                        listas[field][_normalize(field, fuente[field])].append(pos)
+                if fuente.get("medicamento") and fuente.get("categoria"):
+                    pares[_normalize("medicamento", fuente["medicamento"]), _normalize("categoria", fuente["categoria"])].append(pos)
+            if atc:
+                atc = _normalize("atc", atc)
+                for n in ATC_LEVEL_LENGTHS:
+                    if len(atc) >= n:
+                        listas["atc"][atc[:n]].append(pos)
+        self._lists = {
+            field: {value: np.unique(np.asarray(pos, dtype=np.int64)) for value, pos in valores.items()}
+            for field, valores in listas.items()
+        }
+        self._pairs = {par: np.unique(np.asarray(pos, dtype=np.int64)) for par, pos in pares.items()}
+
+    def values(self, field):
+        """Valores distintos de un campo (ej. todos los medicamentos)."""
+        return sorted(self._lists[field])
+
+    def pair_positions(self, medicamento, categoria):
+        """Posiciones de los fragmentos de la sección `categoria` del medicamento (búsqueda en el hash de pares)."""
+        vacio = np.zeros(0, dtype=np.int64)
+        return self._pairs.get((_normalize("medicamento", medicamento), _normalize("categoria", categoria)), vacio)
+
+    def positions(self, filters):
+        """
+        Posiciones de los fragmentos que cumplen los filtros.
+
+        Parámetros:
+        - filters (dict): campo -> valor o lista de valores (ej. {"medicamento": "ibuprofeno",
+          "atc": "M01A"}). Los valores de un campo se combinan con O y los campos con Y.
+
+        Retorna:
+        - np.ndarray o None: posiciones ordenadas (None si no hay filtros).
+        """
+        resultado = None
+        for field, valores in (filters or {}).items():
+            if field not in self._lists:
+                raise ValueError(f"Campo de filtro desconocido: {field} (disponibles: {', '.join(FILTER_FIELDS)})")
+            if valores is None:
+                continue
+            if isinstance(valores, str):
+                valores = [valores]
+            vacio = np.zeros(0, dtype=np.int64)
+            listas = [self._lists[field].get(_normalize(field, v), vacio) for v in valores]
+            posiciones = np.unique(np.concatenate(listas)) if listas else vacio
+            resultado = posiciones if resultado is None else np.intersect1d(resultado, posiciones, assume_unique=True)
+        return resultado
+
+
+# Función para obtener los parámetros de búsqueda con un selector de ids
+def _search_params(index, selector, candidates):
+    """
+    Parámetros de búsqueda del tipo adecuado al índice. nprobe (IVF) y efSearch (HNSW) se
+    multiplican por la inversa de la fracción de vectores que pasan el filtro, de forma que
+    se exploran los mismos candidatos válidos que en una búsqueda sin filtros.
+    """
+    interno = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    factor = index.ntotal / max(candidates, 1)
+    ivf = faiss.try_extract_index_ivf(interno)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(ivf.nlist, int(np.ceil(ivf.nprobe * factor))))
+    if isinstance(interno, faiss.IndexHNSW):
+        efsearch = min(index.ntotal, int(np.ceil(interno.hnsw.efSearch * factor)))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=efsearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+# Función para buscar solo entre los fragmentos filtrados
+def filtered_search(index, query_embeddings, k, positions, exact_max=EXACT_SEARCH_MAX, stats=None):
+    """
+    Busca los k vecinos de cada consulta entre los fragmentos de `positions`.
+
+    Parámetros:
+    - index: índice FAISS (o el envoltorio con ids estables del paquete de recuperación).
+    - query_embeddings (np.ndarray): matriz N x d de consultas.
+    - k (int): número de vecinos.
+    - positions (np.ndarray): posiciones de los fragmentos permitidos.
+    - exact_max (int): tamaño máximo del subconjunto para la búsqueda exacta.
+    - stats (dict): se rellena con "strategy" ("exact" o "selector") y "candidates".
+
+    Retorna:
+    - tuple: (distancias N x k, posiciones N x k; -1 si hay menos de k candidatos)
+    """
+    stats = {} if stats is None else stats
+    queries = np.ascontiguousarray(query_embeddings, dtype=np.float32).reshape(-1, index.d)
+    n = len(queries)
+    stats["candidates"] = len(positions)
+    distances = np.full((n, k), np.inf, dtype=np.float32)
+    resultado = np.full((n, k), -1, dtype=np.int64)
+    if len(positions) == 0:
+        stats["strategy"] = "empty"
+        return distances, resultado
+
+    # Índices con ids estables: los selectores y la reconstrucción trabajan con ids, no posiciones
+    con_ids = hasattr(index, "to_positions")
+    base = index.index if con_ids else index
+    labels = index.labels[positions] if con_ids else positions
+
+    # 1. Subconjunto pequeño: búsqueda exacta sobre sus vectores (los IVF sin mapa directo no
+    # pueden reconstruirlos)
+    ivf = faiss.try_extract_index_ivf(base)
+    if len(positions) <= exact_max and (ivf is None or ivf.direct_map.type != faiss.DirectMap.NoMap):
+        try:
+            vectores = base.reconstruct_batch(labels)
+        except RuntimeError:
+            vectores = None
+        if vectores is not None:
+            stats["strategy"] = "exact"
+            if base.metric_type == faiss.METRIC_INNER_PRODUCT:
+                scores = -(queries @ vectores.T)
+            else:
+                scores = (queries ** 2).sum(1)[:, None] - 2 * queries @ vectores.T + (vectores ** 2).sum(1)[None, :]
+            m = min(k, len(positions))
+            top = np.argpartition(scores, m - 1, axis=1)[:, :m]
+            orden = np.take_along_axis(scores, top, 1).argsort(axis=1)
+            top = np.take_along_axis(top, orden, 1)
+            distances[:, :m] = np.take_along_axis(scores, top, 1)
+            if base.metric_type == faiss.METRIC_INNER_PRODUCT:
+                distances[:, :m] *= -1
+            resultado[:, :m] = positions[top]
+            return distances, resultado
+
+    # 2. Subconjunto grande: búsqueda en el índice descartando el resto de ids
+    stats["strategy"] = "selector"
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(labels, dtype=np.int64))
+    distances, ids = base.search(queries, k, params=_search_params(base, selector, len(positions)))
+    return distances, (index.to_positions(ids) if con_ids else ids)
+
+
+# Función para añadir los códigos ATC a los fragmentos
+def annotate_atc(fragments, fichas):
+    """
+    Añade a cada fragmento el código ATC ("ATC") de su ficha técnica, buscándola por el
+    nombre completo del medicamento.
+
+    Retorna:
+    - int: número de fragmentos anotados.
+    """
+    codigos = {
+        str(ficha.get("nombre_medicamento_completo", "")).replace(".txt", "").lower(): ficha.get("ATC")
+        for ficha in fichas
+        if ficha.get("ATC")
+    }
+    anotados = 0
+    for frag in fragments:
+        atc = codigos.get(str(frag.get("nombre_medicamento_completo", "")).lower())
+        if atc:
+            frag["ATC"] = atc
+            anotados += 1
+    return anotados
+
+
+# Función principal
+def main():
+    import os
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import load_json, FRAGMENTS_PATH
+
+    parser = argparse.ArgumentParser(description="Metadatos de filtrado de los fragmentos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    annotate = sub.add_parser("annotate", help="Añade el código ATC de cada fragmento")
+    annotate.add_argument("--fragments", default=FRAGMENTS_PATH)
+    annotate.add_argument("--fichas", default=FICHAS_ATC_PATH)
+    annotate.add_argument("--output", default=None, help="Por defecto, sobrescribe --fragments")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    fragments = load_json(args.fragments)
+    anotados = annotate_atc(fragments, load_json(args.fichas))
+    output = args.output or args.fragments
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(fragments, f, ensure_ascii=False, indent=4)
+    logging.info(f"{anotados}/{len(fragments)} fragmentos con código ATC guardados en {output}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
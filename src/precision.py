@@ -0,0 +1,130 @@
+# precision.py
+"""
+Modos de precisión para cargar los LLM en CPU, donde Llama-2-7b en float32 ocupa unos 28 GB por proceso:
+
+- float32: pesos completos.
+- bfloat16 (por defecto): la mitad de memoria, sin cambios en el código de generación.
+- int8: cuantización dinámica (pesos int8, activaciones cuantizadas al vuelo) de las capas Linear.
+- int4: pesos en 4 bits por grupos con optimum-quanto (dependencia opcional).
+
+El modo se elige con el parámetro `precision` de los cargadores de utils.py o con la variable de entorno PHARMAI_CPU_PRECISION.
+"""
+
+# Librerías
+import os
+
+import torch
+from torch import nn
+
+# Modos de precisión soportados en CPU
+CPU_PRECISIONS = ("float32", "bfloat16", "int8", "int4")
+
+# Modo por defecto, configurable mediante variable de entorno
+DEFAULT_CPU_PRECISION = os.environ.get("PHARMAI_CPU_PRECISION", "bfloat16")
+
+
+# Función para validar el modo de precisión
+def resolve_precision(precision=None):
+    """Devuelve el modo de precisión indicado (o el de PHARMAI_CPU_PRECISION) tras validarlo."""
+    precision = precision or DEFAULT_CPU_PRECISION
+    if precision not in CPU_PRECISIONS:
+        raise ValueError(f"Precisión desconocida: {precision} (opciones: {', '.join(CPU_PRECISIONS)})")
+    return precision
+
+
+# Función para convertir una capa Conv1D de GPT-2 en una Linear equivalente
+def _conv1d_to_linear(conv):
+    """Las Conv1D de GPT-2 guardan el peso transpuesto (in x out); se convierten para poder cuantizarlas."""
+    in_features, out_features = conv.weight.shape
+    linear = nn.Linear(in_features, out_features, bias=conv.bias is not None, dtype=conv.weight.dtype)
+    with torch.no_grad():
+        linear.weight.copy_(conv.weight.t())
+        if conv.bias is not None:
+            linear.bias.copy_(conv.bias)
+    return linear
+
+
+# Función para sustituir las Conv1D de GPT-2 por capas Linear
+def _replace_conv1d(model):
+    """Las librerías de cuantización solo reconocen nn.Linear; GPT-2 usa Conv1D en atención y MLP."""
+    from transformers.pytorch_utils import Conv1D
+
+    for padre in list(model.modules()):
+        for nombre, hijo in list(padre.named_children()):
+            if isinstance(hijo, Conv1D):
+                setattr(padre, nombre, _conv1d_to_linear(hijo))
+    return model
+
+
+# Función para cuantizar dinámicamente a int8 las capas Linear de un modelo
+def quantize_linear_int8(model):
+    """
+    Sustituye cada capa Linear (y Conv1D de GPT-2) por su versión con cuantización dinámica
+    int8. Se cuantiza capa a capa para que el pico de memoria sea el del modelo cargado en
+    bfloat16 más una sola capa en float32. El resto del modelo (embeddings, normalizaciones)
+    se pasa a float32, el tipo de entrada y salida de las capas cuantizadas.
+
+    Retorna:
+    - nn.Module: el mismo modelo, modificado en sitio.
+    """
+    _replace_conv1d(model)
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    # Si la capa de salida comparte pesos con los embeddings (GPT-2), cuantizarla duplicaría la matriz
+    embeddings = model.get_input_embeddings().weight
+    padres = [m for m in model.modules() if any(isinstance(c, nn.Linear) for c in m.children())]
+    for padre in padres:
+        for nombre, hijo in list(padre.named_children()):
+            if isinstance(hijo, nn.Linear) and hijo.weight is not embeddings:
+                hijo = hijo.float()
+                hijo.qconfig = qconfig
+                setattr(padre, nombre, torch.ao.nn.quantized.dynamic.Linear.from_float(hijo))
+    return model.float()
+
+
+# Función para cuantizar los pesos a 4 bits con optimum-quanto
+def quantize_weights_int4(model):
+    """
+    Cuantiza los pesos de las capas lineales a int4 (por grupos) con optimum-quanto; las
+    activaciones siguen en bfloat16. La capa de salida (lm_head) se deja sin cuantizar.
+
+    Retorna:
+    - nn.Module: el mismo modelo, modificado en sitio.
+    """
+    try:
+        from optimum.quanto import freeze, qint4, quantize
+    except ImportError as e:
+        raise ImportError("El modo int4 en CPU necesita optimum-quanto: pip install optimum-quanto") from e
+
+    _replace_conv1d(model)
+    quantize(model, weights=qint4, exclude="lm_head")
+    freeze(model)
+    return model
+
+
+# Función para cargar un modelo causal en CPU con el modo de precisión indicado
+def load_cpu_model(model_id, precision=None, model_cls=None, **kwargs):
+    """
+    Carga un modelo de Hugging Face en CPU con el modo de precisión indicado.
+
+    Parámetros:
+    - model_id (str): nombre o ruta del modelo.
+    - precision (str): "float32", "bfloat16", "int8" o "int4" (por defecto, PHARMAI_CPU_PRECISION).
+    - model_cls: clase del modelo (por defecto, AutoModelForCausalLM).
+    - kwargs: argumentos adicionales para from_pretrained.
+
+    Retorna:
+    - PreTrainedModel: modelo en modo evaluación.
+    """
+    if model_cls is None:
+        from transformers import AutoModelForCausalLM as model_cls
+
+    precision = resolve_precision(precision)
+    # Los modos cuantizados parten de bfloat16 para no materializar el modelo completo en float32
+    dtype = torch.float32 if precision == "float32" else torch.bfloat16
+    model = model_cls.from_pretrained(model_id, torch_dtype=dtype, low_cpu_mem_usage=True, **kwargs)
+
+    if precision == "int8":
+        quantize_linear_int8(model)
+    elif precision == "int4":
+        quantize_weights_int4(model)
+    return model.eval()
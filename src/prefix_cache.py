@@ -0,0 +1,81 @@
+# prefix_cache.py
+"""
+Caché KV de la parte fija del prompt. Las instrucciones y el ejemplo con los que empieza el prompt (ver `build_prompt_parts` en utils.py) son idénticos en todas las consultas, así que su prefill se hace una sola vez por modelo cargado y las generaciones parten de una copia de esas past_key_values: el prefill de cada consulta solo cubre el contexto recuperado y la pregunta.
+"""
+
+# Librerías
+import copy
+
+import torch
+
+
+# Función para tokenizar el prompt por partes (prefijo fijo + sufijo variable)
+def encode_prompt_parts(tokenizer, prefix, suffix, max_length=None):
+    """
+    Tokeniza el prefijo (con los tokens especiales iniciales, ej. BOS) y el sufijo (sin ellos)
+    por separado y concatena los ids. Tokenizar siempre por partes garantiza que los ids del
+    prefijo coinciden exactamente con los de la caché.
+
+    Parámetros:
+    - tokenizer: tokenizador del modelo.
+    - prefix (str): parte fija del prompt.
+    - suffix (str): parte variable del prompt (contexto y pregunta).
+    - max_length (int): si se indica, se recorta el final del sufijo para no superarlo.
+
+    Retorna:
+    - list: ids de los tokens del prompt.
+    """
+    prefix_ids = tokenizer(prefix)["input_ids"]
+    suffix_ids = tokenizer(suffix, add_special_tokens=False)["input_ids"]
+    ids = list(prefix_ids) + list(suffix_ids)
+    if max_length is not None:
+        ids = ids[:max_length]
+    return ids
+
+
+class PrefixKVCache:
+    """
+    past_key_values del prefijo fijo del prompt, calculadas una vez por modelo.
+
+    Parámetros:
+    - model: modelo causal de Hugging Face.
+    - tokenizer: tokenizador del modelo.
+    - prefix (str): texto del prefijo fijo.
+    """
+
+    def __init__(self, model, tokenizer, prefix):
+        self.prefix = prefix
+        self.prefix_ids = list(tokenizer(prefix)["input_ids"])
+        device = next(model.parameters()).device
+        input_ids = torch.tensor([self.prefix_ids], device=device)
+        with torch.no_grad():
+            out = model(input_ids=input_ids, use_cache=True)
+        self.cache = out.past_key_values
+        self.legacy = self.cache.to_legacy_cache() if hasattr(self.cache, "to_legacy_cache") else self.cache
+
+    def __len__(self):
+        return len(self.prefix_ids)
+
+    @property
+    def nbytes(self):
+        """Bytes ocupados por la caché."""
+        return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in self.legacy)
+
+    def matches(self, input_ids):
+        """Indica si el prompt empieza por el prefijo cacheado (y tiene algo más detrás)."""
+        n = len(self.prefix_ids)
+        return len(input_ids) > n and list(input_ids[:n]) == self.prefix_ids
+
+    def copy(self):
+        """
+        Copia de la caché para una generación. model.generate amplía la caché en sitio, así
+        que cada consulta necesita su propia copia.
+        """
+        return copy.deepcopy(self.cache)
+
+    def expand(self, batch_size):
+        """Caché del prefijo replicada para un lote (formato legacy: tupla de (k, v) por capa)."""
+        return tuple(
+            (k.expand(batch_size, *k.shape[1:]).contiguous(), v.expand(batch_size, *v.shape[1:]).contiguous())
+            for k, v in self.legacy
+        )
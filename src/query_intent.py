@@ -0,0 +1,140 @@
+# query_intent.py
+"""
+Reconocimiento de consultas estructuradas del tipo "<sección> de <medicamento>" (ej. "¿cuáles son las reacciones adversas del paracetamol normon?" o "¿puedo conducir si tomo ibuprofeno?").
+
+Si la consulta nombra un único medicamento y una única sección de la ficha técnica (las claves de "categoria" de `extract_secciones`), los fragmentos se leen directamente del índice hash (medicamento, categoría) de `MetadataIndex`, sin calcular el embedding de la consulta ni buscar en FAISS. En cualquier otro caso (sin medicamento, varios medicamentos, varias secciones o confianza baja) la consulta sigue la ruta de búsqueda vectorial.
+
+El medicamento se reconoce con el índice de nombres (`drug_names.py`): por su nombre completo (ej. "paracetamol normon", confianza 1.0), por las primeras palabras del nombre (ej. "paracetamol", que abarca todos sus medicamentos, confianza 0.9) o, con menos confianza, con erratas y abreviaturas.
+
+Uso:
+    python src/query_intent.py "¿qué efectos secundarios tiene el ibuprofeno?" [--fragments RUTA]
+"""
+
+# Librerías
+import re
+import argparse
+
+import numpy as np
+
+from drug_names import normalize_text
+
+# Expresiones (sobre la consulta en minúsculas y sin tildes) que identifican cada sección
+SECTION_PATTERNS = {
+    "indicaciones": [r"\bindicaciones\b", r"\bpara que (sirve|se usa|se utiliza|esta indicado)\b", r"\bindicado para\b"],
+    "posologia": [
+        r"\bposologia\b", r"\bdosis\b", r"\bdosificacion\b", r"\bcada cuant[ao]s? horas\b",
+        r"\bcomo (se )?(toma|tomar|administra)\b", r"\bforma de administracion\b",
+    ],
+    "contraindicaciones": [r"\bcontraindica"],
+    "advertencias": [r"\badvertencias?\b", r"\bprecauciones (especiales )?de empleo\b"],
+    "interacciones": [r"\binteraccion(es)?\b", r"\binteractua", r"\botros medicamentos\b"],
+    "fertilidad_embarazo": [r"\bembaraz", r"\blactancia\b", r"\bfertilidad\b", r"\bamamant"],
+    "efectos_conducir": [r"\bconduc(ir|cion)\b", r"\bmaquinaria\b", r"\bmanejar maquinas\b"],
+    "reacciones_adversas": [r"\breacciones adversas\b", r"\befectos (secundarios|adversos|indeseados)\b"],
+    "sobredosis": [r"\bsobredosis\b", r"\bintoxicacion\b"],
+    "Propiedades_farmacocineticas": [r"\bfarmacocinetica", r"\bvida media\b", r"\bsemivida\b"],
+    "excipientes": [r"\bexcipientes?\b"],
+    "incompatibilidades": [r"\bincompatibilidad(es)?\b"],
+    "precauciones_conservacion": [r"\bconservacion\b", r"\bconservar(se|lo|la)?\b", r"\balmacenar\b"],
+}
+
+# Confianza mínima para usar la ruta directa (una errata en un principio activo queda en ~0.8)
+MIN_CONFIDENCE = 0.8
+
+
+class QueryIntent:
+    """
+    Intención reconocida en una consulta.
+
+    Atributos:
+    - medicamentos (list): medicamentos (tal y como aparecen en los fragmentos) a los que se refiere.
+    - categoria (str): sección de la ficha técnica.
+    - confidence (float): confianza del reconocimiento (0-1).
+    - match (str): texto de la consulta que identificó el medicamento.
+    """
+
+    __slots__ = ("medicamentos", "categoria", "confidence", "match")
+
+    def __init__(self, medicamentos, categoria, confidence, match):
+        self.medicamentos = medicamentos
+        self.categoria = categoria
+        self.confidence = confidence
+        self.match = match
+
+    def to_dict(self):
+        return {
+            "match": self.match,
+            "medicamentos": len(self.medicamentos),
+            "categoria": self.categoria,
+            "confidence": self.confidence,
+        }
+
+
+class IntentParser:
+    """
+    Reconoce consultas "<sección> de <medicamento>" con el índice de nombres del corpus.
+
+    Parámetros:
+    - metadata (MetadataIndex): listas invertidas de los fragmentos (índice hash).
+    - names (DrugNameIndex): índice de nombres de medicamentos.
+    - min_confidence (float): confianza mínima para devolver una intención.
+    """
+
+    def __init__(self, metadata, names, min_confidence=MIN_CONFIDENCE):
+        self.metadata = metadata
+        self.names = names
+        self.min_confidence = min_confidence
+        self._sections = {cat: [re.compile(p) for p in patrones] for cat, patrones in SECTION_PATTERNS.items()}
+
+    def _match_sections(self, texto):
+        return [cat for cat, patrones in self._sections.items() if any(p.search(texto) for p in patrones)]
+
+    def parse(self, query):
+        """
+        Reconoce el medicamento y la sección de la consulta.
+
+        Retorna:
+        - QueryIntent o None: None si no hay exactamente un medicamento y una sección con la
+          confianza mínima.
+        """
+        texto = normalize_text(query)
+        secciones = self._match_sections(texto)
+        if len(secciones) != 1:
+            return None
+        menciones = self.names.detect(texto)
+        if len({tuple(m.drugs) for m in menciones}) != 1 or menciones[0].score < self.min_confidence:
+            return None
+        return QueryIntent(menciones[0].drugs, secciones[0], menciones[0].score, menciones[0].name)
+
+    def positions(self, intent):
+        """Posiciones (ordenadas) de los fragmentos de la sección de los medicamentos de la intención."""
+        return np.unique(np.concatenate([self.metadata.pair_positions(m, intent.categoria) for m in intent.medicamentos]))
+
+
+# Función principal
+def main():
+    import os
+    import sys
+    import json
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import load_json, FRAGMENTS_PATH
+    from metadata_filter import MetadataIndex
+    from drug_names import DrugNameIndex
+
+    parser = argparse.ArgumentParser(description="Reconoce consultas '<sección> de <medicamento>'")
+    parser.add_argument("queries", nargs="+")
+    parser.add_argument("--fragments", default=FRAGMENTS_PATH)
+    args = parser.parse_args()
+
+    fragments = load_json(args.fragments)
+    intents = IntentParser(MetadataIndex(fragments), DrugNameIndex.build(fragments))
+    for query in args.queries:
+        intent = intents.parse(query)
+        ruta = "directa" if intent is not None and len(intents.positions(intent)) else "vectorial"
+        print(json.dumps({"query": query, "ruta": ruta, "intent": intent and intent.to_dict()}, ensure_ascii=False))
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
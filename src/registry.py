@@ -0,0 +1,377 @@
+# registry.py
+"""
+Registro de modelos y artefactos compartido por todo el proceso. Cada recurso pesado del chatbot (LLM, modelo de embeddings, fragmentos, índice FAISS, Whisper y TTS) se registra con una función de carga y se materializa una única vez por proceso, de forma que las reejecuciones de Streamlit y las distintas sesiones reutilizan la misma instancia. El registro aplica un presupuesto de memoria explícito y, cuando se supera, descarga los recursos inactivos menos usados recientemente (LRU).
+
+Un recurso está en uso mientras dura su préstamo (`with registry.use(nombre) as recurso:`), no solo durante el `get`: un LLM con una generación en curso no se expulsa aunque otra sesión cargue Whisper o TTS por encima del presupuesto. Tampoco se expulsa un recurso del que depende otro en uso (ej. el LLM de un motor de batching con consultas en curso) ni un recurso con el atributo `busy` activo (el propio motor mientras tiene consultas).
+"""
+
+# Librerías
+import gc
+import os
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+# Presupuesto de memoria por defecto (en GB), configurable mediante variable de entorno
+DEFAULT_MEMORY_BUDGET_GB = float(os.environ.get("PHARMAI_MEMORY_BUDGET_GB", "32"))
+
+
+# Función para calcular los bytes de un tensor (o tupla de tensores) del state_dict
+def _tensor_nbytes(t, vistos):
+    """Bytes de un tensor, incluidos los tensores cuantizados de torch y de optimum-quanto."""
+    # Pesos empaquetados de las capas con cuantización dinámica: tupla (peso, sesgo)
+    if isinstance(t, (tuple, list)):
+        return sum(_tensor_nbytes(x, vistos) for x in t)
+    # Subclases de tensor (ej. pesos int4 de optimum-quanto): se suman sus tensores internos
+    if hasattr(t, "__tensor_flatten__") and type(t).__name__ != "Tensor":
+        names, _ = t.__tensor_flatten__()
+        return sum(_tensor_nbytes(getattr(t, name), vistos) for name in names)
+    # Otros valores del state_dict (ej. el dtype de las capas con cuantización dinámica)
+    if not hasattr(t, "element_size"):
+        return 0
+    clave = (t.data_ptr(), t.numel())
+    if clave in vistos:
+        return 0
+    vistos.add(clave)
+    return t.numel() * t.element_size()
+
+
+# Función para estimar la memoria ocupada por un recurso cargado
+def estimate_nbytes(obj):
+    """
+    Estima el número de bytes que ocupa un recurso cargado en memoria.
+
+    Parámetros:
+    - obj: recurso (modelo de torch, índice FAISS, array de numpy, lista, tupla...).
+
+    Retorna:
+    - int: número aproximado de bytes.
+    """
+    # Tuplas y listas de recursos (ej. (tokenizer, model) o (model, device))
+    if isinstance(obj, (tuple, list)) and obj and not isinstance(obj[0], dict):
+        return sum(estimate_nbytes(o) for o in obj)
+
+    # Modelos de torch: tensores del state_dict (incluye los pesos de las capas cuantizadas,
+    # que no son parámetros); los pesos compartidos se cuentan una sola vez
+    if hasattr(obj, "parameters") and hasattr(obj, "state_dict"):
+        try:
+            vistos = set()
+            return sum(_tensor_nbytes(t, vistos) for t in obj.state_dict().values())
+        except Exception:
+            pass
+
+    # Modelos TTS de Coqui: el modelo real está en synthesizer.tts_model
+    synthesizer = getattr(obj, "synthesizer", None)
+    if synthesizer is not None and hasattr(synthesizer, "tts_model"):
+        return estimate_nbytes(synthesizer.tts_model)
+
+    # Índices FAISS: vectores de dimensión d en float32
+    if hasattr(obj, "ntotal") and hasattr(obj, "d"):
+        return int(obj.ntotal) * int(obj.d) * 4
+
+    # Arrays de numpy
+    if hasattr(obj, "nbytes"):
+        return int(obj.nbytes)
+
+    # Listas de diccionarios (fragmentos): estimación por el tamaño de sus textos
+    if isinstance(obj, list):
+        return sys.getsizeof(obj) + sum(
+            sum(sys.getsizeof(v) for v in item.values()) if isinstance(item, dict) else sys.getsizeof(item)
+            for item in obj
+        )
+
+    return sys.getsizeof(obj)
+
+
+class _Entry:
+    """Entrada del registro: función de carga, instancia cargada y metadatos de uso."""
+
+    def __init__(self, loader, pinned=False, size_estimator=None, depends_on=None):
+        self.loader = loader
+        self.pinned = pinned
+        self.depends_on = list(depends_on or [])
+        self.size_estimator = size_estimator or estimate_nbytes
+        self.value = None
+        self.loaded = False
+        self.nbytes = 0
+        self.load_seconds = 0.0
+        self.last_used = 0.0
+        self.in_use = 0
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Registro de recursos cargados una vez por proceso con presupuesto de memoria y expulsión LRU.
+
+    Parámetros:
+    - memory_budget_gb (float): memoria máxima (en GB) que pueden ocupar los recursos cargados.
+    - idle_seconds (float): tiempo mínimo sin uso para que un recurso pueda ser expulsado.
+    """
+
+    def __init__(self, memory_budget_gb=DEFAULT_MEMORY_BUDGET_GB, idle_seconds=0.0):
+        self.memory_budget_bytes = int(memory_budget_gb * 1024**3)
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()  # Orden LRU: el primero es el menos usado recientemente
+        self._lock = threading.RLock()
+
+    def register(self, name, loader, pinned=False, size_estimator=None, depends_on=None):
+        """
+        Registra un recurso con su función de carga. Si ya existe, se mantiene la instancia cargada.
+
+        Parámetros:
+        - name (str): nombre del recurso (ej. "llm:llama2", "embedder").
+        - loader (callable): función sin argumentos que carga y devuelve el recurso.
+        - pinned (bool): si es True, el recurso nunca se expulsa por LRU.
+        - size_estimator (callable): función que estima los bytes del recurso cargado.
+        - depends_on (list): recursos de los que depende; si se expulsa alguno, este también.
+        """
+        with self._lock:
+            if name in self._entries:
+                return
+            self._entries[name] = _Entry(loader, pinned, size_estimator, depends_on)
+
+    def is_registered(self, name):
+        """Indica si un recurso está registrado."""
+        return name in self._entries
+
+    def is_loaded(self, name):
+        """Indica si un recurso está cargado en memoria."""
+        entry = self._entries.get(name)
+        return entry is not None and entry.loaded
+
+    def get(self, name):
+        """
+        Devuelve el recurso, cargándolo la primera vez que se pide. El recurso solo cuenta como
+        en uso durante la llamada; para usos largos (ej. una generación) se usa `use`.
+
+        Parámetros:
+        - name (str): nombre del recurso registrado.
+
+        Retorna:
+        - El recurso cargado.
+        """
+        entry = self._acquire(name)
+        try:
+            return self._materialize(name, entry)
+        finally:
+            self._release(entry)
+
+    @contextmanager
+    def use(self, name):
+        """
+        Presta el recurso durante el bloque `with`: mientras dure, no se expulsa por LRU (ni los
+        recursos de los que depende).
+
+        Uso:
+            with registry.use("llm:llama2") as (tokenizer, model):
+                model.generate(...)
+        """
+        entry = self._acquire(name)
+        try:
+            yield self._materialize(name, entry)
+        finally:
+            self._release(entry)
+
+    def _acquire(self, name):
+        with self._lock:
+            if name not in self._entries:
+                raise KeyError(f"Recurso no registrado: {name}")
+            entry = self._entries[name]
+            self._entries.move_to_end(name)
+            entry.in_use += 1
+            return entry
+
+    def _materialize(self, name, entry):
+        # Lock por recurso: dos sesiones que piden el mismo modelo a la vez lo cargan una sola vez
+        with entry.lock:
+            if not entry.loaded:
+                self._load(name, entry)
+        entry.last_used = time.monotonic()
+        return entry.value
+
+    def _release(self, entry):
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    def _load(self, name, entry):
+        """Carga un recurso y aplica el presupuesto de memoria."""
+        logging.info(f"Cargando recurso '{name}'...")
+        start = time.perf_counter()
+        value = entry.loader()
+        entry.load_seconds = time.perf_counter() - start
+        entry.value = value
+        entry.nbytes = entry.size_estimator(value)
+        entry.loaded = True
+        logging.info(
+            f"Recurso '{name}' cargado en {entry.load_seconds:.2f}s "
+            f"({entry.nbytes / 1024**2:.1f} MB)"
+        )
+        self._enforce_budget(keep=name)
+
+    def _enforce_budget(self, keep=None):
+        """Expulsa recursos inactivos en orden LRU hasta respetar el presupuesto de memoria."""
+        with self._lock:
+            now = time.monotonic()
+            keep_deps = self._entries[keep].depends_on if keep in self._entries else []
+            for name in list(self._entries):
+                if self.used_bytes() <= self.memory_budget_bytes:
+                    break
+                entry = self._entries[name]
+                if (
+                    name == keep
+                    or name in keep_deps
+                    or not entry.loaded
+                    or entry.pinned
+                    or self._leased(name)
+                    or now - entry.last_used < self.idle_seconds
+                ):
+                    continue
+                self._unload(name, entry)
+
+            if self.used_bytes() > self.memory_budget_bytes:
+                logging.warning(
+                    f"Presupuesto de memoria superado: {self.used_bytes() / 1024**3:.2f} GB "
+                    f"de {self.memory_budget_bytes / 1024**3:.2f} GB (no hay recursos inactivos que expulsar)"
+                )
+
+    def _leased(self, name, vistos=None):
+        """
+        Indica si un recurso está en uso: prestado, ocupado (atributo `busy` de la instancia) o
+        con algún recurso cargado que depende de él en uso (expulsarlo los descargaría también).
+        """
+        vistos = set() if vistos is None else vistos
+        if name in vistos:
+            return False
+        vistos.add(name)
+        entry = self._entries[name]
+        if entry.in_use > 0 or (entry.loaded and getattr(entry.value, "busy", False)):
+            return True
+        return any(
+            self._leased(other_name, vistos)
+            for other_name, other in self._entries.items()
+            if name in other.depends_on and other.loaded
+        )
+
+    def _unload(self, name, entry):
+        """Descarga un recurso de memoria (y los que dependen de él)."""
+        logging.info(f"Expulsando recurso '{name}' ({entry.nbytes / 1024**2:.1f} MB)")
+        for other_name, other in self._entries.items():
+            if name in other.depends_on and other.loaded:
+                self._unload(other_name, other)
+        # Recursos con hilos propios (ej. el motor de batching) se detienen antes de soltarlos
+        if hasattr(entry.value, "close"):
+            try:
+                entry.value.close()
+            except Exception:
+                logging.exception(f"Error al cerrar el recurso '{name}'")
+        entry.value = None
+        entry.loaded = False
+        entry.nbytes = 0
+        gc.collect()
+        try:
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def evict(self, name):
+        """Descarga explícitamente un recurso (se volverá a cargar en el siguiente get)."""
+        entry = self._entries.get(name)
+        if entry is None:
+            return
+        # Se espera a que termine una posible carga en curso antes de descargar
+        with entry.lock:
+            if entry.loaded:
+                self._unload(name, entry)
+
+    def replace(self, name, value):
+        """
+        Sustituye atómicamente la instancia cargada de un recurso (ej. un índice recién reconstruido).
+        Los recursos que dependen de él se descargan y se vuelven a cargar con la nueva instancia
+        en el siguiente get.
+
+        Parámetros:
+        - name (str): nombre del recurso registrado.
+        - value: nueva instancia del recurso.
+        """
+        with self._lock:
+            entry = self._entries[name]
+            entry.value = value
+            entry.nbytes = entry.size_estimator(value)
+            entry.loaded = True
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(name)
+            dependientes = [other_name for other_name, other in self._entries.items() if name in other.depends_on]
+        for other_name in dependientes:
+            self.evict(other_name)
+        self._enforce_budget(keep=name)
+
+    def warm_up(self, names=None):
+        """
+        Carga por adelantado los recursos indicados (o todos los registrados) para que la
+        primera pregunta no pague el coste de carga.
+
+        Parámetros:
+        - names (list): nombres de los recursos a precargar. None para todos.
+
+        Retorna:
+        - dict: segundos de carga por recurso.
+        """
+        names = list(self._entries) if names is None else names
+        tiempos = {}
+        for name in names:
+            self.get(name)
+            tiempos[name] = self._entries[name].load_seconds
+        return tiempos
+
+    def used_bytes(self):
+        """Bytes ocupados por los recursos cargados."""
+        return sum(e.nbytes for e in self._entries.values() if e.loaded)
+
+    def stats(self):
+        """
+        Devuelve el estado del registro.
+
+        Retorna:
+        - dict: por recurso, si está cargado, su tamaño (MB), tiempo de carga y segundos desde el último uso.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    "loaded": e.loaded,
+                    "pinned": e.pinned,
+                    "mb": round(e.nbytes / 1024**2, 1),
+                    "load_seconds": round(e.load_seconds, 2),
+                    "idle_seconds": round(now - e.last_used, 1) if e.loaded else None,
+                }
+                for name, e in self._entries.items()
+            }
+
+
+# Instancia global del registro (una por proceso)
+_registry = None
+_registry_lock = threading.Lock()
+
+
+# Función para obtener el registro global del proceso
+def get_registry():
+    """
+    Devuelve el registro global del proceso, creándolo la primera vez. Como el módulo
+    permanece importado entre reejecuciones de Streamlit, todas las sesiones lo comparten.
+
+    Retorna:
+    - ModelRegistry: registro global.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
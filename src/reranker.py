@@ -0,0 +1,182 @@
+# reranker.py
+"""
+Reordenación de los fragmentos recuperados con un cross-encoder.
+
+La búsqueda vectorial (bi-encoder) ordena los fragmentos con ruido, así que al LLM se le envían 10 fragmentos para no perder los relevantes y el prefill paga todos sus tokens. Con la reordenación, se recupera un conjunto mayor de candidatos (RERANK_POOL, 50 por defecto), un cross-encoder pequeño puntúa cada par (consulta, fragmento) en una sola pasada por lotes y solo los mejores (RERANK_TOP_N, 3 por defecto) pasan a `format_context`.
+
+Las puntuaciones se guardan en una caché LRU por (hash de la consulta, id del fragmento), así que las consultas repetidas o reformuladas con los mismos candidatos no vuelven a pasar por el modelo. La caché se vacía al cambiar de paquete de recuperación, porque los ids son posiciones en la lista de fragmentos del paquete.
+
+Uso:
+    python src/reranker.py "¿qué dosis de ibuprofeno puedo tomar?" [--pool 50] [--top-n 3] [--model NOMBRE]
+"""
+
+# Librerías
+import os
+import time
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+# Cross-encoder por defecto: MiniLM multilingüe entrenado en mMARCO (incluye español)
+RERANK_MODEL = os.environ.get("PHARMAI_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+
+# Candidatos que se puntúan y fragmentos que se conservan
+RERANK_POOL = 50
+RERANK_TOP_N = 3
+
+# Longitud máxima (en tokens) de cada par consulta + fragmento
+RERANK_MAX_LENGTH = 256
+
+# Número máximo de puntuaciones en caché
+RERANK_CACHE_SIZE = 100000
+
+
+# Función para obtener la clave de caché de una consulta
+def query_hash(query):
+    return hashlib.sha1(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+
+# Función para obtener el texto de un fragmento que ve el cross-encoder
+def _passage(fragment):
+    """Texto del fragmento precedido del medicamento (como en el contexto del LLM)."""
+    medicamento = fragment.get("medicamento")
+    return f"{medicamento}. {fragment['texto']}" if medicamento else fragment["texto"]
+
+
+class CrossEncoderReranker:
+    """
+    Cross-encoder de Hugging Face (AutoModelForSequenceClassification) con caché de puntuaciones.
+
+    Parámetros:
+    - model_name (str): modelo del cross-encoder.
+    - device (str): dispositivo (por defecto, "cuda" si está disponible).
+    - max_length (int): longitud máxima de cada par consulta + fragmento.
+    - cache_size (int): número máximo de puntuaciones en caché.
+    - model, tokenizer: modelo y tokenizador ya cargados (ej. en los benchmarks).
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, device=None, max_length=RERANK_MAX_LENGTH, cache_size=RERANK_CACHE_SIZE, model=None, tokenizer=None):
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.tokenizer = tokenizer or AutoTokenizer.from_pretrained(model_name)
+        self.model = (model or AutoModelForSequenceClassification.from_pretrained(model_name)).to(self.device).eval()
+        self._cache = OrderedDict()  # (hash de la consulta, id del fragmento) -> puntuación
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _forward(self, query, passages):
+        """Puntuaciones de los pares (consulta, fragmento) en una sola pasada por lotes."""
+        batch = self.tokenizer(
+            [query] * len(passages), passages, padding=True, truncation="only_second",
+            max_length=self.max_length, return_tensors="pt",
+        ).to(self.device)
+        with torch.inference_mode():
+            logits = self.model(**batch).logits.float()
+        # Un logit de relevancia o, en los modelos de dos clases, el log-odds de la clase "relevante"
+        scores = logits[:, 0] if logits.shape[-1] == 1 else logits[:, 1] - logits[:, 0]
+        return scores.cpu().numpy()
+
+    def score(self, query, fragments):
+        """
+        Puntuación de cada fragmento para la consulta (mayor es más relevante).
+
+        Retorna:
+        - tuple: (np.ndarray de puntuaciones, número de puntuaciones leídas de la caché)
+        """
+        qh = query_hash(query)
+        scores = np.empty(len(fragments), dtype=np.float32)
+        pendientes = []
+        with self._lock:
+            for i, frag in enumerate(fragments):
+                clave = (qh, frag["id"])
+                if clave in self._cache:
+                    self._cache.move_to_end(clave)
+                    scores[i] = self._cache[clave]
+                else:
+                    pendientes.append(i)
+            self.hits += len(fragments) - len(pendientes)
+            self.misses += len(pendientes)
+
+        if pendientes:
+            nuevas = self._forward(query, [_passage(fragments[i]) for i in pendientes])
+            scores[pendientes] = nuevas
+            with self._lock:
+                for i, s in zip(pendientes, nuevas):
+                    self._cache[(qh, fragments[i]["id"])] = float(s)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores, len(fragments) - len(pendientes)
+
+    def rerank(self, query, fragments, top_n=RERANK_TOP_N, stats=None):
+        """
+        Reordena los fragmentos por la puntuación del cross-encoder y conserva los top_n.
+
+        Parámetros:
+        - query (str): consulta del usuario.
+        - fragments (list): fragmentos recuperados (con "id" y "texto").
+        - top_n (int): número de fragmentos que se conservan.
+        - stats (dict): se rellena con "candidates", "cached", "kept" y "s" (segundos).
+
+        Retorna:
+        - list: los top_n fragmentos, con su puntuación en "rerank_score".
+        """
+        start = time.perf_counter()
+        if not fragments:
+            return []
+        scores, cached = self.score(query, fragments)
+        orden = np.argsort(-scores, kind="stable")[:top_n]
+        results = [{**fragments[i], "rerank_score": float(scores[i])} for i in orden]
+        if stats is not None:
+            stats.update(candidates=len(fragments), cached=cached, kept=len(results), s=time.perf_counter() - start)
+        return results
+
+    def clear(self):
+        """Vacía la caché de puntuaciones (ej. al cambiar de paquete de recuperación)."""
+        with self._lock:
+            self._cache.clear()
+
+
+# Función principal
+def main():
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import get_chatbot_registry, retrieve_relevant_fragments
+
+    parser = argparse.ArgumentParser(description="Reordena los fragmentos recuperados con un cross-encoder")
+    parser.add_argument("queries", nargs="+")
+    parser.add_argument("--model", default=RERANK_MODEL)
+    parser.add_argument("--pool", type=int, default=RERANK_POOL)
+    parser.add_argument("--top-n", type=int, default=RERANK_TOP_N)
+    args = parser.parse_args()
+
+    registry = get_chatbot_registry()
+    bundle = registry.get("retrieval")
+    reranker = CrossEncoderReranker(args.model)
+    for query in args.queries:
+        query = query.lower()
+        candidatos = retrieve_relevant_fragments(
+            query, registry.get("embedder"), bundle.fragments, bundle.index, "llama2", k=args.pool, adaptive=False,
+        )
+        stats = {}
+        mejores = reranker.rerank(query, candidatos, args.top_n, stats)
+        print(f"{query!r}: {stats['candidates']} candidatos puntuados en {stats['s'] * 1000:.1f} ms")
+        puestos = {c["id"]: i + 1 for i, c in enumerate(candidatos)}
+        for frag in mejores:
+            print(f"    {frag['rerank_score']:7.3f}  (puesto {puestos[frag['id']]} en FAISS)  {frag.get('medicamento')} / {frag.get('categoria')}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
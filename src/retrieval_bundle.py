@@ -0,0 +1,686 @@
+# retrieval_bundle.py
+"""
+Paquete versionado de recuperación: índice FAISS + fragmentos + manifiesto (modelo de embeddings, dimensión, número de vectores y checksums) en una misma carpeta, de forma que el índice y los fragmentos no puedan desincronizarse.
+
+Estructura en disco:
+    bundles/
+        CURRENT                      # versión activa (se actualiza de forma atómica)
+        20250101-120000-1a2b3c4d/
+            index.faiss
+            fragments.json
+            fragment_store/          # los mismos fragmentos en formato columnar (fragment_store.py)
+            manifest.json
+            names/                   # índice de nombres de medicamentos (drug_names.py)
+            bm25/                    # índice léxico BM25 de los fragmentos (sparse_index.py)
+            tokens/                  # fragmentos pre-tokenizados de este paquete (fragment_tokens.py)
+
+El índice y los fragmentos (almacén columnar) se abren con mmap, así que varios procesos que sirven el mismo paquete comparten sus páginas. Los checksums de todos los ficheros se comprueban una sola vez, al activar el paquete; al cargarlo (al arrancar o en un cambio en caliente) solo se comprueban los tamaños, para no leer del disco el paquete entero. Un servidor en marcha cambia de paquete en caliente con `BundleWatcher`: el nuevo paquete se carga y se calienta en segundo plano y después se sustituye de forma atómica en el registro de modelos, sin reinicios ni picos de latencia en las consultas en curso.
+
+Uso:
+    python src/retrieval_bundle.py build [--index RUTA] [--fragments RUTA] [--no-activate]
+    python src/retrieval_bundle.py activate VERSION
+    python src/retrieval_bundle.py list
+    python src/retrieval_bundle.py update [--fragments RUTA] [--dedup]   # solo embebe lo nuevo o modificado
+    python src/fragment_tokens.py --fragments BUNDLE/fragments.json --output-dir BUNDLE/tokens
+"""
+
+# Librerías
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import functools
+import threading
+
+import faiss
+import numpy as np
+
+from fragment_dedup import text_hash, dedup_fragments
+from metadata_filter import MetadataIndex
+from query_intent import IntentParser
+from drug_names import DrugNameIndex
+from sparse_index import BM25Index
+from fragment_store import FragmentStore, fragment_column, write_fragment_store
+from fragment_tokens import TOKENIZER_NAMES, build_token_stores
+
+# Carpeta por defecto de los paquetes de recuperación
+BUNDLES_DIR = "./data/outputs/5_chatbot/bundles"
+
+# Ficheros de cada paquete
+INDEX_FILE = "index.faiss"
+FRAGMENTS_FILE = "fragments.json"
+MANIFEST_FILE = "manifest.json"
+TOKENS_DIR = "tokens"
+NAMES_DIR = "names"
+SPARSE_DIR = "bm25"
+FRAGMENT_STORE_DIR = "fragment_store"
+CURRENT_FILE = "CURRENT"
+
+
+# Función para calcular el checksum de un fichero
+def file_sha256(path, chunk_size=1 << 20):
+    """SHA-256 del contenido de un fichero, leído por bloques."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(chunk_size), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+# Función para comprobar los ficheros de un paquete contra su manifiesto
+def verify_bundle(path, manifest=None, checksums=True):
+    """
+    Comprueba que los ficheros del paquete tienen el tamaño y, con `checksums`, el sha256 del
+    manifiesto (esto último lee el paquete entero). Lanza ValueError si alguno no coincide.
+    """
+    if manifest is None:
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    for name, info in manifest["files"].items():
+        fichero = os.path.join(path, name)
+        if not os.path.isfile(fichero) or info.get("bytes", os.path.getsize(fichero)) != os.path.getsize(fichero):
+            raise ValueError(f"Paquete {manifest['version']}: falta {name} o su tamaño no coincide con el manifiesto")
+        if checksums and file_sha256(fichero) != info["sha256"]:
+            raise ValueError(f"Paquete {manifest['version']}: checksum incorrecto en {name}")
+
+
+# Función para leer un índice FAISS con mmap
+def read_index(path, mmap=True):
+    """
+    Lee un índice FAISS. Con mmap, los vectores de los índices planos (IndexFlat*) no se copian
+    a memoria: se leen del fichero bajo demanda y las páginas se comparten entre procesos.
+    """
+    if mmap:
+        for flag in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+            if hasattr(faiss, flag):
+                try:
+                    return faiss.read_index(path, getattr(faiss, flag) | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    continue
+        logging.warning(f"No se pudo abrir {path} con mmap: se carga en memoria")
+    return faiss.read_index(path)
+
+
+# Función para escribir un fichero de texto de forma atómica
+def _write_atomic(path, text):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+class _PositionIndex:
+    """
+    Envoltorio de un índice con ids estables (IndexIDMap2 o IVF con ids) que devuelve la
+    posición de cada resultado en la lista de fragmentos, como un índice sin ids.
+
+    Parámetros:
+    - index: índice FAISS con ids.
+    - labels (list): id en el índice de cada fragmento, en el orden de la lista.
+    """
+
+    def __init__(self, index, labels):
+        self.index = index
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self._order = np.argsort(self.labels)
+        self._sorted = self.labels[self._order]
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def d(self):
+        return self.index.d
+
+    def to_positions(self, labels):
+        """Traduce ids del índice a posiciones en la lista de fragmentos (-1 se mantiene)."""
+        validos = labels >= 0
+        posiciones = np.full_like(labels, -1)
+        posiciones[validos] = self._order[np.searchsorted(self._sorted, labels[validos])]
+        return posiciones
+
+    def search(self, x, k, params=None):
+        distances, labels = self.index.search(x, k, params=params)
+        return distances, self.to_positions(labels)
+
+
+class RetrievalBundle:
+    """
+    Índice FAISS y fragmentos de una misma versión del corpus.
+
+    Parámetros:
+    - index: índice FAISS.
+    - fragments (list o FragmentStore): fragmentos, en el mismo orden que los vectores del índice.
+    - manifest (dict): versión, modelo de embeddings, dimensión y checksums.
+    - path (str): carpeta del paquete (None para los ficheros sueltos heredados).
+    - mmap (bool): si el índice está abierto con mmap.
+    """
+
+    def __init__(self, index, fragments, manifest, path=None, mmap=False):
+        # Con ids estables (paquetes actualizados de forma incremental), cada fragmento guarda
+        # su id en "faiss_id" y las búsquedas se traducen a posiciones de la lista. Con el almacén
+        # columnar se lee solo esa columna, sin construir los fragmentos
+        if isinstance(fragments, FragmentStore):
+            stable_ids = "faiss_id" in fragments.columns
+        else:
+            stable_ids = bool(fragments) and "faiss_id" in fragments[0]
+        if stable_ids:
+            index = _PositionIndex(index, fragment_column(fragments, "faiss_id"))
+        self.index = index
+        self.fragments = fragments
+        self.manifest = manifest
+        self.path = path
+        self.mmap = mmap
+        self._metadata = None
+        self._names = None
+        self._intents = None
+        self._sparse = None
+
+    def __len__(self):
+        return len(self.fragments)
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    @property
+    def embedding_model(self):
+        return self.manifest["embedding_model"]
+
+    @property
+    def dimension(self):
+        return self.manifest["dimension"]
+
+    @property
+    def corpus_fingerprint(self):
+        """sha256 del JSON de fragmentos del paquete (huella de sus almacenes de tokens), o None."""
+        return self.manifest["files"].get(FRAGMENTS_FILE, {}).get("sha256")
+
+    @property
+    def nbytes(self):
+        """Memoria propia del proceso: fragmentos (y el índice, si no está abierto con mmap)."""
+        if isinstance(self.fragments, FragmentStore):
+            total = self.fragments.nbytes
+        else:
+            total = sum(sys.getsizeof(v) for frag in self.fragments for v in frag.values())
+        if not self.mmap:
+            total += int(self.index.ntotal) * int(self.index.d) * 4
+        return total
+
+    @property
+    def metadata(self):
+        """Listas invertidas para filtrar por medicamento, categoría y ATC (se construyen la primera vez)."""
+        if self._metadata is None:
+            self._metadata = MetadataIndex(self.fragments)
+        return self._metadata
+
+    @property
+    def names(self):
+        """Índice de nombres de medicamentos: el del paquete (con mmap) o, si no lo tiene, construido en memoria."""
+        if self._names is None:
+            path = os.path.join(self.path, NAMES_DIR) if self.path else None
+            self._names = DrugNameIndex.load(path) if path and os.path.isdir(path) else DrugNameIndex.build(self.fragments)
+        return self._names
+
+    @property
+    def sparse(self):
+        """Índice BM25 de los fragmentos: el del paquete (con mmap) o, si no lo tiene, construido en memoria."""
+        if self._sparse is None:
+            path = os.path.join(self.path, SPARSE_DIR) if self.path else None
+            self._sparse = BM25Index.load(path) if path and os.path.isdir(path) else BM25Index.build(self.fragments)
+        return self._sparse
+
+    @property
+    def intents(self):
+        """Reconocedor de consultas "<sección> de <medicamento>" con los nombres de este paquete."""
+        if self._intents is None:
+            self._intents = IntentParser(self.metadata, self.names)
+        return self._intents
+
+    def validate(self):
+        """Comprueba que el índice, los fragmentos y el manifiesto son coherentes entre sí."""
+        if self.index.ntotal != len(self.fragments):
+            raise ValueError(
+                f"Paquete {self.version}: el índice tiene {self.index.ntotal} vectores y hay {len(self.fragments)} fragmentos"
+            )
+        if self.index.d != self.dimension:
+            raise ValueError(f"Paquete {self.version}: dimensión del índice {self.index.d} != {self.dimension} del manifiesto")
+
+    def warm_up(self):
+        """
+        Recorre el índice con una búsqueda para cargar sus páginas y construye las listas de
+        filtrado, el reconocedor de consultas y el índice BM25 antes de servir consultas.
+        """
+        if self.index.ntotal:
+            self.index.search(np.zeros((1, self.index.d), dtype=np.float32), 1)
+        self.intents
+        self.sparse
+
+    @classmethod
+    def load(cls, path, verify=False, mmap=True):
+        """
+        Carga un paquete desde su carpeta. Siempre se comprueba el tamaño de los ficheros; los
+        checksums ya se comprobaron al activarlo (ver activate_bundle).
+
+        Parámetros:
+        - path (str): carpeta del paquete.
+        - verify (bool): si es True, se comprueban también los checksums (lee el paquete entero).
+        - mmap (bool): si es True, el índice y el almacén columnar de fragmentos se abren con mmap.
+        """
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        verify_bundle(path, manifest, checksums=verify)
+        # Los paquetes antiguos (sin almacén columnar) se leen del JSON
+        if os.path.isdir(os.path.join(path, FRAGMENT_STORE_DIR)):
+            fragments = FragmentStore(os.path.join(path, FRAGMENT_STORE_DIR), mmap)
+        else:
+            with open(os.path.join(path, FRAGMENTS_FILE), "r", encoding="utf-8") as f:
+                fragments = json.load(f)
+        bundle = cls(read_index(os.path.join(path, INDEX_FILE), mmap), fragments, manifest, path, mmap)
+        bundle.validate()
+        return bundle
+
+    @classmethod
+    def from_files(cls, index_path, fragments_path, embedding_model, version, mmap=True):
+        """Paquete a partir del índice y el JSON de fragmentos sueltos (rutas heredadas)."""
+        with open(fragments_path, "r", encoding="utf-8") as f:
+            fragments = json.load(f)
+        index = read_index(index_path, mmap)
+        manifest = {
+            "version": version,
+            "embedding_model": embedding_model,
+            "dimension": int(index.d),
+            "ntotal": int(index.ntotal),
+            "num_fragments": len(fragments),
+            "files": {},
+        }
+        bundle = cls(index, fragments, manifest, None, mmap)
+        bundle.validate()
+        return bundle
+
+
+# Función para obtener la carpeta del paquete activo
+def current_bundle_path(bundles_dir=BUNDLES_DIR):
+    """Devuelve la carpeta del paquete activo según el puntero CURRENT, o None si no hay."""
+    pointer = os.path.join(bundles_dir, CURRENT_FILE)
+    if not os.path.isfile(pointer):
+        return None
+    with open(pointer, "r", encoding="utf-8") as f:
+        version = f.read().strip()
+    return os.path.join(bundles_dir, version) if version else None
+
+
+# Función para activar una versión del paquete
+def activate_bundle(version, bundles_dir=BUNDLES_DIR, verify=True):
+    """
+    Cambia el puntero CURRENT a la versión indicada (de forma atómica). Con `verify`, antes se
+    comprueban los checksums de sus ficheros: los servidores lo cargan después sin releerlo entero.
+    """
+    if not os.path.isfile(os.path.join(bundles_dir, version, MANIFEST_FILE)):
+        raise FileNotFoundError(f"No existe el paquete {version} en {bundles_dir}")
+    if verify:
+        verify_bundle(os.path.join(bundles_dir, version))
+    _write_atomic(os.path.join(bundles_dir, CURRENT_FILE), version + "\n")
+    logging.info(f"Paquete de recuperación activo: {version}")
+
+
+# Función para construir un paquete a partir del índice y los fragmentos
+def build_bundle(index_path, fragments_path, embedding_model, bundles_dir=BUNDLES_DIR, version=None, activate=True, metadata=None, token_models=None):
+    """
+    Crea un paquete versionado con el índice, los fragmentos y su manifiesto. El paquete se
+    escribe en una carpeta temporal y se renombra al final, así que nunca se ve a medias.
+
+    Parámetros:
+    - index_path (str): índice FAISS.
+    - fragments_path (str): JSON de fragmentos, en el orden de los vectores del índice.
+    - embedding_model (str): modelo de embeddings con el que se construyó el índice.
+    - bundles_dir (str): carpeta de los paquetes.
+    - version (str): nombre de la versión (por defecto, fecha + checksum).
+    - activate (bool): si es True, se activa el paquete al terminar.
+    - metadata (dict): campos adicionales del manifiesto (ej. la cadena de la index_factory).
+    - token_models (list): modelos cuyos fragmentos pre-tokenizados se guardan en tokens/ (por
+      defecto, todos los de TOKENIZER_NAMES; lista vacía para no construirlos).
+
+    Retorna:
+    - str: versión creada.
+    """
+    index = faiss.read_index(index_path)
+    with open(fragments_path, "r", encoding="utf-8") as f:
+        fragments = json.load(f)
+    num_fragments = len(fragments)
+    if index.ntotal != num_fragments:
+        raise ValueError(f"El índice tiene {index.ntotal} vectores y el JSON {num_fragments} fragmentos")
+
+    checksums = {INDEX_FILE: file_sha256(index_path), FRAGMENTS_FILE: file_sha256(fragments_path)}
+    if version is None:
+        huella = hashlib.sha256("".join(checksums.values()).encode()).hexdigest()[:8]
+        version = f"{time.strftime('%Y%m%d-%H%M%S')}-{huella}"
+
+    destino = os.path.join(bundles_dir, version)
+    if os.path.exists(destino):
+        raise FileExistsError(f"Ya existe el paquete {destino}")
+    tmp = destino + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    shutil.copyfile(index_path, os.path.join(tmp, INDEX_FILE))
+    shutil.copyfile(fragments_path, os.path.join(tmp, FRAGMENTS_FILE))
+    DrugNameIndex.build(fragments).save(os.path.join(tmp, NAMES_DIR))
+    BM25Index.build(fragments).save(os.path.join(tmp, SPARSE_DIR))
+    for name in write_fragment_store(fragments, os.path.join(tmp, FRAGMENT_STORE_DIR)):
+        name = f"{FRAGMENT_STORE_DIR}/{name}"
+        checksums[name] = file_sha256(os.path.join(tmp, name))
+    # Fragmentos pre-tokenizados de esta versión: sin ellos, cada consulta tokeniza el contexto
+    tokens = build_token_stores(
+        [frag["texto"] for frag in fragments], os.path.join(tmp, TOKENS_DIR),
+        list(TOKENIZER_NAMES) if token_models is None else token_models, corpus=checksums[FRAGMENTS_FILE],
+    )
+    for name in tokens:
+        name = f"{TOKENS_DIR}/{name}"
+        checksums[name] = file_sha256(os.path.join(tmp, name))
+    manifest = {
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "embedding_model": embedding_model,
+        "dimension": int(index.d),
+        "ntotal": int(index.ntotal),
+        "num_fragments": num_fragments,
+        "index_type": type(index).__name__,
+        **(metadata or {}),
+        "files": {
+            name: {"sha256": sha, "bytes": os.path.getsize(os.path.join(tmp, name))} for name, sha in checksums.items()
+        },
+    }
+    with open(os.path.join(tmp, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.replace(tmp, destino)
+    logging.info(f"Paquete de recuperación {version} creado en {destino}")
+
+    # Los checksums se acaban de calcular sobre los ficheros escritos
+    if activate:
+        activate_bundle(version, bundles_dir, verify=False)
+    return version
+
+
+# Función para obtener la clave estable de un fragmento
+def _fragment_key(fragment):
+    """Hash del contenido (fragmentos deduplicados) o de la procedencia y el texto del fragmento."""
+    if "hash" in fragment:
+        return fragment["hash"]
+    return text_hash("\x00".join(
+        [fragment.get("medicamento", ""), fragment.get("nombre_medicamento_completo", ""), fragment.get("categoria", ""), fragment["texto"]]
+    ))
+
+
+# Función para actualizar el paquete activo solo con los fragmentos nuevos o modificados
+def update_bundle(fragments, embedding_model, embed, store, bundles_dir=BUNDLES_DIR, factory=None, version=None, activate=True, token_models=None):
+    """
+    Crea una nueva versión del paquete a partir de la activa: borra del índice (remove_ids) los
+    fragmentos que ya no existen y añade los nuevos o modificados, embebiendo solo los textos
+    que no están en el almacén de embeddings. Si no hay paquete activo con ids estables, si
+    cambia el modelo de embeddings o si el índice no admite borrados (ej. HNSW), el índice se
+    reconstruye entero a partir del almacén.
+
+    Parámetros:
+    - fragments (list): fragmentos actuales del corpus.
+    - embedding_model (str): modelo de embeddings.
+    - embed (callable): función lista de textos -> matriz de embeddings (solo se llama con los textos nuevos).
+    - store (EmbeddingStore): almacén de embeddings del modelo.
+    - bundles_dir (str): carpeta de los paquetes.
+    - factory (str): cadena de la index_factory para las reconstrucciones completas (por
+      defecto, la del paquete activo o "Flat").
+    - version (str): nombre de la nueva versión (por defecto, fecha + checksum).
+    - activate (bool): si es True, se activa la nueva versión.
+    - token_models (list): modelos cuyos fragmentos pre-tokenizados se guardan (ver build_bundle).
+
+    Retorna:
+    - tuple: (versión activa o creada, dict con "added", "removed", "embedded" y "rebuilt")
+    """
+    from index_factory import build_index
+
+    # Fragmentos idénticos (misma procedencia y texto) se guardan una sola vez
+    claves, unicos = set(), []
+    for frag in fragments:
+        clave = _fragment_key(frag)
+        if clave not in claves:
+            claves.add(clave)
+            unicos.append(frag)
+    if len(unicos) < len(fragments):
+        logging.warning(f"Se descartan {len(fragments) - len(unicos)} fragmentos repetidos")
+    fragments = [{k: v for k, v in frag.items() if k != "faiss_id"} for frag in unicos]
+
+    path = current_bundle_path(bundles_dir)
+    old = RetrievalBundle.load(path, mmap=False) if path else None
+    factory = factory or (old.manifest.get("factory") if old is not None else None) or "Flat"
+    resumen = {"added": 0, "removed": 0, "embedded": 0, "rebuilt": False}
+    store_stats = {}
+
+    index = None
+    if old is not None and isinstance(old.index, _PositionIndex) and old.embedding_model == embedding_model:
+        # Los fragmentos del paquete activo se leen una sola vez (claves y comparación final)
+        previos = list(old.fragments)
+        anteriores = {_fragment_key(frag): frag["faiss_id"] for frag in previos}
+        obsoletos = np.array([label for clave, label in anteriores.items() if clave not in claves], dtype=np.int64)
+        # Los fragmentos que siguen conservan su id; los nuevos reciben ids a continuación
+        siguiente = max(anteriores.values(), default=-1) + 1
+        labels, nuevos, labels_nuevos = [], [], []
+        for frag in fragments:
+            clave = _fragment_key(frag)
+            if clave in anteriores:
+                labels.append(anteriores[clave])
+            else:
+                labels.append(siguiente)
+                nuevos.append(frag)
+                labels_nuevos.append(siguiente)
+                siguiente += 1
+        salida = [{**frag, "faiss_id": int(label)} for frag, label in zip(fragments, labels)]
+        if not len(obsoletos) and not nuevos and salida == previos:
+            logging.info(f"Sin cambios respecto al paquete {old.version}")
+            return old.version, resumen
+
+        index = old.index.index
+        try:
+            if len(obsoletos):
+                index.remove_ids(obsoletos)
+            if nuevos:
+                vectores = store.encode([frag["texto"] for frag in nuevos], embed, stats=store_stats)
+                index.add_with_ids(vectores, np.array(labels_nuevos, dtype=np.int64))
+            resumen.update(added=len(nuevos), removed=len(obsoletos))
+        except RuntimeError:
+            logging.warning(f"El índice {type(index).__name__} no admite borrados: se reconstruye entero")
+            index = None
+
+    if index is None:
+        salida = [{**frag, "faiss_id": i} for i, frag in enumerate(fragments)]
+        vectores = store.encode([frag["texto"] for frag in fragments], embed, stats=store_stats)
+        index, _ = build_index(vectores, factory, ids=np.arange(len(fragments)))
+        resumen.update(added=len(fragments), removed=old.index.ntotal if old is not None else 0, rebuilt=True)
+    resumen["embedded"] = store_stats.get("misses", 0)
+
+    tmp = os.path.join(bundles_dir, ".update")
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        faiss.write_index(index, os.path.join(tmp, INDEX_FILE))
+        with open(os.path.join(tmp, FRAGMENTS_FILE), "w", encoding="utf-8") as f:
+            json.dump(salida, f, ensure_ascii=False, indent=4)
+        version = build_bundle(
+            os.path.join(tmp, INDEX_FILE), os.path.join(tmp, FRAGMENTS_FILE), embedding_model, bundles_dir, version, activate,
+            metadata={"factory": factory}, token_models=token_models,
+        )
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    logging.info(
+        f"Paquete {version}: {resumen['added']} fragmentos añadidos, {resumen['removed']} borrados, "
+        f"{resumen['embedded']} textos embebidos" + (" (reconstrucción completa)" if resumen["rebuilt"] else "")
+    )
+    return version, resumen
+
+
+class BundleWatcher:
+    """
+    Vigila el puntero CURRENT y, si cambia, carga el nuevo paquete en segundo plano y lo
+    sustituye de forma atómica en el registro de modelos. Las consultas en curso terminan con
+    el paquete que ya tenían; las siguientes usan el nuevo.
+
+    Parámetros:
+    - registry (ModelRegistry): registro donde está el paquete activo.
+    - name (str): nombre del recurso del paquete en el registro.
+    - bundles_dir (str): carpeta de los paquetes.
+    - interval (float): segundos entre comprobaciones.
+    - on_swap (callable): función (paquete anterior, paquete nuevo) llamada tras cada cambio.
+    """
+
+    def __init__(self, registry, name="retrieval", bundles_dir=BUNDLES_DIR, interval=30.0, on_swap=None):
+        self.registry = registry
+        self.name = name
+        self.bundles_dir = bundles_dir
+        self.interval = interval
+        self.on_swap = on_swap
+        self.swaps = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """
+        Comprueba el puntero y cambia de paquete si hay una versión nueva.
+
+        Retorna:
+        - bool: True si se ha cambiado de paquete.
+        """
+        with self._lock:
+            path = current_bundle_path(self.bundles_dir)
+            if path is None:
+                return False
+            old = self.registry.get(self.name)
+            if os.path.basename(os.path.normpath(path)) == old.version:
+                return False
+            try:
+                new = RetrievalBundle.load(path)
+                new.warm_up()
+            except (OSError, ValueError, RuntimeError):
+                logging.exception(f"No se pudo cargar el paquete {path}: se mantiene {old.version}")
+                return False
+            self.registry.replace(self.name, new)
+            self.swaps += 1
+            logging.info(f"Paquete de recuperación cambiado en caliente: {old.version} -> {new.version}")
+            if self.on_swap is not None:
+                self.on_swap(old, new)
+            return True
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Error al comprobar el paquete de recuperación")
+
+    def start(self):
+        """Arranca la comprobación periódica en un hilo en segundo plano."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="bundle-watcher")
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+
+# Función para cargar el paquete activo
+def load_current_bundle(bundles_dir=BUNDLES_DIR, legacy=None):
+    """
+    Carga el paquete activo. Si todavía no se ha construido ninguno, se usa el índice y el
+    JSON sueltos de `legacy` (dict con index_path, fragments_path, embedding_model y version).
+    """
+    path = current_bundle_path(bundles_dir)
+    if path is not None:
+        bundle = RetrievalBundle.load(path)
+    elif legacy is not None:
+        logging.warning("No hay paquete de recuperación activo: se usan el índice y los fragmentos sueltos")
+        bundle = RetrievalBundle.from_files(**legacy)
+    else:
+        raise FileNotFoundError(f"No hay paquete de recuperación activo en {bundles_dir}")
+    bundle.warm_up()
+    return bundle
+
+
+# Función principal
+def main():
+    """Construye, activa o lista los paquetes de recuperación."""
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import FAISS_INDEX_PATH, FRAGMENTS_PATH, EMBEDDING_MODEL_NAME
+    from embedding_store import EMBEDDING_STORE_DIR
+
+    parser = argparse.ArgumentParser(description="Paquetes versionados de recuperación (índice + fragmentos)")
+    parser.add_argument("--bundles-dir", default=BUNDLES_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Crea un paquete a partir del índice y los fragmentos")
+    build.add_argument("--index", default=FAISS_INDEX_PATH)
+    build.add_argument("--fragments", default=FRAGMENTS_PATH)
+    build.add_argument("--embedding-model", default=EMBEDDING_MODEL_NAME)
+    build.add_argument("--version", default=None)
+    build.add_argument("--no-activate", action="store_true")
+    build.add_argument("--tokenizers", nargs="*", default=list(TOKENIZER_NAMES), help="Modelos cuyos fragmentos se pre-tokenizan")
+    activate = sub.add_parser("activate", help="Activa una versión (los servidores la cargan en caliente)")
+    activate.add_argument("version")
+    update = sub.add_parser("update", help="Nueva versión embebiendo solo los fragmentos nuevos o modificados")
+    update.add_argument("--fragments", default=FRAGMENTS_PATH)
+    update.add_argument("--embedding-model", default=EMBEDDING_MODEL_NAME)
+    update.add_argument("--store-dir", default=EMBEDDING_STORE_DIR)
+    update.add_argument("--factory", default=None, help="Índice de las reconstrucciones completas (por defecto, el del paquete activo)")
+    update.add_argument("--dedup", action="store_true", help="Deduplica los fragmentos por hash de contenido")
+    update.add_argument("--version", default=None)
+    update.add_argument("--no-activate", action="store_true")
+    update.add_argument("--tokenizers", nargs="*", default=list(TOKENIZER_NAMES), help="Modelos cuyos fragmentos se pre-tokenizan")
+    sub.add_parser("list", help="Lista los paquetes disponibles")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "build":
+        build_bundle(
+            args.index, args.fragments, args.embedding_model, args.bundles_dir, args.version, not args.no_activate,
+            token_models=args.tokenizers,
+        )
+    elif args.command == "activate":
+        activate_bundle(args.version, args.bundles_dir)
+    elif args.command == "update":
+        from embedding_store import EmbeddingStore
+
+        @functools.lru_cache(maxsize=1)
+        def embedder():
+            from sentence_transformers import SentenceTransformer
+
+            return SentenceTransformer(args.embedding_model)
+
+        def embed(texts):
+            return embedder().encode(texts, convert_to_numpy=True, batch_size=64)
+
+        with open(args.fragments, "r", encoding="utf-8") as f:
+            fragments = json.load(f)
+        if args.dedup:
+            fragments, _ = dedup_fragments(fragments)
+        store = EmbeddingStore(args.store_dir, args.embedding_model)
+        update_bundle(
+            fragments, args.embedding_model, embed, store, args.bundles_dir, args.factory, args.version, not args.no_activate,
+            token_models=args.tokenizers,
+        )
+    else:
+        activo = current_bundle_path(args.bundles_dir)
+        for version in sorted(os.listdir(args.bundles_dir)) if os.path.isdir(args.bundles_dir) else []:
+            manifest_path = os.path.join(args.bundles_dir, version, MANIFEST_FILE)
+            if not os.path.isfile(manifest_path):
+                continue
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            marca = "*" if activo and os.path.basename(activo) == version else " "
+            print(f"{marca} {version}  {manifest['ntotal']} vectores  {manifest['embedding_model']}  {manifest['created']}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
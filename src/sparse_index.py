@@ -0,0 +1,213 @@
+# sparse_index.py
+"""
+Índice léxico BM25 de los fragmentos para la búsqueda híbrida (BM25 + FAISS).
+
+El modelo de embeddings (all-MiniLM-L6-v2) está entrenado en inglés y representa mal los nombres de medicamentos y excipientes en español, los códigos ATC o las dosis, así que la búsqueda vectorial pierde a menudo coincidencias literales (ej. "N02BE01" o "ibuprofeno 600"). El índice BM25 las recupera y sus resultados se combinan con los de FAISS por fusión de rangos recíprocos (RRF) en `retrieve_relevant_fragments`.
+
+Cada fragmento se indexa con su "medicamento" y su "texto", normalizados como los nombres de `drug_names.py` (minúsculas, sin tildes, solo letras y números) y sin palabras vacías. Las listas invertidas se guardan en formato CSR (desplazamientos por término, posiciones de los fragmentos y peso BM25 ya calculado de cada aparición), así que una consulta solo suma los pesos de las listas de sus términos. El vocabulario es un trie (marisa-trie) y el índice se guarda en la carpeta `bm25/` de cada paquete de recuperación y se abre con mmap.
+
+Uso:
+    python src/sparse_index.py build [--fragments RUTA] --output CARPETA
+    python src/sparse_index.py query "excipientes del N02BE01" [--index CARPETA] [--k 10]
+"""
+
+# Librerías
+import os
+import json
+import time
+import argparse
+from collections import Counter, defaultdict
+
+import marisa_trie
+import numpy as np
+
+from drug_names import normalize_text
+
+# Ficheros del índice
+TERMS_TRIE = "terms.marisa"
+META_FILE = "bm25.json"
+ARRAYS = ("offsets", "postings", "weights")
+
+# Parámetros de BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Constante de la fusión de rangos recíprocos (valor habitual en la literatura)
+RRF_K = 60
+
+# Palabras vacías (sobre el texto normalizado) que no se indexan
+STOPWORDS = {
+    "a", "al", "como", "con", "cual", "cuales", "de", "del", "el", "en", "es", "esta", "este", "hay", "la", "las",
+    "le", "les", "lo", "los", "mas", "me", "mi", "no", "o", "para", "pero", "por", "puede", "pueden", "puedo", "que",
+    "se", "si", "sin", "sobre", "son", "su", "sus", "un", "una", "y", "ya",
+}
+
+
+# Función para obtener los términos de un texto
+def tokenize(texto):
+    return [t for t in normalize_text(texto).split() if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Índice BM25 con listas invertidas CSR (ver la descripción del módulo).
+
+    Uso:
+        sparse = BM25Index.build(fragments)      # o BM25Index.load(carpeta)
+        scores, positions = sparse.search("excipientes del paracetamol", k=10)
+    """
+
+    def __init__(self, terms, num_docs, arrays, k1=BM25_K1, b=BM25_B):
+        self.terms = terms
+        self.num_docs = num_docs
+        self.k1 = k1
+        self.b = b
+        for nombre in ARRAYS:
+            setattr(self, nombre, arrays[nombre])
+
+    def __len__(self):
+        return self.num_docs
+
+    @classmethod
+    def build(cls, fragments, k1=BM25_K1, b=BM25_B):
+        """Construye el índice en memoria; la posición de cada fragmento en la lista es su id."""
+        listas = defaultdict(list)
+        longitudes = np.zeros(len(fragments), dtype=np.float32)
+        for pos, frag in enumerate(fragments):
+            terminos = Counter(tokenize(f"{frag.get('medicamento', '')} {frag.get('texto', '')}"))
+            longitudes[pos] = sum(terminos.values())
+            for termino, tf in terminos.items():
+                listas[termino].append((pos, tf))
+
+        terms = marisa_trie.Trie(listas)
+        avgdl = float(longitudes.mean()) if len(fragments) else 1.0
+        por_termino = [None] * len(terms)
+        for termino, lista in listas.items():
+            por_termino[terms[termino]] = lista
+
+        # Peso de cada aparición: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * longitud / longitud media))
+        offsets = np.cumsum([0] + [len(x) for x in por_termino]).astype(np.int64)
+        postings = np.asarray([pos for x in por_termino for pos, _ in x], dtype=np.int32)
+        tf = np.asarray([tf for x in por_termino for _, tf in x], dtype=np.float32)
+        df = np.diff(offsets).astype(np.float32)
+        idf = np.log1p((len(fragments) - df + 0.5) / (df + 0.5))
+        norma = k1 * (1 - b + b * longitudes[postings] / max(avgdl, 1e-6))
+        weights = (np.repeat(idf, np.diff(offsets)) * tf * (k1 + 1) / (tf + norma)).astype(np.float32)
+        return cls(terms, len(fragments), {"offsets": offsets, "postings": postings, "weights": weights}, k1, b)
+
+    def save(self, path):
+        """Escribe el índice en la carpeta `path`."""
+        os.makedirs(path, exist_ok=True)
+        self.terms.save(os.path.join(path, TERMS_TRIE))
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"num_docs": self.num_docs, "k1": self.k1, "b": self.b}, f)
+        for nombre in ARRAYS:
+            np.save(os.path.join(path, f"{nombre}.npy"), getattr(self, nombre))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Abre el índice de la carpeta `path` (con mmap)."""
+        terms = marisa_trie.Trie()
+        (terms.mmap if mmap else terms.load)(os.path.join(path, TERMS_TRIE))
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {nombre: np.asarray(np.load(os.path.join(path, f"{nombre}.npy"), mmap_mode="r" if mmap else None)) for nombre in ARRAYS}
+        return cls(terms, meta["num_docs"], arrays, meta["k1"], meta["b"])
+
+    def search(self, query, k, positions=None):
+        """
+        Fragmentos con mayor puntuación BM25 para la consulta.
+
+        Parámetros:
+        - query (str): consulta del usuario.
+        - k (int): número máximo de resultados.
+        - positions (np.ndarray): si se indica, solo se puntúan esos fragmentos (filtros de metadatos).
+
+        Retorna:
+        - tuple: (puntuaciones, posiciones de los fragmentos), de mayor a menor puntuación y
+          solo con los fragmentos que contienen algún término de la consulta.
+        """
+        listas = []
+        for termino in set(tokenize(query)):
+            if termino in self.terms:
+                j = self.terms[termino]
+                listas.append(slice(self.offsets[j], self.offsets[j + 1]))
+        if not listas:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        docs = np.concatenate([self.postings[s] for s in listas])
+        scores = np.bincount(docs, np.concatenate([self.weights[s] for s in listas]), minlength=self.num_docs)
+        if positions is not None:
+            candidatos = np.asarray(positions, dtype=np.int64)
+            candidatos = candidatos[scores[candidatos] > 0]
+        else:
+            candidatos = np.unique(docs).astype(np.int64)
+        if len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(-scores[candidatos], k - 1)[:k]]
+        candidatos = candidatos[np.argsort(-scores[candidatos], kind="stable")]
+        return scores[candidatos].astype(np.float32), candidatos
+
+
+# Función para combinar varias listas de resultados por fusión de rangos recíprocos
+def reciprocal_rank_fusion(rankings, k=RRF_K, limit=None):
+    """
+    Fusión de rangos recíprocos: cada fragmento suma 1 / (k + rango) por cada lista en la que
+    aparece, así que no hace falta que las puntuaciones de las listas sean comparables.
+
+    Parámetros:
+    - rankings (list): listas de posiciones de fragmentos, cada una de mejor a peor (-1 se ignora).
+    - k (int): constante de la fusión (amortigua el peso de los primeros puestos).
+    - limit (int): número máximo de resultados.
+
+    Retorna:
+    - list: tuplas (posición, puntuación) de mayor a menor puntuación.
+    """
+    fusion = defaultdict(float)
+    for ranking in rankings:
+        for rango, pos in enumerate(ranking):
+            if pos >= 0:
+                fusion[int(pos)] += 1.0 / (k + rango + 1)
+    return sorted(fusion.items(), key=lambda x: -x[1])[:limit]
+
+
+# Función principal
+def main():
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from utils import load_json, FRAGMENTS_PATH
+    from retrieval_bundle import current_bundle_path, FRAGMENTS_FILE, SPARSE_DIR
+
+    parser = argparse.ArgumentParser(description="Índice BM25 de los fragmentos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Construye el índice a partir de los fragmentos")
+    build.add_argument("--fragments", default=FRAGMENTS_PATH)
+    build.add_argument("--output", required=True)
+    query = sub.add_parser("query", help="Muestra los fragmentos con mayor puntuación de una o varias consultas")
+    query.add_argument("queries", nargs="+")
+    query.add_argument("--index", default=None, help="Carpeta del paquete de recuperación (por defecto, el activo)")
+    query.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        sparse = BM25Index.build(load_json(args.fragments))
+        sparse.save(args.output)
+        print(f"{len(sparse.terms)} términos de {len(sparse)} fragmentos en {args.output} ({time.perf_counter() - start:.1f} s)")
+        return
+
+    bundle_path = args.index or current_bundle_path()
+    fragments = load_json(os.path.join(bundle_path, FRAGMENTS_FILE))
+    sparse = BM25Index.load(os.path.join(bundle_path, SPARSE_DIR))
+    for q in args.queries:
+        start = time.perf_counter()
+        scores, positions = sparse.search(q, args.k)
+        print(f"{q!r} ({(time.perf_counter() - start) * 1000:.2f} ms)")
+        for score, pos in zip(scores, positions):
+            frag = fragments[pos]
+            print(f"    {score:6.2f}  [{pos}] {frag.get('medicamento')} / {frag.get('categoria')}: {frag['texto'][:80]!r}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
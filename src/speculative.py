@@ -0,0 +1,194 @@
+# speculative.py
+"""
+Decodificación especulativa por búsqueda en el prompt (prompt lookup). Las respuestas del chatbot copian literalmente tramos de las fichas técnicas recuperadas, así que los siguientes tokens suelen estar ya en el prompt: se busca el último n-grama generado en la secuencia, se proponen como borrador los tokens que lo siguen y el modelo los verifica todos en una sola pasada. Se aceptan los tokens del borrador que coinciden con la elección voraz del modelo, por lo que la salida es idéntica a la de la búsqueda voraz (greedy) y no hace falta un segundo modelo.
+"""
+
+# Librerías
+import time
+
+import numpy as np
+import torch
+from numpy.lib.stride_tricks import sliding_window_view
+from transformers import RepetitionPenaltyLogitsProcessor
+
+
+# Función para proponer tokens de borrador a partir de la propia secuencia
+def find_draft(ids, ngram_size=3, num_draft_tokens=10, min_ngram_size=2):
+    """
+    Busca la aparición más reciente del último n-grama de `ids` (probando de `ngram_size` a
+    `min_ngram_size` tokens) y devuelve los tokens que la siguen.
+
+    Parámetros:
+    - ids (np.ndarray): secuencia actual (prompt + tokens generados).
+    - ngram_size (int): tamaño máximo del n-grama buscado.
+    - num_draft_tokens (int): número máximo de tokens propuestos.
+    - min_ngram_size (int): tamaño mínimo del n-grama buscado.
+
+    Retorna:
+    - list: tokens del borrador (vacía si no hay coincidencia).
+    """
+    for n in range(ngram_size, min_ngram_size - 1, -1):
+        if len(ids) <= n:
+            continue
+        patron = ids[-n:]
+        # Ventanas que terminan antes del último token (se excluye el propio n-grama final)
+        ventanas = sliding_window_view(ids[:-1], n)
+        coincidencias = np.flatnonzero((ventanas == patron).all(axis=1))
+        if len(coincidencias):
+            inicio = int(coincidencias[-1]) + n
+            return ids[inicio:inicio + num_draft_tokens].tolist()
+    return []
+
+
+# Función para recortar la caché KV a una longitud
+def _crop_cache(past_key_values, length):
+    """Descarta de la caché las posiciones de los tokens de borrador rechazados."""
+    if hasattr(past_key_values, "crop"):
+        past_key_values.crop(length)
+        return past_key_values
+    return tuple((k[:, :, :length], v[:, :, :length]) for k, v in past_key_values)
+
+
+# Función para obtener la longitud de la caché KV
+def _cache_length(past_key_values):
+    if past_key_values is None:
+        return 0
+    if hasattr(past_key_values, "get_seq_length"):
+        return past_key_values.get_seq_length()
+    return past_key_values[0][0].shape[2]
+
+
+# Función para generar con decodificación especulativa por búsqueda en el prompt
+def prompt_lookup_generate(
+    model,
+    input_ids,
+    max_new_tokens=256,
+    eos_token_id=None,
+    repetition_penalty=1.0,
+    ngram_size=3,
+    num_draft_tokens=10,
+    past_key_values=None,
+    streamer=None,
+    stats=None,
+    should_stop=None,
+):
+    """
+    Genera con búsqueda voraz verificando en cada paso los tokens de borrador tomados del
+    propio prompt. Devuelve lo mismo que `model.generate(..., do_sample=False)`.
+
+    Parámetros:
+    - model: modelo causal de Hugging Face.
+    - input_ids (torch.Tensor): ids del prompt (1 x L); solo se admite un prompt.
+    - max_new_tokens (int): número máximo de tokens generados.
+    - eos_token_id (int): token de fin de secuencia.
+    - repetition_penalty (float): penalización por repetición (como en model.generate).
+    - ngram_size (int): tamaño máximo del n-grama buscado en la secuencia.
+    - num_draft_tokens (int): tokens de borrador verificados por paso.
+    - past_key_values: caché KV de un prefijo del prompt (ej. PrefixKVCache.copy()).
+    - streamer: streamer de transformers (ej. TextIteratorStreamer), opcional.
+    - should_stop (callable): se llama tras cada pasada; si devuelve un valor verdadero, la
+      generación se detiene con los tokens aceptados hasta ese momento (ej. RequestDeadline.check).
+    - stats (dict): si se proporciona, se rellena con las estadísticas de la petición:
+      tokens propuestos y aceptados, tasa de aceptación, pasadas del modelo y la aceleración
+      estimada frente a la búsqueda voraz (tiempo de un paso sin borrador x tokens generados
+      frente al tiempo real).
+
+    Retorna:
+    - torch.Tensor: ids del prompt seguidos de los generados (1 x (L + n)).
+    """
+    if input_ids.shape[0] != 1:
+        raise ValueError("prompt_lookup_generate solo admite un prompt por llamada")
+    stats = {} if stats is None else stats
+    processor = RepetitionPenaltyLogitsProcessor(repetition_penalty) if repetition_penalty != 1.0 else None
+
+    def elegir(secuencia, logits):
+        """Token voraz tras aplicar la penalización por repetición."""
+        if processor is not None:
+            logits = processor(secuencia, logits.float())
+        return int(logits.argmax(dim=-1))
+
+    ids = input_ids
+    if streamer is not None:
+        streamer.put(ids.cpu())
+
+    # Prefill (solo de la parte no cubierta por la caché del prefijo)
+    start = time.perf_counter()
+    with torch.no_grad():
+        out = model(input_ids=ids[:, _cache_length(past_key_values):], past_key_values=past_key_values, use_cache=True)
+    past, logits = out.past_key_values, out.logits[:, -1]
+    prefill_s = time.perf_counter() - start
+
+    propuestos = aceptados = pasadas = 0
+    pasos_simples, tiempo_simple = 0, 0.0
+    generados = 0
+    terminado = False
+    decode_start = time.perf_counter()
+    while not terminado and generados < max_new_tokens:
+        # 1. Token voraz a partir de los logits de la última posición aceptada
+        siguiente = elegir(ids, logits)
+        nuevos = [siguiente]
+        generados += 1
+        terminado = siguiente == eos_token_id or generados >= max_new_tokens
+        if terminado:
+            # Último token: sus logits no se usarían, así que no hace falta otra pasada
+            ids = torch.cat([ids, torch.tensor([[siguiente]], device=ids.device)], dim=1)
+            if streamer is not None:
+                streamer.put(torch.tensor(nuevos))
+            break
+
+        # 2. Borrador: continuación del último n-grama dentro de la propia secuencia
+        secuencia = np.concatenate([ids[0].cpu().numpy(), [siguiente]])
+        borrador = find_draft(secuencia, ngram_size, min(num_draft_tokens, max_new_tokens - generados))
+
+        # 3. Una sola pasada del modelo para el token voraz y todo el borrador
+        paso_start = time.perf_counter()
+        feed = torch.tensor([[siguiente] + borrador], device=ids.device)
+        with torch.no_grad():
+            out = model(input_ids=feed, past_key_values=past, use_cache=True)
+        pasadas += 1
+        if not borrador:
+            pasos_simples += 1
+            tiempo_simple += time.perf_counter() - paso_start
+
+        # 4. Verificación: se acepta el borrador mientras coincida con la elección voraz
+        secuencia = torch.cat([ids, feed[:, :1]], dim=1)
+        n_aceptados = 0
+        for j, token in enumerate(borrador):
+            if elegir(secuencia, out.logits[:, j]) != token:
+                break
+            n_aceptados += 1
+            generados += 1
+            secuencia = torch.cat([secuencia, feed[:, j + 1:j + 2]], dim=1)
+            nuevos.append(token)
+            if token == eos_token_id:
+                terminado = True
+                break
+        propuestos += len(borrador)
+        aceptados += n_aceptados
+
+        ids = secuencia
+        logits = out.logits[:, n_aceptados]
+        past = _crop_cache(out.past_key_values, ids.shape[1])
+        if streamer is not None:
+            streamer.put(torch.tensor(nuevos))
+        if should_stop is not None and should_stop():
+            break
+
+    if streamer is not None:
+        streamer.end()
+
+    decode_s = time.perf_counter() - decode_start
+    # Estimación de la búsqueda voraz: todos los tokens al coste medio de un paso sin borrador
+    paso_simple = tiempo_simple / pasos_simples if pasos_simples else None
+    stats.update(
+        new_tokens=generados,
+        forward_passes=pasadas,
+        draft_tokens=propuestos,
+        accepted_tokens=aceptados,
+        accept_rate=aceptados / propuestos if propuestos else 0.0,
+        tokens_per_pass=generados / pasadas if pasadas else 0.0,
+        prefill_s=prefill_s,
+        decode_s=decode_s,
+        speedup=(paso_simple * generados / decode_s) if paso_simple and decode_s else None,
+    )
+    return ids
@@ -0,0 +1,295 @@
+# telemetry.py
+"""
+Instrumentación de la latencia de cada etapa del camino pregunta-respuesta (guardado del audio, preprocesado, transcripción, embedding de la consulta, búsqueda en el índice, formateo del contexto, tokenización, prefill, decodificación y síntesis de voz).
+
+Cada etapa se mide con un span que se exporta de dos formas:
+
+1. Como una línea JSON en el log (ej. `logs/app_audio.log`), con la duración, la traza de la consulta y atributos como el número de tokens o de fragmentos.
+2. Como métricas en formato de texto de Prometheus (resumen con p50/p95/p99 por etapa y contadores de tokens y fragmentos), escritas en un fichero y, opcionalmente, servidas por HTTP.
+
+Los percentiles de un log ya escrito se calculan con:
+    python src/telemetry.py logs/app_audio.log
+"""
+
+# Librerías
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Percentiles exportados
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Ruta por defecto del fichero de métricas
+METRICS_PATH = "logs/metrics.prom"
+
+# Span activo en el contexto actual (para propagar la traza de la consulta)
+_current_span = contextvars.ContextVar("pharmai_span", default=None)
+
+
+# Función para calcular un percentil
+def quantile(values, q):
+    """Percentil q (0-1) por interpolación lineal; None si no hay valores."""
+    values = sorted(values)
+    if not values:
+        return None
+    pos = (len(values) - 1) * q
+    lo, hi = int(pos), min(int(pos) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+class Span:
+    """Etapa medida: nombre, traza de la consulta, span padre y atributos."""
+
+    def __init__(self, name, trace_id, parent=None, attrs=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.parent = parent
+        self.attrs = dict(attrs or {})
+
+    def set(self, **attrs):
+        """Añade atributos al span (ej. número de tokens o de fragmentos)."""
+        self.attrs.update(attrs)
+
+
+class Telemetry:
+    """
+    Registro de spans con exportación a log JSON y a métricas de Prometheus.
+
+    Parámetros:
+    - window (int): número de duraciones recientes por etapa usadas para los percentiles.
+    - write_interval (float): segundos mínimos entre escrituras del fichero de métricas.
+    """
+
+    def __init__(self, window=2048, write_interval=5.0):
+        self.window = window
+        self.write_interval = write_interval
+        self.metrics_path = None
+        self.logger = logging.getLogger("pharmai.telemetry")
+
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=self.window))
+        self._count = defaultdict(int)
+        self._sum = defaultdict(float)
+        self._items = defaultdict(float)  # (etapa, atributo) -> total acumulado
+        self._last_write = 0.0
+        self._server = None
+
+    # -------- Configuración --------
+
+    def configure(self, log_path=None, metrics_path=METRICS_PATH, port=None):
+        """
+        Configura los destinos de exportación.
+
+        Parámetros:
+        - log_path (str): fichero donde se escriben los spans como líneas JSON.
+        - metrics_path (str): fichero con las métricas en formato Prometheus (None para no escribirlo).
+        - port (int): si se indica, sirve las métricas por HTTP en /metrics.
+        """
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            ruta = os.path.abspath(log_path)
+            if not any(getattr(h, "baseFilename", None) == ruta for h in self.logger.handlers):
+                handler = logging.FileHandler(log_path, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+            # Las líneas JSON no se repiten con el formato del log raíz
+            self.logger.propagate = False
+        self.metrics_path = metrics_path
+        if port and self._server is None:
+            self.serve(port)
+
+    # -------- Spans --------
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Mide la duración del bloque como una etapa. Los spans anidados heredan la traza del
+        span que los contiene; un span sin padre inicia una traza nueva.
+
+        Uso:
+            with telemetry.span("index_search", k=10) as span:
+                ...
+                span.set(fragments=len(resultados))
+        """
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else uuid.uuid4().hex[:16], parent.name if parent else None, attrs)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # El span se cerró en otro contexto (ej. un generador finalizado por el GC)
+                pass
+            self._finish(span, duration)
+
+    def record(self, name, duration_s, **attrs):
+        """Registra una etapa medida por otro medio (ej. prefill y decodificación del LLM)."""
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else uuid.uuid4().hex[:16], parent.name if parent else None, attrs)
+        self._finish(span, duration_s)
+
+    def _finish(self, span, duration):
+        with self._lock:
+            self._durations[span.name].append(duration)
+            self._count[span.name] += 1
+            self._sum[span.name] += duration
+            for key, value in span.attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and (key.endswith("tokens") or key == "fragments"):
+                    self._items[(span.name, key)] += value
+
+        self.logger.info(json.dumps({
+            "ts": time.time(),
+            "span": span.name,
+            "trace_id": span.trace_id,
+            "parent": span.parent,
+            "duration_ms": round(duration * 1000, 3),
+            **span.attrs,
+        }, ensure_ascii=False, default=str))
+
+        if self.metrics_path and time.time() - self._last_write >= self.write_interval:
+            self.write_metrics()
+
+    # -------- Métricas --------
+
+    def summary(self):
+        """Percentiles (en ms), número de muestras y duración media de cada etapa."""
+        with self._lock:
+            resumen = {}
+            for name, durations in self._durations.items():
+                valores = list(durations)
+                resumen[name] = {
+                    "count": self._count[name],
+                    "mean_ms": self._sum[name] / self._count[name] * 1000,
+                    **{f"p{int(q * 100)}_ms": quantile(valores, q) * 1000 for q in QUANTILES},
+                }
+            return resumen
+
+    def prometheus_text(self):
+        """Métricas en formato de texto de Prometheus."""
+        with self._lock:
+            lineas = [
+                "# HELP pharmai_stage_duration_seconds Duración de cada etapa de la consulta.",
+                "# TYPE pharmai_stage_duration_seconds summary",
+            ]
+            for name in sorted(self._durations):
+                valores = list(self._durations[name])
+                for q in QUANTILES:
+                    lineas.append(f'pharmai_stage_duration_seconds{{stage="{name}",quantile="{q}"}} {quantile(valores, q):.6f}')
+                lineas.append(f'pharmai_stage_duration_seconds_sum{{stage="{name}"}} {self._sum[name]:.6f}')
+                lineas.append(f'pharmai_stage_duration_seconds_count{{stage="{name}"}} {self._count[name]}')
+            lineas += [
+                "# HELP pharmai_stage_items_total Tokens y fragmentos procesados en cada etapa.",
+                "# TYPE pharmai_stage_items_total counter",
+            ]
+            for (name, item), total in sorted(self._items.items()):
+                lineas.append(f'pharmai_stage_items_total{{stage="{name}",item="{item}"}} {total:g}')
+            return "\n".join(lineas) + "\n"
+
+    def write_metrics(self, path=None):
+        """Escribe las métricas en el fichero de Prometheus de forma atómica."""
+        path = path or self.metrics_path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(path + ".tmp", path)
+        self._last_write = time.time()
+
+    def serve(self, port, host="0.0.0.0"):
+        """Sirve las métricas en http://host:port/metrics desde un hilo en segundo plano."""
+        telemetry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+
+# Instancia única compartida por todo el proceso
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+# Función para obtener la telemetría del proceso
+def get_telemetry():
+    """Devuelve la instancia de Telemetry del proceso (la crea la primera vez)."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry()
+        return _telemetry
+
+
+# Función para calcular los percentiles de cada etapa a partir de un log
+def summarize_log(path):
+    """
+    Lee las líneas JSON de los spans de un log (ignora el resto de líneas) y devuelve, por
+    etapa, el número de muestras y los percentiles p50/p95/p99 en ms.
+    """
+    duraciones = defaultdict(list)
+    with open(path, "r", encoding="utf-8") as f:
+        for linea in f:
+            if not linea.startswith("{"):
+                continue
+            try:
+                span = json.loads(linea)
+            except ValueError:
+                continue
+            if "span" in span and "duration_ms" in span:
+                duraciones[span["span"]].append(span["duration_ms"])
+    return {
+        name: {"count": len(valores), **{f"p{int(q * 100)}_ms": quantile(valores, q) for q in QUANTILES}}
+        for name, valores in duraciones.items()
+    }
+
+
+# Función principal
+def main():
+    parser = argparse.ArgumentParser(description="Percentiles de latencia por etapa a partir de un log")
+    parser.add_argument("log", nargs="?", default="logs/app_audio.log")
+    args = parser.parse_args()
+
+    resumen = summarize_log(args.log)
+    if not resumen:
+        print(f"No hay spans en {args.log}")
+        sys.exit(1)
+    print(f"{'etapa':>18} | {'n':>6} | {'p50 (ms)':>10} | {'p95 (ms)':>10} | {'p99 (ms)':>10}")
+    for name, r in sorted(resumen.items(), key=lambda item: -item[1]["p50_ms"]):
+        print(f"{name:>18} | {r['count']:>6} | {r['p50_ms']:>10.1f} | {r['p95_ms']:>10.1f} | {r['p99_ms']:>10.1f}")
+
+
+# Ejecución del script
+if __name__ == "__main__":
+    main()
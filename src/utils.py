@@ -3,13 +3,82 @@
 # Librerías
 import os
 import json
+import logging
+import time
+import threading
+from contextlib import ExitStack
+from collections.abc import Mapping
+import numpy as np
 import torch
 import os
 from sentence_transformers import SentenceTransformer
 import faiss
 import tiktoken
 from optimum.neural_compressor import PostTrainingQuantConfig, INCQuantizer
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, GPT2TokenizerFast, GPT2LMHeadModel
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, GPT2TokenizerFast, GPT2LMHeadModel, TextIteratorStreamer, StoppingCriteriaList
+from registry import get_registry
+from batching import BatchingEngine
+from prefix_cache import PrefixKVCache, encode_prompt_parts
+from answer_cache import AnswerCache, corpus_version
+from precision import load_cpu_model
+from speculative import prompt_lookup_generate
+from telemetry import get_telemetry
+from fragment_tokens import FragmentTokenStore, PromptAssembler, TOKEN_STORE_DIR, corpus_fingerprint, encode_continuation
+from fragment_dedup import fragment_citation, text_hash
+from retrieval_bundle import BUNDLES_DIR, TOKENS_DIR, BundleWatcher, load_current_bundle
+from metadata_filter import MetadataIndex, filtered_search
+from sparse_index import reciprocal_rank_fusion
+from reranker import CrossEncoderReranker, RERANK_POOL, RERANK_TOP_N
+from extractive import extractive_answer
+from cascade import CascadeRouter, retrieval_confidence
+from deadline import RequestDeadline, DeadlineStoppingCriteria, GENERATION_DEADLINE_S, STOP_DISCONNECTED, truncation_marker
+
+# Rutas de los artefactos de recuperación y modelo de embeddings
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+FRAGMENTS_PATH = "./data/outputs/5_chatbot/contexto_medicamentos_chatbot.json"
+FAISS_INDEX_PATH = "./data/outputs/5_chatbot/faiss_index_IndexFlatL2.bin"
+
+# Segundos entre comprobaciones de un nuevo paquete de recuperación activo
+BUNDLE_POLL_SECONDS = float(os.environ.get("PHARMAI_BUNDLE_POLL_SECONDS", "30"))
+
+# Ruta directa para las consultas "<sección> de <medicamento>" (sin embedding ni FAISS), ver query_intent.py
+INTENT_FAST_PATH = os.environ.get("PHARMAI_INTENT_FAST_PATH", "1") != "0"
+
+# Búsqueda híbrida: resultados de BM25 fusionados con los de FAISS (ver sparse_index.py)
+HYBRID_SEARCH = os.environ.get("PHARMAI_HYBRID_SEARCH", "1") != "0"
+
+# Candidatos de cada búsqueda que entran en la fusión, en múltiplos de k
+HYBRID_DEPTH = 3
+
+# Número de fragmentos recuperados por modelo
+RETRIEVAL_K = {"llama2": 10, "gpt2": 3}
+
+# Reordenación de los candidatos con un cross-encoder antes de construir el contexto (ver reranker.py)
+RERANK = os.environ.get("PHARMAI_RERANK", "0") == "1"
+
+# Recorte adaptativo del número de fragmentos según sus distancias (ver adaptive_cutoff)
+ADAPTIVE_K = os.environ.get("PHARMAI_ADAPTIVE_K", "1") != "0"
+
+# Reglas del recorte: distancias L2 al cuadrado entre embeddings normalizados (de 0 a 4; 1.4
+# equivale a una similitud coseno de 0.3)
+ADAPTIVE_K_RULES = {
+    "max_distance": float(os.environ.get("PHARMAI_MAX_DISTANCE", "1.4")),
+    "max_gap": float(os.environ.get("PHARMAI_MAX_DISTANCE_GAP", "0.35")),
+    "elbow": 3.0,
+    "min_k": 1,
+}
+
+# Modo de respuesta por defecto: "generate" (LLM), "extractive" (frases de los fragmentos, sin
+# LLM, ver extractive.py) o "auto" (extractiva si el LLM aún no está cargado o hay demasiadas
+# generaciones en curso)
+ANSWER_MODES = ("generate", "extractive", "auto")
+ANSWER_MODE = os.environ.get("PHARMAI_ANSWER_MODE", "generate")
+
+# Generaciones simultáneas a partir de las cuales el modo "auto" responde de forma extractiva
+MAX_ACTIVE_GENERATIONS = int(os.environ.get("PHARMAI_MAX_GENERATIONS", "4"))
+
+# Nombre de modelo que activa la cascada extractiva -> GPT-2 -> Llama-2 (ver cascade.py)
+CASCADE_MODEL = "cascade"
 
 ##-------FUNCIONES GENERALES---------------------------------------------------------------##
 
@@ -128,36 +197,33 @@ def num_tokens_gpt2(texto: str) -> int:
     print(f"Número de tokens que entran al modelo GPT-2: {num_tokens}")
 
 
-# Función para generar la respuesta del modelo
-def generate_answer(query: str, context: str, model, tokenizer, model_name = "llama2"):
+# Función para tokenizar el prompt y mover modelo y tensores al dispositivo
+def _prepare_inputs(query: str, context: str, model, tokenizer, model_name="llama2", prompt_ids=None):
     """
-    Genera una respuesta usando GPT-2 o Llama2 según model_name.
-
-    Parámetros:
-    - query: la consulta del usuario.
-    - context: texto con fragmentos recuperados.
-    - model_name: "gpt2" o "llama2".
+    Construye el prompt según el modelo, lo tokeniza y mueve modelo y tensores al dispositivo.
+    Si se proporcionan `prompt_ids` (prompt ya ensamblado a partir de tokens pre-calculados),
+    se usan directamente sin tokenizar.
 
     Retorna:
-    - str: la respuesta generada.
+    - dict: tensores de entrada (input_ids, attention_mask) en el dispositivo del modelo.
     """
-
-    # Construir el prompt según el modelo
-    if model_name == "gpt2":
-        prompt = build_prompt(context, query, model_name)
-        num_tokens_gpt2(prompt) # obtener el número de tokens
-        inputs = tokenizer(
-            prompt,
-            return_tensors="pt",
-            truncation=True,
-            max_length=1024
-        )
-    else:  # llama2-chat
-        prompt = build_prompt(context, query)
-        inputs = tokenizer(
-            prompt,
-            return_tensors="pt"
-        )
+    with get_telemetry().span("tokenization", pretokenized=prompt_ids is not None) as span:
+        if prompt_ids is not None:
+            input_ids = list(prompt_ids)
+        else:
+            # Construir el prompt según el modelo. Se tokeniza por partes (prefijo fijo + contexto y
+            # pregunta) para que los ids del prefijo coincidan con los de su caché KV
+            prefix, suffix = build_prompt_parts(context, query, model_name)
+            if model_name == "gpt2":
+                num_tokens_gpt2(prefix + suffix) # obtener el número de tokens
+            # El contexto ya se ha empaquetado dentro del presupuesto de tokens del modelo, así que
+            # no se recorta aquí (recortar por el final eliminaría la pregunta)
+            input_ids = encode_prompt_parts(tokenizer, prefix, suffix)
+        inputs = {
+            "input_ids": torch.tensor([input_ids]),
+            "attention_mask": torch.ones(1, len(input_ids), dtype=torch.long),
+        }
+        span.set(prompt_tokens=len(input_ids))
 
     # Seleccionar dispositivo
     if torch.cuda.is_available():
@@ -167,34 +233,175 @@ def generate_answer(query: str, context: str, model, tokenizer, model_name = "ll
     else:
         device = "cpu"
 
-    print("Usando dispositivo:", device)
+    logging.debug("Usando dispositivo: %s", device)
 
     # Mover modelo y tensores
     model.to(device)
-    inputs = {k: v.to(device) for k, v in inputs.items()}
+    return {k: v.to(device) for k, v in inputs.items()}
+
+
+# Parámetros de generación que admite el motor de batching continuo
+_ENGINE_PARAMS = ("max_new_tokens", "do_sample", "temperature", "top_p", "repetition_penalty")
 
+
+# Función con los parámetros de generación de cada modelo
+def _generation_kwargs(model_name, tokenizer):
+    """Devuelve los parámetros de model.generate para gpt2 o llama2."""
     if model_name == "gpt2":
-       # Búsqueda con beams (más determinista y coherente)
-        output_ids = model.generate(
-            **inputs,
+        # Búsqueda con beams (más determinista y coherente)
+        return dict(
             max_new_tokens=500,
             do_sample=False,
             num_beams=5,
             early_stopping=True,
             pad_token_id=tokenizer.eos_token_id,
         )
-
     elif model_name == "llama2":
-        # Generación de texto
+        return dict(
+            max_new_tokens=2000,
+            do_sample=True,
+            temperature=0.1,
+            top_p=0.9,
+            repetition_penalty=1.2,
+        )
+    raise ValueError(f"Modelo desconocido: {model_name}")
+
+
+class _TokenTimer:
+    """
+    Streamer mínimo para model.generate: marca el instante del primer token generado (fin del
+    prefill) y cuenta los tokens. Reenvía los tokens a otro streamer si se indica.
+    """
+
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.num_tokens = 0
+        self._prompt = True
+
+    def put(self, value):
+        # La primera llamada de model.generate contiene el prompt
+        if self._prompt:
+            self._prompt = False
+        else:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.num_tokens += value.numel()
+        if self.inner is not None:
+            self.inner.put(value)
+
+    def end(self):
+        if self.inner is not None:
+            self.inner.end()
+
+    def record(self, prompt_tokens, **attrs):
+        """Registra los spans de prefill y decodificación de la generación."""
+        end = time.perf_counter()
+        telemetry = get_telemetry()
+        if self.first_token_at is None:
+            telemetry.record("prefill", end - self.start, prompt_tokens=prompt_tokens, **attrs)
+            return
+        telemetry.record("prefill", self.first_token_at - self.start, prompt_tokens=prompt_tokens, **attrs)
+        telemetry.record("decode", end - self.first_token_at, new_tokens=self.num_tokens, **attrs)
+
+
+# Función para generar con decodificación especulativa por búsqueda en el prompt
+def _prompt_lookup(inputs, model, tokenizer, gen_kwargs, prefix_cache, stats, streamer=None, deadline=None):
+    """
+    Genera con prompt_lookup_generate (búsqueda voraz: sin muestreo ni beams) usando la
+    longitud máxima y la penalización por repetición del modelo. Guarda en stats la tasa de
+    aceptación del borrador y la aceleración estimada de la petición. Con `deadline`, la
+    generación se detiene tras la pasada en la que vence el plazo.
+    """
+    gen_kwargs = dict(gen_kwargs, num_beams=1)
+    gen_kwargs.pop("stopping_criteria", None)
+    gen_kwargs = _with_prefix_cache(inputs, gen_kwargs, prefix_cache)
+    output_ids = prompt_lookup_generate(
+        model,
+        inputs["input_ids"],
+        max_new_tokens=gen_kwargs["max_new_tokens"],
+        eos_token_id=tokenizer.eos_token_id,
+        repetition_penalty=gen_kwargs.get("repetition_penalty", 1.0),
+        past_key_values=gen_kwargs.get("past_key_values"),
+        streamer=streamer,
+        stats=stats,
+        should_stop=deadline.check if deadline is not None else None,
+    )
+    telemetry = get_telemetry()
+    telemetry.record("prefill", stats["prefill_s"], prompt_tokens=inputs["input_ids"].shape[-1], mode="prompt_lookup")
+    telemetry.record(
+        "decode", stats["decode_s"], new_tokens=stats["new_tokens"], mode="prompt_lookup",
+        accept_rate=round(stats["accept_rate"], 3),
+    )
+    logging.debug(
+        "Prompt lookup: %d/%d tokens de borrador aceptados, %.2f tokens por pasada",
+        stats["accepted_tokens"], stats["draft_tokens"], stats["tokens_per_pass"],
+    )
+    return output_ids
+
+
+# Función para reutilizar la caché KV del prefijo fijo del prompt
+def _with_prefix_cache(inputs, gen_kwargs, prefix_cache):
+    """
+    Añade a los parámetros de generación una copia de la caché del prefijo si el prompt
+    empieza por él. No se usa con beam search porque la caché no se replica por beam.
+    """
+    if (
+        prefix_cache is not None
+        and gen_kwargs.get("num_beams", 1) == 1
+        and prefix_cache.matches(inputs["input_ids"][0].tolist())
+    ):
+        gen_kwargs["past_key_values"] = prefix_cache.copy()
+    return gen_kwargs
+
+
+# Función para generar la respuesta del modelo
+def generate_answer(query: str, context: str, model, tokenizer, model_name = "llama2", prefix_cache=None, prompt_ids=None, prompt_lookup=False, stats=None, deadline=None):
+    """
+    Genera una respuesta usando GPT-2 o Llama2 según model_name.
+
+    Parámetros:
+    - query: la consulta del usuario.
+    - context: texto con fragmentos recuperados.
+    - model_name: "gpt2" o "llama2".
+    - prefix_cache (PrefixKVCache): caché KV del prefijo fijo del prompt (opcional).
+    - prompt_ids (list): ids del prompt ya ensamblado (opcional, ver build_prompt_ids).
+    - prompt_lookup (bool): si es True, se decodifica de forma voraz con borradores tomados
+      del propio prompt (ver speculative.py); la salida es la de la búsqueda voraz.
+    - stats (dict): con prompt_lookup, se rellena stats["speculative"] con la tasa de
+      aceptación y la aceleración de la petición; si la generación se interrumpe, el motivo se
+      guarda en stats["truncated"].
+    - deadline (RequestDeadline): plazo y cancelación de la consulta (opcional). Al vencer, la
+      generación se detiene tras el token en curso y se devuelve la respuesta parcial con una
+      marca de truncado.
+
+    Retorna:
+    - str: la respuesta generada.
+    """
+    stats = {} if stats is None else stats
+    inputs = _prepare_inputs(query, context, model, tokenizer, model_name, prompt_ids)
+    gen_kwargs = _generation_kwargs(model_name, tokenizer)
+    if deadline is not None:
+        gen_kwargs["stopping_criteria"] = StoppingCriteriaList([DeadlineStoppingCriteria(deadline)])
+
+    # Generación de texto
+    if prompt_lookup:
+        output_ids = _prompt_lookup(
+            inputs, model, tokenizer, gen_kwargs, prefix_cache, stats.setdefault("speculative", {}), deadline=deadline
+        )
+    elif gen_kwargs.get("num_beams", 1) > 1:
+        # Con beam search no hay streamer: se mide la generación completa
+        with get_telemetry().span("generate", prompt_tokens=inputs["input_ids"].shape[-1], num_beams=gen_kwargs["num_beams"]) as span:
+            with torch.no_grad():
+                output_ids = model.generate(**inputs, **gen_kwargs)
+            span.set(new_tokens=output_ids.shape[-1] - inputs["input_ids"].shape[-1])
+    else:
+        gen_kwargs = _with_prefix_cache(inputs, gen_kwargs, prefix_cache)
+        timer = _TokenTimer()
         with torch.no_grad():
-            output_ids = model.generate(
-                **inputs,
-                max_new_tokens=2000,
-                do_sample=True,
-                temperature=0.1,
-                top_p=0.9,
-                repetition_penalty=1.2,
-            )
+            output_ids = model.generate(**inputs, **gen_kwargs, streamer=timer)
+        timer.record(inputs["input_ids"].shape[-1])
 
     # Decodificar y extraer solo la respuesta
     #full_text = tokenizer.decode(output_ids[0], skip_special_tokens=True)
@@ -207,11 +414,135 @@ def generate_answer(query: str, context: str, model, tokenizer, model_name = "ll
     gen_tokens = output_ids[0][input_len:]
     response = tokenizer.decode(gen_tokens, skip_special_tokens=True).strip()
 
+    # Respuesta parcial si se ha alcanzado el plazo o se ha cancelado la consulta
+    if deadline is not None and deadline.reason is not None:
+        stats["truncated"] = deadline.reason
+        response = f"{response}\n\n{truncation_marker(deadline.reason)}".strip()
+
     return response
 
 
+# Función para generar la respuesta del modelo en streaming (texto incremental)
+def generate_answer_stream(query: str, context: str, model, tokenizer, model_name="llama2", stats=None, engine=None, prefix_cache=None, prompt_ids=None, prompt_lookup=False, deadline=None):
+    """
+    Genera la respuesta token a token. La generación se ejecuta en un hilo en segundo plano
+    (o en el motor de batching compartido si se indica `engine`) y esta función va
+    devolviendo los fragmentos de texto según se decodifican.
+
+    Con gpt2 se usa búsqueda voraz en lugar de beam search, ya que los beams no se pueden
+    emitir de forma incremental.
+
+    Parámetros:
+    - query: la consulta del usuario.
+    - context: texto con fragmentos recuperados.
+    - model_name: "gpt2" o "llama2".
+    - stats (dict): si se proporciona, se rellena con "ttft_s" (tiempo hasta el primer token),
+      "total_s" (latencia total) y "num_chunks".
+    - engine (BatchingEngine): motor de batching continuo del modelo (opcional).
+    - prefix_cache (PrefixKVCache): caché KV del prefijo fijo del prompt (opcional; el motor
+      de batching usa la suya propia).
+    - prompt_ids (list): ids del prompt ya ensamblado (opcional, ver build_prompt_ids).
+    - prompt_lookup (bool): decodificación voraz con borradores del prompt, como en
+      generate_answer; rellena stats["speculative"]. No se combina con `engine`.
+    - deadline (RequestDeadline): plazo y cancelación de la consulta (por defecto, sin plazo).
+      Si el consumidor deja de leer (cierra el generador), la generación se cancela; si vence el
+      plazo, el último fragmento es la marca de truncado y el motivo queda en stats["truncated"].
+
+    Retorna:
+    - generator: fragmentos de texto (deltas) de la respuesta.
+    """
+    stats = {} if stats is None else stats
+    start = time.perf_counter()
+    deadline = deadline or RequestDeadline()
+
+    inputs = _prepare_inputs(query, context, model, tokenizer, model_name, prompt_ids)
+    gen_kwargs = _generation_kwargs(model_name, tokenizer)
+    if gen_kwargs.get("num_beams", 1) > 1:
+        gen_kwargs.update(num_beams=1, early_stopping=False)
+    gen_kwargs["stopping_criteria"] = StoppingCriteriaList([DeadlineStoppingCriteria(deadline)])
+
+    if engine is not None and not prompt_lookup:
+        # La consulta se encola en el motor compartido con el resto de sesiones
+        params = {k: gen_kwargs[k] for k in _ENGINE_PARAMS if k in gen_kwargs}
+        request = engine.submit(inputs["input_ids"][0].tolist(), deadline=deadline, **params)
+        deltas = request.stream_text()
+
+        def finish():
+            # En el motor, el prefill incluye la espera en la cola hasta ser admitida
+            req = request.stats()
+            telemetry = get_telemetry()
+            telemetry.record("prefill", req["ttft_s"] or 0.0, prompt_tokens=len(request.prompt_ids), mode="batching")
+            if req["ttft_s"] is not None:
+                telemetry.record("decode", req["total_s"] - req["ttft_s"], new_tokens=req["num_tokens"], mode="batching")
+    else:
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        timer = _TokenTimer(streamer)
+        error = []
+
+        def _run():
+            try:
+                if prompt_lookup:
+                    _prompt_lookup(
+                        inputs, model, tokenizer, gen_kwargs, prefix_cache, stats.setdefault("speculative", {}), streamer,
+                        deadline,
+                    )
+                    return
+                with torch.no_grad():
+                    model.generate(**inputs, **_with_prefix_cache(inputs, gen_kwargs, prefix_cache), streamer=timer)
+            except Exception as e:
+                # Se cierra el streamer para que el consumidor no se quede bloqueado
+                error.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+
+        def finish():
+            thread.join()
+            if error:
+                raise error[0]
+            if not prompt_lookup:
+                timer.record(inputs["input_ids"].shape[-1])
+
+        deltas = streamer
+
+    stats["ttft_s"] = None
+    stats["num_chunks"] = 0
+    primero = True
+    completed = False
+    try:
+        for delta in deltas:
+            if not delta:
+                continue
+            if primero:
+                # Se eliminan los espacios iniciales como en generate_answer
+                delta = delta.lstrip()
+                if not delta:
+                    continue
+                stats["ttft_s"] = time.perf_counter() - start
+                primero = False
+            stats["num_chunks"] += 1
+            yield delta
+        completed = True
+    finally:
+        # El consumidor ha dejado de leer (sesión cerrada o nueva pregunta): se libera el modelo
+        if not completed:
+            deadline.cancel(STOP_DISCONNECTED)
+
+    finish()
+    if deadline.reason is not None:
+        stats["truncated"] = deadline.reason
+        stats["num_chunks"] += 1
+        yield ("\n\n" if not primero else "") + truncation_marker(deadline.reason)
+    stats["total_s"] = time.perf_counter() - start
+
+
 # Función para cargar el modelo LLaMA y el tokenizador
-def load_llama_model():
+def load_llama_model(precision=None):
+    """
+    Carga Llama-2-7b Chat. En CPU, `precision` elige el modo de precisión ("float32",
+    "bfloat16", "int8" o "int4"; por defecto, PHARMAI_CPU_PRECISION), ver precision.py.
+    """
     # Detectar el dispositivo disponible: CUDA, MPS (para Mac con Apple Silicon) o CPU
     if torch.cuda.is_available():
         device = "cuda"
@@ -220,18 +551,22 @@ def load_llama_model():
     else:
         device = "cpu"
 
-    print("Usando dispositivo:", device)
+    logging.debug("Usando dispositivo: %s", device)
 
     # Nombre del modelo a cargar (Llama-2-7b Chat)
     model_name = "meta-llama/Llama-2-7b-chat-hf"
     
-    # Cargar el tokenizador incluyendo el token de autenticación
-    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
+    # Cargar el tokenizador rápido (Rust) incluyendo el token de autenticación
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+
+    # En CPU, cargar el modelo con el modo de precisión elegido (float32 ocupa unos 28 GB)
+    if device == "cpu":
+        return load_cpu_model(model_name, precision), tokenizer
 
     # Cargar el modelo, especificando el tipo de datos y usando device_map="auto" para aprovechar la GPU
     model = AutoModelForCausalLM.from_pretrained(
         model_name,
-        torch_dtype=torch.float16 if device in ["cuda", "mps"] else torch.float32,
+        torch_dtype=torch.float16,
         device_map="auto",
     )
 
@@ -241,7 +576,7 @@ def load_llama_model():
 # Función para cargar el modelo GPT-2
 def load_gpt2_model(model_name="gpt2-medium"):
     device = "mps" if torch.backends.mps.is_available() else "cpu"
-    print("Usando dispositivo:", device)
+    logging.debug("Usando dispositivo: %s", device)
 
     tokenizer = GPT2Tokenizer.from_pretrained(model_name)
     model = GPT2LMHeadModel.from_pretrained(model_name)
@@ -293,57 +628,385 @@ def retrieve_relevant_fragments_prueba(query, model, fragments, index, k=10):
     return retrieved_fragments
 
 
+# Función para obtener las posiciones de los fragmentos que cumplen los filtros de metadatos
+def _filter_positions(fragments, filters, metadata):
+    """Posiciones de los fragmentos que cumplen `filters`, o None si no hay filtros."""
+    if not filters:
+        return None
+    metadata = metadata if metadata is not None else MetadataIndex(fragments)
+    return metadata.positions(filters)
+
+
+# Función para buscar en el índice, con o sin filtros de metadatos
+def _search(index, query_embeddings, k, positions, span):
+    """index.search o, si hay filtros, búsqueda restringida a los fragmentos que los cumplen."""
+    if positions is None:
+        return index.search(query_embeddings, k)
+    filter_stats = {}
+    result = filtered_search(index, query_embeddings, k, positions, stats=filter_stats)
+    span.set(filter_strategy=filter_stats["strategy"], filter_candidates=filter_stats["candidates"])
+    return result
+
+
+# Función para decidir cuántos resultados conservar según sus distancias
+def adaptive_cutoff(distances, max_distance=None, max_gap=None, elbow=None, min_k=1):
+    """
+    Número de resultados (ordenados de menor a mayor distancia) que se conservan. Se aplican,
+    por este orden, las reglas indicadas:
+    - max_distance: se descartan los resultados a más de esa distancia (umbral absoluto).
+    - max_gap: se descartan los que están a más de max_gap del mejor resultado (umbral relativo).
+    - elbow: se corta en el mayor salto entre distancias consecutivas si es más de `elbow`
+      veces la media del resto de saltos (codo de la curva de distancias).
+
+    Parámetros:
+    - distances (list): distancias L2 de los resultados, de menor a mayor.
+    - min_k (int): número mínimo de resultados que se conservan.
+
+    Retorna:
+    - tuple: (número de resultados, regla que ha recortado o None)
+    """
+    d = np.asarray(distances, dtype=np.float32)
+    n, regla = len(d), None
+    if max_distance is not None and n and d[n - 1] > max_distance:
+        n, regla = int(np.argmax(d > max_distance)), "max_distance"
+    if max_gap is not None and n and d[n - 1] - d[0] > max_gap:
+        n, regla = int(np.argmax(d - d[0] > max_gap)), "max_gap"
+    if elbow is not None and n > 2:
+        saltos = np.diff(d[:n])
+        i = int(np.argmax(saltos))
+        resto = (saltos.sum() - saltos[i]) / (len(saltos) - 1)
+        if saltos[i] > elbow * max(resto, 1e-6):
+            n, regla = i + 1, "elbow"
+    return max(n, min(min_k, len(d))), regla
+
+
+# Función para aplicar el recorte adaptativo a los fragmentos recuperados
+def _apply_cutoff(results, rules, span):
+    """
+    Recorta los resultados con adaptive_cutoff. En la búsqueda híbrida, los fragmentos que solo
+    ha encontrado BM25 (sin distancia) no se juzgan por las distancias y se conservan.
+    """
+    if not rules:
+        return results
+    distancias = sorted(r["distance"] for r in results if r["distance"] is not None)
+    n, regla = adaptive_cutoff(distancias, **rules)
+    if regla is not None:
+        limite = distancias[n - 1] if n else -np.inf
+        recortados = [r for r in results if r["distance"] is None or r["distance"] <= limite]
+        results = recortados if len(recortados) >= rules.get("min_k", 1) else results[:rules.get("min_k", 1)]
+    span.set(cutoff=regla, fragments=len(results))
+    return results
+
+
 # Función para buscar fragmentos relevantes para el modelo (RAG)
-def retrieve_relevant_fragments(query, embedding_model, fragments, index, model_name):
+def retrieve_relevant_fragments(query, embedding_model, fragments, index, model_name, query_embedding=None, filters=None, metadata=None, sparse=None, k=None, adaptive=None, reranker=None, stats=None):
     """
     Realiza una búsqueda en FAISS para encontrar los fragmentos más similares a la consulta.
+    Si se indica un índice BM25 (`sparse`), sus resultados se fusionan con los de FAISS por
+    fusión de rangos recíprocos, para no perder las coincidencias literales (nombres de
+    medicamentos, códigos ATC, dosis) que el modelo de embeddings no representa bien. Si se
+    indica un cross-encoder (`reranker`), se recuperan RERANK_POOL candidatos y solo se
+    devuelven los k mejores según el cross-encoder (en lugar del recorte adaptativo).
 
     Parámetros:
     - query (str): La consulta en lenguaje natural.
     - k (int): Número de resultados a recuperar.
+    - query_embedding (np.ndarray): embedding de la consulta, si ya se ha calculado.
+    - filters (dict): restringe la búsqueda por "medicamento", "categoria" y/o "atc" (ej.
+      {"medicamento": "ibuprofeno"} o {"atc": "M01A"}); ver metadata_filter.py.
+    - metadata (MetadataIndex): listas de filtrado de los fragmentos (se construyen si faltan).
+    - sparse (BM25Index): índice BM25 de los fragmentos para la búsqueda híbrida.
+    - k (int): número máximo de fragmentos (por defecto, RETRIEVAL_K del modelo).
+    - adaptive (dict o bool): reglas del recorte adaptativo (ver adaptive_cutoff); None usa
+      ADAPTIVE_K_RULES si PHARMAI_ADAPTIVE_K está activo y False devuelve siempre k fragmentos.
+    - reranker (CrossEncoderReranker): cross-encoder para reordenar los candidatos; con él, k
+      es por defecto RERANK_TOP_N.
+    - stats (dict): con reranker, se rellena stats["rerank"] (candidatos, leídos de caché y segundos).
 
     Retorna:
-    - Lista de fragmentos de texto relevantes.
+    - Lista de fragmentos de texto relevantes (con su "id" en el índice y su "distance"; en la
+      búsqueda híbrida también su puntuación de fusión "score", y "distance" es None si el
+      fragmento solo lo encontró BM25).
     """
 
-    if model_name == "llama2":
-        k = 10
-    elif model_name == "gpt2":
-        k = 3
-    
+    k = k or (RERANK_TOP_N if reranker is not None else RETRIEVAL_K[model_name])
+    pool = max(RERANK_POOL, k) if reranker is not None else k
+    if adaptive is None:
+        adaptive = ADAPTIVE_K_RULES if ADAPTIVE_K else None
+
     # Convertir la consulta en embedding
-    query_embedding = embedding_model.encode(query, convert_to_numpy=True).reshape(1, -1)
+    if query_embedding is None:
+        query_embedding = embedding_model.encode(query, convert_to_numpy=True)
+    query_embedding = query_embedding.reshape(1, -1)
+
+    positions = _filter_positions(fragments, filters, metadata)
+    if sparse is not None:
+        results = _hybrid_search(query, query_embedding, fragments, index, sparse, pool, positions)
+        return _select_fragments(query, results, k, adaptive, reranker, stats)
+
+    with get_telemetry().span("index_search", k=pool) as span:
+        # Buscar los k embeddings más cercanos (solo entre los filtrados, si hay filtros)
+        distances, indices = _search(index, query_embedding, pool, positions, span)
+
+        # Recuperar los fragmentos correspondientes, incluyendo las distancias
+        results = []
+        for i, idx in enumerate(indices[0]):
+            if 0 <= idx < len(fragments):  # Asegurar que el índice es válido (FAISS devuelve -1 si faltan resultados)
+                results.append(
+                    {
+                        **fragments[idx],  # Añadir los datos del fragmento
+                        "id": int(idx),  # Posición del fragmento en el índice
+                        "distance": distances[0][i],  # Añadir la distancia de similitud
+                    }
+                )
+        span.set(fragments=len(results))
+
+    return _select_fragments(query, results, k, adaptive, reranker, stats)
+
+
+# Función para elegir los fragmentos que pasan al contexto
+def _select_fragments(query, results, k, adaptive, reranker, stats):
+    """Los k mejores según el cross-encoder o, sin él, los que deja el recorte adaptativo."""
+    if reranker is None:
+        with get_telemetry().span("adaptive_k", k=k) as span:
+            return _apply_cutoff(results, adaptive, span)
+    rerank_stats = {}
+    with get_telemetry().span("rerank", k=k) as span:
+        results = reranker.rerank(query, results, k, rerank_stats)
+        span.set(candidates=rerank_stats.get("candidates", 0), cached=rerank_stats.get("cached", 0))
+    if stats is not None:
+        stats["rerank"] = rerank_stats
+    return results
 
-    # Buscar los k embeddings más cercanos
-    distances, indices = index.search(query_embedding, k)
 
-    # Recuperar los fragmentos correspondientes, incluyendo las distancias
-    results = []
-    for i, idx in enumerate(indices[0]):
-        if idx < len(fragments):  # Asegurar que el índice es válido
-            results.append(
-                {
-                    **fragments[idx],  # Añadir los datos del fragmento
-                    "distance": distances[0][i],  # Añadir la distancia de similitud
-                }
-            )
+# Función para la búsqueda híbrida (FAISS + BM25)
+def _hybrid_search(query, query_embedding, fragments, index, sparse, k, positions):
+    """Busca HYBRID_DEPTH * k candidatos en FAISS y en BM25 y devuelve los k mejores de su fusión (RRF)."""
+    depth = k * HYBRID_DEPTH
+    telemetry = get_telemetry()
+    with telemetry.span("index_search", k=depth) as span:
+        distances, indices = _search(index, query_embedding, depth, positions, span)
+    with telemetry.span("sparse_search", k=depth) as span:
+        _, sparse_ids = sparse.search(query, depth, positions)
+        span.set(fragments=len(sparse_ids))
+
+    with telemetry.span("rank_fusion") as span:
+        dense = {int(idx): float(dist) for idx, dist in zip(indices[0], distances[0]) if 0 <= idx < len(fragments)}
+        results = [
+            {**fragments[idx], "id": idx, "distance": dense.get(idx), "score": score}
+            for idx, score in reciprocal_rank_fusion([indices[0], sparse_ids], limit=k)
+            if idx < len(fragments)
+        ]
+        span.set(fragments=len(results), sparse_only=sum(r["distance"] is None for r in results))
+    return results
+
+
+# Función para recuperar los fragmentos de una consulta "<sección> de <medicamento>"
+def retrieve_by_intent(intent, fragments, intents, model_name, k=None):
+    """
+    Lee los fragmentos de la sección y el medicamento reconocidos del índice hash
+    (medicamento, categoría), sin embedding ni búsqueda en FAISS. Las copias literales de un
+    mismo texto (genéricos de un principio activo) se devuelven una sola vez.
+
+    Parámetros:
+    - intent (QueryIntent): intención reconocida por `intents`.
+    - fragments (list): fragmentos del paquete de recuperación.
+    - intents (IntentParser): reconocedor del paquete.
+    - model_name (str): "gpt2" o "llama2" (determina el número de fragmentos).
+    - k (int): número máximo de fragmentos (por defecto, RETRIEVAL_K del modelo).
 
+    Retorna:
+    - list: fragmentos con "id" y "distance" (0.0), como retrieve_relevant_fragments.
+    """
+    k = k or RETRIEVAL_K[model_name]
+    results = []
+    vistos = set()
+    for idx in intents.positions(intent):
+        frag = fragments[idx]
+        clave = frag.get("hash") or text_hash(frag["texto"])
+        if clave in vistos:
+            continue
+        vistos.add(clave)
+        results.append({**frag, "id": int(idx), "distance": 0.0})
+        if len(results) == k:
+            break
     return results
 
 
+class FragmentView(Mapping):
+    """
+    Vista de solo lectura de un fragmento recuperado: se comporta como el diccionario que
+    devuelve retrieve_relevant_fragments (con "id" y "distance"), pero sin copiar el fragmento.
+    """
+
+    __slots__ = ("_fragment", "_id", "_distance")
+
+    def __init__(self, fragment, idx, distance):
+        self._fragment = fragment
+        self._id = idx
+        self._distance = distance
+
+    def __getitem__(self, key):
+        if key == "id":
+            return self._id
+        if key == "distance":
+            return self._distance
+        return self._fragment[key]
+
+    def __iter__(self):
+        yield from self._fragment
+        yield "id"
+        yield "distance"
+
+    def __len__(self):
+        return len(self._fragment) + 2
+
+    def __repr__(self):
+        return f"FragmentView(id={self._id}, distance={self._distance:.4f}, medicamento={self._fragment.get('medicamento')!r})"
+
+
+class RetrievalResults:
+    """
+    Resultados de una búsqueda por lotes: matrices N x k de posiciones (`ids`, -1 si faltan
+    resultados) y distancias, y vistas perezosas de los fragmentos de cada consulta.
+
+    Uso:
+        results = retrieve_relevant_fragments_batch(consultas, embedding_model, fragments, index)
+        results.ids[i]          # posiciones de los fragmentos de la consulta i
+        results[i]              # lista de FragmentView de la consulta i
+    """
+
+    def __init__(self, ids, distances, fragments, query_embeddings=None):
+        self.ids = ids
+        self.distances = distances
+        self.fragments = fragments
+        self.query_embeddings = query_embeddings
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return [
+            FragmentView(self.fragments[idx], int(idx), float(dist))
+            for idx, dist in zip(self.ids[i], self.distances[i])
+            if 0 <= idx < len(self.fragments)
+        ]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+# Función para buscar los fragmentos relevantes de varias consultas a la vez
+def retrieve_relevant_fragments_batch(queries, embedding_model, fragments, index, k=10, query_embeddings=None, batch_size=64, filters=None, metadata=None):
+    """
+    Igual que retrieve_relevant_fragments, pero para N consultas: se embeben en una sola
+    llamada, se buscan con un único index.search sobre la matriz N x d y los resultados se
+    devuelven como matrices y vistas, sin copiar los fragmentos.
+
+    Parámetros:
+    - queries (list): consultas en lenguaje natural.
+    - embedding_model: modelo de embeddings (SentenceTransformer).
+    - fragments (list): fragmentos, en el orden de los vectores del índice.
+    - index: índice FAISS.
+    - k (int): número de resultados por consulta.
+    - query_embeddings (np.ndarray): embeddings N x d de las consultas, si ya se han calculado.
+    - batch_size (int): tamaño de lote al embeber las consultas.
+    - filters (dict): filtros de metadatos, comunes a todas las consultas.
+    - metadata (MetadataIndex): listas de filtrado de los fragmentos.
+
+    Retorna:
+    - RetrievalResults: posiciones, distancias y fragmentos de cada consulta.
+    """
+    telemetry = get_telemetry()
+    if query_embeddings is None:
+        with telemetry.span("query_embedding", queries=len(queries)):
+            query_embeddings = embedding_model.encode(list(queries), convert_to_numpy=True, batch_size=batch_size)
+    query_embeddings = np.ascontiguousarray(np.asarray(query_embeddings, dtype=np.float32).reshape(len(queries), -1))
+
+    with telemetry.span("index_search", k=k, queries=len(queries)) as span:
+        distances, ids = _search(index, query_embeddings, k, _filter_positions(fragments, filters, metadata), span)
+        span.set(fragments=int((ids >= 0).sum()))
+    return RetrievalResults(ids, distances, fragments, query_embeddings)
+
+
+# Función para buscar varias consultas en el paquete de recuperación activo
+def retrieve_batch(queries, k=10, registry=None, batch_size=64, filters=None):
+    """
+    Búsqueda por lotes con los recursos del registro (ej. para evaluaciones offline).
+
+    Retorna:
+    - RetrievalResults: posiciones, distancias y fragmentos de cada consulta.
+    """
+    registry = registry or get_chatbot_registry()
+    bundle = registry.get("retrieval")
+    return retrieve_relevant_fragments_batch(
+        [q.lower() for q in queries], registry.get("embedder"), bundle.fragments, bundle.index, k, batch_size=batch_size,
+        filters=filters, metadata=bundle.metadata,
+    )
+
+
+# Función para dar formato a un fragmento dentro del contexto
+def _format_fragment(i, medicamento, categoria, texto):
+    """Bloque de texto de un fragmento tal y como aparece en el contexto."""
+    return (
+        f"\nFragmento {i}:\n"
+        f"Medicamento: {medicamento}\n"
+        f"Categoría: {categoria}\n"
+        f"Información: {texto}\n"
+    )
+
+
+# Función para obtener los shingles de palabras de un texto (detección de casi duplicados)
+def _shingles(texto, n=3):
+    palabras = texto.lower().split()
+    return {" ".join(palabras[i:i + n]) for i in range(max(1, len(palabras) - n + 1))}
+
+
+# Función para detectar textos duplicados o casi duplicados de los ya incluidos en el contexto
+def _is_duplicate(texto, vistos, shingles_vistos, threshold):
+    """
+    Duplicados exactos (ej. genéricos con la misma sección palabra por palabra) o casi
+    duplicados (similitud de Jaccard entre trigramas de palabras >= threshold).
+    """
+    if " ".join(texto.lower().split()) in vistos:
+        return True
+    shingles = _shingles(texto)
+    return any(len(shingles & otro) / len(shingles | otro) >= threshold for otro in shingles_vistos)
+
+
+# Función para registrar un texto como incluido en el contexto
+def _mark_seen(texto, vistos, shingles_vistos):
+    vistos.add(" ".join(texto.lower().split()))
+    shingles_vistos.append(_shingles(texto))
+
+
+# Función para contar tokens con el tokenizador del modelo activo
+def _count_tokens(tokenizer, texto):
+    return len(tokenizer(texto, add_special_tokens=False)["input_ids"])
+
+
 # Función para formatear el contexto para el modelo
-def format_context(retrieved_fragments, max_fragments=10, max_text_length=2000):
+def format_context(retrieved_fragments, max_fragments=10, max_text_length=2000, tokenizer=None, token_budget=None, stats=None):
     """
     Formatea los fragmentos recuperados en un contexto para el modelo. Transforma una lista de diccionarios en un texto estructurado.
 
+    Si se indican `tokenizer` y `token_budget`, el contexto se empaqueta por tokens (ver
+    pack_context) en lugar de recortar cada fragmento por caracteres.
+
     Parámetros:
     - retrieved_fragments (list): Lista de fragmentos recuperados (diccionarios)
     - max_fragments (int): Número máximo de fragmentos a utilizar
     - max_text_length (int): Longitud máxima del texto a mostrar por fragmento
+    - tokenizer: tokenizador del modelo activo (opcional)
+    - token_budget (int): tokens disponibles para el contexto (opcional)
+    - stats (dict): se rellena con las estadísticas del empaquetado por tokens
 
     Retorna:
     - str: Contexto formateado para el modelo
     """
+    if tokenizer is not None and token_budget is not None:
+        return pack_context(retrieved_fragments, tokenizer, token_budget, max_fragments=max_fragments, stats=stats)
+
     context = ""
     
     # Asegurar que no se intenten tomar más fragmentos de los que existen
@@ -355,8 +1018,7 @@ def format_context(retrieved_fragments, max_fragments=10, max_text_length=2000):
             print(f"Advertencia: Fragmento {i+1} no tiene la estructura esperada.")
             continue  # Saltar fragmentos mal formateados
 
-        medicamento = frag["medicamento"]
-        categoria = frag["categoria"]
+        medicamento, categoria = fragment_citation(frag)
         texto = frag["texto"]
 
         # Limitar la longitud del texto
@@ -365,29 +1027,191 @@ def format_context(retrieved_fragments, max_fragments=10, max_text_length=2000):
         )
 
         # Construcción del contexto
-        context += f"\nFragmento {i+1}:\n"
-        context += f"Medicamento: {medicamento}\n"
-        context += f"Categoría: {categoria}\n"
-        context += f"Información: {truncated_text}\n"
+        context += _format_fragment(i + 1, medicamento, categoria, truncated_text)
 
     return context
 
 
-# Función para construir el prompt para el modelo
-def build_prompt(context, query, model_name="llama2"):
+# Función para empaquetar los fragmentos en un presupuesto de tokens
+def pack_context(retrieved_fragments, tokenizer, token_budget, max_fragments=None, near_duplicate_threshold=0.85, min_fragment_tokens=32, stats=None):
     """
-    Construye el prompt para el modelo con base en el contexto y la consulta,
-    incluyendo un ejemplo de cómo debe formatear la respuesta.
+    Construye el contexto llenando un presupuesto de tokens medido con el tokenizador del
+    modelo activo. Los fragmentos se añaden por orden de relevancia, se descartan los textos
+    duplicados exactos y casi duplicados (similitud de Jaccard entre trigramas de palabras),
+    y solo el último fragmento que no cabe entero se recorta (por tokens) para aprovechar
+    el presupuesto restante. Las instrucciones y la pregunta quedan fuera del presupuesto,
+    así que nunca se recortan.
 
     Parámetros:
-    - context (str): Contexto a proporcionar al modelo
-    - query (str): Consulta del usuario
+    - retrieved_fragments (list): fragmentos recuperados, ordenados por relevancia
+    - tokenizer: tokenizador del modelo activo
+    - token_budget (int): tokens disponibles para el contexto
+    - max_fragments (int): número máximo de fragmentos (None para no limitar)
+    - near_duplicate_threshold (float): similitud de Jaccard a partir de la cual un texto se
+      considera casi duplicado
+    - min_fragment_tokens (int): tokens mínimos de texto para incluir un fragmento recortado
+    - stats (dict): se rellena con "fragments", "tokens", "duplicates" y "truncated"
 
     Retorna:
-    - str: Prompt completo para el modelo
+    - str: Contexto formateado para el modelo
     """
-    if model_name == "llama2":
-        prompt = f"""
+    stats = {} if stats is None else stats
+    stats.update(fragments=0, tokens=0, duplicates=0, truncated=False)
+
+    context = ""
+    vistos = set()
+    shingles_vistos = []
+    for frag in retrieved_fragments:
+        if max_fragments is not None and stats["fragments"] >= max_fragments:
+            break
+        if not all(key in frag for key in ["medicamento", "categoria", "texto"]):
+            print(f"Advertencia: Fragmento {frag.get('id')} no tiene la estructura esperada.")
+            continue
+
+        texto = frag["texto"]
+        if _is_duplicate(texto, vistos, shingles_vistos, near_duplicate_threshold):
+            stats["duplicates"] += 1
+            continue
+
+        i = stats["fragments"] + 1
+        medicamento, categoria = fragment_citation(frag)
+        bloque = _format_fragment(i, medicamento, categoria, texto)
+        # +1 token de margen por los efectos de frontera al tokenizar el contexto completo
+        n_tokens = _count_tokens(tokenizer, bloque) + 1
+        restante = token_budget - stats["tokens"]
+
+        if n_tokens > restante:
+            # Se recorta el texto por tokens para aprovechar el presupuesto restante
+            cabecera = _count_tokens(tokenizer, _format_fragment(i, medicamento, categoria, "...")) + 1
+            disponible = restante - cabecera
+            if disponible < min_fragment_tokens:
+                break
+            ids = tokenizer(texto, add_special_tokens=False)["input_ids"][:disponible]
+            texto = tokenizer.decode(ids, skip_special_tokens=True) + "..."
+            bloque = _format_fragment(i, medicamento, categoria, texto)
+            n_tokens = _count_tokens(tokenizer, bloque) + 1
+            if n_tokens > restante:
+                break
+            stats["truncated"] = True
+
+        context += bloque
+        _mark_seen(texto, vistos, shingles_vistos)
+        stats["fragments"] += 1
+        stats["tokens"] += n_tokens
+        if stats["truncated"]:
+            break
+
+    return context
+
+
+# Función para empaquetar los fragmentos por ids ya tokenizados
+def pack_context_ids(retrieved_fragments, assembler, token_budget, max_fragments=None, near_duplicate_threshold=0.85, min_fragment_tokens=32, stats=None):
+    """
+    Igual que pack_context, pero trabajando con los ids pre-tokenizados de cada fragmento
+    (FragmentTokenStore): no se tokeniza el texto de los fragmentos y el recuento de tokens
+    es exacto.
+
+    Parámetros:
+    - retrieved_fragments (list): fragmentos recuperados, ordenados por relevancia (con "id")
+    - assembler (PromptAssembler): ensamblador con el almacén de tokens del modelo activo
+    - token_budget (int): tokens disponibles para el contexto
+
+    Retorna:
+    - np.ndarray: ids de los tokens del contexto
+    """
+    stats = {} if stats is None else stats
+    stats.update(fragments=0, tokens=0, duplicates=0, truncated=False)
+
+    bloques = []
+    vistos = set()
+    shingles_vistos = []
+    for frag in retrieved_fragments:
+        if max_fragments is not None and stats["fragments"] >= max_fragments:
+            break
+        if not all(key in frag for key in ["id", "medicamento", "categoria", "texto"]):
+            print(f"Advertencia: Fragmento {frag.get('id')} no tiene la estructura esperada.")
+            continue
+        if _is_duplicate(frag["texto"], vistos, shingles_vistos, near_duplicate_threshold):
+            stats["duplicates"] += 1
+            continue
+
+        i = stats["fragments"] + 1
+        ids = assembler.fragment_ids(i, frag)
+        restante = token_budget - stats["tokens"]
+        if len(ids) > restante:
+            # Se recorta el texto para aprovechar el presupuesto restante
+            exceso = len(ids) - restante + len(assembler.encode("...\n", continuation=True))
+            disponible = assembler.store.num_tokens(frag["id"]) - exceso
+            if disponible < min_fragment_tokens:
+                break
+            ids = assembler.fragment_ids(i, frag, max_text_tokens=disponible)
+            stats["truncated"] = True
+
+        bloques.append(ids)
+        _mark_seen(frag["texto"], vistos, shingles_vistos)
+        stats["fragments"] += 1
+        stats["tokens"] += len(ids)
+        if stats["truncated"]:
+            break
+
+    return np.concatenate(bloques) if bloques else np.zeros(0, dtype=np.int64)
+
+
+# Marcador para separar la parte del sufijo anterior y posterior al contexto
+_CONTEXT_MARK = "\x00CONTEXTO\x00"
+
+
+# Función para ensamblar los ids del prompt completo a partir de arrays ya tokenizados
+def build_prompt_ids(assembler, context_ids, query, model_name="llama2"):
+    """
+    Ensambla los ids del prompt: prefijo fijo + inicio del sufijo + ids del contexto + pregunta.
+    Solo se tokenizan la pregunta y las piezas fijas de la plantilla (memorizadas).
+
+    Retorna:
+    - list: ids de los tokens del prompt
+    """
+    prefix, suffix = build_prompt_parts(_CONTEXT_MARK, query, model_name)
+    inicio, fin = suffix.split(_CONTEXT_MARK)
+    ids = (
+        list(assembler.encode(prefix, add_special_tokens=True))
+        + list(assembler.encode(inicio))
+        + context_ids.tolist()
+        + list(encode_continuation(assembler.tokenizer, [fin])[0])
+    )
+    return ids
+
+
+# Ventana de contexto (en tokens) de cada modelo
+MODEL_MAX_CONTEXT = {"llama2": 4096, "gpt2": 1024}
+
+
+# Función para calcular los tokens disponibles para el contexto recuperado
+def context_token_budget(tokenizer, query, model_name="llama2", max_context_tokens=None):
+    """
+    Tokens disponibles para el contexto: la ventana del modelo menos las instrucciones, la
+    pregunta y los tokens reservados para la respuesta (max_new_tokens).
+
+    Parámetros:
+    - tokenizer: tokenizador del modelo activo
+    - query (str): consulta del usuario
+    - model_name (str): "llama2" o "gpt2"
+    - max_context_tokens (int): límite adicional opcional para acortar el prefill
+
+    Retorna:
+    - int: presupuesto de tokens para el contexto
+    """
+    prefix, suffix = build_prompt_parts("", query, model_name)
+    overhead = len(encode_prompt_parts(tokenizer, prefix, suffix))
+    reserve = _generation_kwargs(model_name, tokenizer)["max_new_tokens"]
+    budget = max(0, MODEL_MAX_CONTEXT[model_name] - reserve - overhead)
+    if max_context_tokens is not None:
+        budget = min(budget, max_context_tokens)
+    return budget
+
+
+# Parte fija del prompt de llama2 (instrucciones y ejemplo). Va siempre al principio para que
+# su caché KV se calcule una sola vez por modelo y se reutilice en todas las consultas.
+LLAMA2_PROMPT_PREFIX = """
         
         1. OBJETIVO GENERAL:
         Eres un asistente médico especializado en información sobre medicamentos. Debes responder a la pregunta del usuario basándote únicamente en la información proporcionada. No debes inventar ni suponer información adicional.
@@ -415,33 +1239,81 @@ def build_prompt(context, query, model_name="llama2"):
         La aspirina puede causar efectos secundarios como náuseas y dolor de estómago (extraído de la ficha técnica, de la sección "efectos_secundarios" del medicamento "ASPIRINA": "la aspirina tiene como efectos secundarios, entre ottros, la aparición de náuseas y dolor de tripa"). Si necesitas más detalles, por favor consulta la ficha técnica completa.
 
         5. INSTRUCCIONES FINALES:
-        Básandote ÚNICAMENTE en la información proporcionada en ({context}), responde a la siguiente pregunta:
-        {query}
-
-        Respuesta:"""
+        Básandote ÚNICAMENTE en la información proporcionada en el siguiente contexto, responde a la pregunta del usuario.
+"""
 
-    elif model_name == "gpt2":
-        prompt = f"""
+# Parte fija del prompt de gpt2
+GPT2_PROMPT_PREFIX = """
         INSTRUCCIÓN:
         Eres un asistente médico especializado en información sobre medicamentos. Debes responder a la pregunta del usuario basándote únicamente en el contexto proporcionado. 
 
         EJEMPLO:
         Pregunta: ¿Cuáles son los efectos secundarios de la aspirina?
         Respuesta: La aspirina puede causar náuseas y dolor de estómago.
+"""
+
+PROMPT_PREFIXES = {"llama2": LLAMA2_PROMPT_PREFIX, "gpt2": GPT2_PROMPT_PREFIX}
+
+
+# Función para construir las dos partes del prompt (fija y variable)
+def build_prompt_parts(context, query, model_name="llama2"):
+    """
+    Construye el prompt separado en la parte fija (instrucciones y ejemplo, igual en todas
+    las consultas) y la parte variable (contexto recuperado y pregunta).
+
+    Parámetros:
+    - context (str): Contexto a proporcionar al modelo
+    - query (str): Consulta del usuario
+    - model_name (str): "llama2" o "gpt2"
+
+    Retorna:
+    - tuple: (prefijo fijo, sufijo con el contexto y la pregunta)
+    """
+    if model_name == "llama2":
+        suffix = f"""
+        Contexto: ({context})
+
+        Pregunta: {query}
 
+        Respuesta:"""
+
+    elif model_name == "gpt2":
+        suffix = f"""
         Contexto:
         {context}
 
         Pregunta: {query}
         Respuesta a la pregunta:"""
-        
-    return prompt
+
+    else:
+        raise ValueError(f"Modelo desconocido: {model_name}")
+
+    return PROMPT_PREFIXES[model_name], suffix
+
+
+# Función para construir el prompt para el modelo
+def build_prompt(context, query, model_name="llama2"):
+    """
+    Construye el prompt para el modelo con base en el contexto y la consulta,
+    incluyendo un ejemplo de cómo debe formatear la respuesta.
+
+    Parámetros:
+    - context (str): Contexto a proporcionar al modelo
+    - query (str): Consulta del usuario
+
+    Retorna:
+    - str: Prompt completo para el modelo
+    """
+    prefix, suffix = build_prompt_parts(context, query, model_name)
+    return prefix + suffix
 
 
 # Función para generar la respuesta del modelo
-def load_model_and_tokenizer(model_name: str):
+def load_model_and_tokenizer(model_name: str, precision=None):
     """
-    Carga el modelo y el tokenizador apropiado según model_name.
+    Carga el modelo y el tokenizador apropiado según model_name. En CPU, `precision` elige
+    el modo de precisión ("float32", "bfloat16", "int8" o "int4"; por defecto,
+    PHARMAI_CPU_PRECISION), ver precision.py.
     """
 
     # Detectar dispositivo
@@ -458,6 +1330,7 @@ def load_model_and_tokenizer(model_name: str):
         '''
         # En dispositivos MPS, evitar cargas grandes sin cuantización
         model_name_gpt2 = "gpt2-large"
+        tokenizer = GPT2TokenizerFast.from_pretrained(model_name_gpt2)
         if device == "mps" and model_name_gpt2 in ("gpt2-large", "gpt2-xl"):
             # --- Cuantización dinámica INT8 con Optimum ---
             # 1) Definimos la configuración de cuantización
@@ -473,8 +1346,9 @@ def load_model_and_tokenizer(model_name: str):
             model = quantizer.quantize(model=base_model)
             # 5) Movemos el modelo cuantizado a MPS
             model.to(device)
+        elif device == "cpu":
+            model = load_cpu_model(model_name_gpt2, precision, GPT2LMHeadModel)
         else:
-            tokenizer = GPT2TokenizerFast.from_pretrained(model_name_gpt2)
             model = GPT2LMHeadModel.from_pretrained(model_name_gpt2)
 
         # Aseguramos un token de pad
@@ -483,17 +1357,20 @@ def load_model_and_tokenizer(model_name: str):
         
 
     elif model_name == "llama2":
-        # Llama2-chat usa SentencePiece; trust_remote_code para cargar implementaciones custom
+        # Llama2-chat usa SentencePiece; se carga su versión rápida (Rust) para tokenizar las consultas
         tokenizer = AutoTokenizer.from_pretrained(
             "meta-llama/Llama-2-7b-chat-hf",
-            use_fast=False
-        )
-        model = AutoModelForCausalLM.from_pretrained(
-            "meta-llama/Llama-2-7b-chat-hf",
-            torch_dtype=torch.float16,
-            device_map="auto",
-            trust_remote_code=True
+            use_fast=True
         )
+        if device == "cpu":
+            model = load_cpu_model("meta-llama/Llama-2-7b-chat-hf", precision, trust_remote_code=True)
+        else:
+            model = AutoModelForCausalLM.from_pretrained(
+                "meta-llama/Llama-2-7b-chat-hf",
+                torch_dtype=torch.float16,
+                device_map="auto",
+                trust_remote_code=True
+            )
 
     else:
         raise ValueError(f"Modelo desconocido: {model_name}")
@@ -501,41 +1378,576 @@ def load_model_and_tokenizer(model_name: str):
     return tokenizer, model
 
 
-# Función para responder a la consulta del usuario
-def answer_query(query, model_name="llama2"):
+# Función para cargar el almacén de fragmentos pre-tokenizados de un modelo
+def _load_prompt_assembler(registry, model_name):
     """
-    Realiza una consulta y genera una respuesta utilizando el modelo.
+    Devuelve el PromptAssembler del modelo para el paquete de recuperación activo, o None si su
+    almacén de tokens no existe o no es válido. El almacén de un paquete está en su carpeta
+    tokens/; los ficheros sueltos heredados usan TOKEN_STORE_DIR. En ambos casos el almacén debe
+    corresponder al sha256 del JSON de fragmentos.
+    """
+    tokenizer, _ = registry.get(f"llm:{model_name}")
+    bundle = registry.get("retrieval")
+    if bundle.path:
+        store_dir, corpus = os.path.join(bundle.path, TOKENS_DIR), bundle.corpus_fingerprint
+    else:
+        store_dir, corpus = TOKEN_STORE_DIR, corpus_fingerprint(FRAGMENTS_PATH)
+    store = FragmentTokenStore.load(store_dir, model_name, tokenizer, num_fragments=len(bundle), corpus=corpus)
+    if store is None:
+        logging.warning(
+            f"Sin almacén de tokens válido para {model_name} en el paquete {bundle.version}: "
+            "se tokenizará el contexto en cada consulta"
+        )
+        return None
+    assembler = PromptAssembler(tokenizer, store)
+    # Los ids de los fragmentos solo son válidos para la versión del paquete con la que se cargó
+    assembler.bundle_version = bundle.version
+    return assembler
+
+
+# Función para cargar el paquete de recuperación activo
+def _load_retrieval_bundle():
+    """Carga el paquete activo o, si aún no hay ninguno, el índice y los fragmentos sueltos."""
+    return load_current_bundle(
+        BUNDLES_DIR,
+        legacy={
+            "index_path": FAISS_INDEX_PATH,
+            "fragments_path": FRAGMENTS_PATH,
+            "embedding_model": EMBEDDING_MODEL_NAME,
+            "version": corpus_version(FRAGMENTS_PATH, FAISS_INDEX_PATH),
+        },
+    )
 
-    Parámetros:
-    - query (str): La consulta del usuario
+
+# Función que adapta el resto de recursos a un paquete de recuperación recién activado
+def _on_bundle_swap(registry, old, new):
+    """Vacía las cachés de respuestas y del cross-encoder y, si cambia el modelo de embeddings, lo recarga."""
+    if registry.is_loaded("answer_cache"):
+        registry.get("answer_cache").set_version(new.version)
+    # Las puntuaciones del cross-encoder están indexadas por posición en los fragmentos del paquete
+    if registry.is_loaded("reranker"):
+        registry.get("reranker").clear()
+    if new.embedding_model != old.embedding_model:
+        registry.evict("embedder")
+
+
+# Función para obtener el registro de modelos con los recursos del chatbot
+def get_chatbot_registry():
+    """
+    Devuelve el registro global del proceso con los recursos del chatbot registrados:
+    modelo de embeddings, paquete de recuperación (índice FAISS + fragmentos) y los LLM
+    (llama2 y gpt2). Cada recurso se carga la primera vez que se pide y se reutiliza en las
+    siguientes consultas.
 
     Retorna:
-    - str: Respuesta generada
+    - ModelRegistry: registro global del proceso.
     """
+    registry = get_registry()
+    # Los artefactos de recuperación se usan en cada consulta: no se expulsan. El índice se abre
+    # con mmap, así que sus páginas se comparten entre procesos y no cuentan en el presupuesto
+    registry.register("retrieval", _load_retrieval_bundle, pinned=True, size_estimator=lambda bundle: bundle.nbytes)
+    registry.register("embedder", lambda: SentenceTransformer(registry.get("retrieval").embedding_model))
+    # Cambio en caliente del paquete cuando se activa una nueva versión
+    registry.register(
+        "bundle_watcher",
+        lambda: BundleWatcher(
+            registry, "retrieval", BUNDLES_DIR, BUNDLE_POLL_SECONDS,
+            on_swap=lambda old, new: _on_bundle_swap(registry, old, new),
+        ).start(),
+        pinned=True,
+        size_estimator=lambda watcher: 0,
+    )
+    # Cross-encoder para reordenar los candidatos (solo con PHARMAI_RERANK=1)
+    registry.register("reranker", CrossEncoderReranker)
+    registry.register("llm:llama2", lambda: load_model_and_tokenizer("llama2"))
+    registry.register("llm:gpt2", lambda: load_model_and_tokenizer("gpt2"))
+    # Reglas de la cascada de modelos y recuento de las consultas que resuelve cada nivel
+    registry.register("cascade", CascadeRouter, pinned=True, size_estimator=lambda router: 0)
+    # Caché de respuestas persistente, ligada a la versión del paquete de recuperación
+    registry.register("answer_cache", lambda: AnswerCache(version=registry.get("retrieval").version), pinned=True)
+
+    for name in ("llama2", "gpt2"):
+        # Fragmentos pre-tokenizados con el tokenizador del modelo (None si no se han construido)
+        registry.register(
+            f"tokens:{name}",
+            lambda name=name: _load_prompt_assembler(registry, name),
+            size_estimator=lambda assembler: assembler.store.nbytes if assembler is not None else 0,
+            depends_on=[f"llm:{name}", "retrieval"],
+        )
+        # Caché KV del prefijo fijo del prompt, calculada una vez por modelo cargado
+        registry.register(
+            f"prefix:{name}",
+            lambda name=name: PrefixKVCache(*reversed(registry.get(f"llm:{name}")), PROMPT_PREFIXES[name]),
+            size_estimator=lambda cache: cache.nbytes,
+            depends_on=[f"llm:{name}"],
+        )
+        # Motores de batching continuo: comparten el modelo del LLM, cuya memoria ya se contabiliza
+        registry.register(
+            f"engine:{name}",
+            lambda name=name: BatchingEngine(
+                *reversed(registry.get(f"llm:{name}")), prefix_cache=registry.get(f"prefix:{name}")
+            ),
+            size_estimator=lambda engine: 0,
+            depends_on=[f"llm:{name}", f"prefix:{name}"],
+        )
+    return registry
 
-    # 1. Converir la consulta a minúsculas
-    query = query.lower()
 
-    # 2. Recuperamos los fragmentos relevantes para la consulta
-    embedding_model = SentenceTransformer("all-MiniLM-L6-v2") # old
-    fragments = load_json("./data/outputs/5_chatbot/contexto_medicamentos_chatbot.json") 
-    index = faiss.read_index("./data/outputs/5_chatbot/faiss_index_IndexFlatL2.bin") # old
+# Función para recuperar los fragmentos relevantes de una consulta
+def _retrieve(query, model_name, registry, filters=None, stats=None, k=None):
+    """
+    Recupera los fragmentos relevantes. Si la consulta pide una sección de un medicamento
+    concreto, se leen directamente del índice (medicamento, categoría); si no, se calcula el
+    embedding de la consulta y se busca en FAISS. El paquete se obtiene una sola vez, así que
+    toda la consulta usa la misma versión aunque se cambie en caliente mientras tanto.
 
-    # 3. Busca los fragmentos relevantes
+    Retorna:
+    - tuple: (fragmentos recuperados, embedding de la consulta o None en la ruta directa,
+      paquete de recuperación); la ruta seguida y el número de fragmentos se guardan en
+      stats["retrieval"].
+    """
+    stats = {} if stats is None else stats
+
+    # Recursos de búsqueda (cargados una sola vez por proceso)
+    bundle = registry.get("retrieval")
+    fragments, index = bundle.fragments, bundle.index
+
+    # Ruta directa: "<sección> de <medicamento>" reconocido con confianza
+    if INTENT_FAST_PATH and not filters:
+        with get_telemetry().span("intent_parse") as span:
+            intent = bundle.intents.parse(query)
+            retrieved_fragments = retrieve_by_intent(intent, fragments, bundle.intents, model_name, k) if intent else []
+            span.set(path="intent" if retrieved_fragments else "dense", fragments=len(retrieved_fragments))
+        if retrieved_fragments:
+            stats["retrieval"] = {"path": "intent", **intent.to_dict(), "fragments": len(retrieved_fragments)}
+            logging.debug("Ruta directa por intención: %s", stats["retrieval"])
+            return retrieved_fragments, None, bundle
+    stats["retrieval"] = {"path": "hybrid" if HYBRID_SEARCH else "dense"}
+    embedding_model = registry.get("embedder")
+
+    # Busca los fragmentos relevantes
+    with get_telemetry().span("query_embedding"):
+        query_embedding = embedding_model.encode(query, convert_to_numpy=True)
     #retrieved_fragments = retrieve_relevant_fragments_prueba(query, embedding_model, fragments, index, k=5)
-    retrieved_fragments = retrieve_relevant_fragments(query, embedding_model, fragments, index, model_name)
+    retrieved_fragments = retrieve_relevant_fragments(
+        query, embedding_model, fragments, index, model_name, query_embedding=query_embedding,
+        filters=filters, metadata=bundle.metadata if filters else None, sparse=bundle.sparse if HYBRID_SEARCH else None, k=k,
+        reranker=registry.get("reranker") if RERANK else None, stats=stats["retrieval"],
+    )
+    stats["retrieval"]["fragments"] = len(retrieved_fragments)
+    logging.debug("Fragmentos recuperados: %s", [frag.get("id") for frag in retrieved_fragments])
+    return retrieved_fragments, query_embedding, bundle
+
+
+# Función para obtener el almacén de tokens de la versión del paquete usada en la consulta
+def _get_assembler(registry, model_name, bundle):
+    """Devuelve el PromptAssembler del modelo si corresponde a `bundle`; si no, None (ruta de texto)."""
+    assembler = registry.get(f"tokens:{model_name}")
+    if assembler is not None and getattr(assembler, "bundle_version", None) != bundle.version:
+        return None
+    return assembler
+
+
+# Función para empaquetar los fragmentos recuperados en el presupuesto de tokens del modelo
+def _pack_retrieved(retrieved_fragments, tokenizer, query, model_name, stats, assembler=None):
+    """
+    Llena el presupuesto de tokens con los fragmentos y guarda sus estadísticas en
+    stats["context"]. Si hay almacén de tokens pre-calculados (assembler), el prompt se
+    ensambla directamente en ids.
+
+    Retorna:
+    - tuple: (contexto en texto o "" si se ensambló en ids, ids del prompt o None)
+    """
+    with get_telemetry().span("format_context", pretokenized=assembler is not None) as span:
+        budget = context_token_budget(tokenizer, query, model_name)
+        stats["context"] = {"budget": budget}
+        if assembler is not None:
+            context_ids = pack_context_ids(retrieved_fragments, assembler, budget, max_fragments=10, stats=stats["context"])
+            context, prompt_ids = "", build_prompt_ids(assembler, context_ids, query, model_name)
+        else:
+            context = format_context(retrieved_fragments, tokenizer=tokenizer, token_budget=budget, stats=stats["context"])
+            prompt_ids = None
+        span.set(
+            fragments=stats["context"].get("fragments"),
+            context_tokens=stats["context"].get("tokens"),
+            budget_tokens=budget,
+            duplicates=stats["context"].get("duplicates"),
+        )
+    return context, prompt_ids
+
+
+# Función para buscar la respuesta en la caché (exacta y semántica)
+def _lookup_answer_cache(cache, query, model_name, retrieved_fragments, query_embedding, stats):
+    """
+    Busca la respuesta en la caché: primero por coincidencia exacta (consulta normalizada +
+    ids de los fragmentos) y después, si hay embedding, por similitud con consultas anteriores
+    que se respondieron con los mismos fragmentos (ver answer_cache.fragments_overlap).
+
+    Retorna:
+    - str o None: respuesta cacheada.
+    """
+    stats["cache"] = None
+    if cache is None:
+        return None
+    fragment_ids = [f["id"] for f in retrieved_fragments]
+    answer = cache.get_exact(query, model_name, fragment_ids)
+    if answer is not None:
+        stats["cache"] = "exact"
+        return answer
+    answer, similarity = (None, None) if query_embedding is None else cache.get_semantic(query_embedding, model_name, fragment_ids)
+    if answer is not None:
+        stats["cache"] = "semantic"
+        stats["cache_similarity"] = similarity
+        return answer
+    cache.record_miss()
+    return None
 
-    # 4. Aplicamos formateo al contexto
-    print(f"Fragmentos recuperados: {retrieved_fragments}")
-    context = format_context(retrieved_fragments, max_fragments=10, max_text_length=2000)
 
-    # 5. Cargar el modelo y el tokenizador
-    tokenizer, model = load_model_and_tokenizer(model_name)
+class _GenerationCounter:
+    """Número de generaciones con el LLM en curso en el proceso (para detectar la sobrecarga)."""
 
-    # 6. Generamos la respuesta del modelo en base al prompt y el contexto
-    print(f"Contexto: {context}")
-    response = generate_answer(query, context, model, tokenizer, model_name)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def __enter__(self):
+        with self._lock:
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.active -= 1
+
+
+_GENERATIONS = _GenerationCounter()
+
+# Recursos que se están cargando en segundo plano
+_background_loads = set()
+_background_lock = threading.Lock()
+
+
+# Función para cargar un recurso del registro en segundo plano
+def load_in_background(registry, name):
+    """
+    Carga el recurso en un hilo aparte (ej. el LLM mientras se responde de forma extractiva).
+    Si ya está cargado o cargándose, no hace nada.
+
+    Retorna:
+    - bool: True si se ha lanzado la carga.
+    """
+    with _background_lock:
+        if registry.is_loaded(name) or name in _background_loads:
+            return False
+        _background_loads.add(name)
+
+    def _load():
+        try:
+            registry.get(name)
+        except Exception:
+            logging.exception(f"Error al cargar '{name}' en segundo plano")
+        finally:
+            with _background_lock:
+                _background_loads.discard(name)
+
+    threading.Thread(target=_load, name=f"load-{name}", daemon=True).start()
+    return True
+
+
+# Función para elegir entre la respuesta generada y la extractiva
+def _choose_answer_mode(mode, model_name, registry, stats, batching=False):
+    """
+    Resuelve el modo de respuesta de la consulta. En modo "auto" se responde de forma extractiva
+    si el LLM aún no está cargado (y se lanza su carga en segundo plano) o si hay
+    MAX_ACTIVE_GENERATIONS generaciones en curso.
 
+    Retorna:
+    - str: "generate" o "extractive"; el motivo de la respuesta extractiva automática se guarda
+      en stats["answer_mode_reason"].
+    """
+    mode = mode or ANSWER_MODE
+    if mode not in ANSWER_MODES:
+        raise ValueError(f"Modo de respuesta desconocido: {mode} (válidos: {', '.join(ANSWER_MODES)})")
+    if mode == "auto":
+        mode = "generate"
+        if not registry.is_loaded(f"llm:{model_name}"):
+            load_in_background(registry, f"engine:{model_name}" if batching else f"llm:{model_name}")
+            mode, stats["answer_mode_reason"] = "extractive", "llm_loading"
+        elif _GENERATIONS.active >= MAX_ACTIVE_GENERATIONS:
+            mode, stats["answer_mode_reason"] = "extractive", "overloaded"
+    stats["answer_mode"] = mode
+    return mode
+
+
+# Función para construir la respuesta extractiva de la consulta
+def _answer_extractive(query, retrieved_fragments, query_embedding, registry, stats):
+    """
+    Respuesta extractiva con los fragmentos recuperados. Si la consulta pasó por la búsqueda
+    vectorial, las frases se ordenan con el modelo de embeddings, que ya está cargado.
+    """
+    embedding_model = registry.get("embedder") if query_embedding is not None and registry.is_loaded("embedder") else None
+    stats["extractive"] = {}
+    with get_telemetry().span("extractive_answer") as span:
+        response = extractive_answer(
+            query, retrieved_fragments, embedding_model=embedding_model, query_embedding=query_embedding,
+            stats=stats["extractive"],
+        )
+        span.set(sentences=stats["extractive"]["sentences"], scoring=stats["extractive"]["scoring"])
     return response
 
 
+# Función para generar la respuesta con un LLM a partir de los fragmentos recuperados
+def _generate(query, model_name, registry, retrieved_fragments, bundle, stats, prompt_lookup=False, deadline=None):
+    """Empaqueta el contexto en el presupuesto de tokens del modelo y genera la respuesta completa."""
+    # 1. Obtener el modelo, el tokenizador y la caché del prefijo del registro (prestados durante
+    # toda la generación, para que no se expulsen si otra sesión carga otro modelo)
+    with registry.use(f"llm:{model_name}") as (tokenizer, model), registry.use(f"prefix:{model_name}") as prefix_cache:
+        # 2. Empaquetamos el contexto en el presupuesto de tokens del modelo
+        assembler = _get_assembler(registry, model_name, bundle)
+        context, prompt_ids = _pack_retrieved(retrieved_fragments, tokenizer, query, model_name, stats, assembler)
+
+        # 3. Generamos la respuesta del modelo en base al prompt y el contexto
+        with _GENERATIONS:
+            return generate_answer(
+                query, context, model, tokenizer, model_name, prefix_cache=prefix_cache, prompt_ids=prompt_ids,
+                prompt_lookup=prompt_lookup, stats=stats, deadline=deadline,
+            )
+
+
+# Función para recorrer los niveles baratos de la cascada de modelos
+def _answer_cascade(query, retrieved_fragments, query_embedding, bundle, registry, stats, prompt_lookup=False, deadline=None):
+    """
+    Prueba la respuesta extractiva y, si no basta, la de GPT-2 (ver cascade.py). Si la
+    generación de GPT-2 agota el plazo de la consulta, se devuelve su respuesta parcial.
+
+    Retorna:
+    - tuple: (respuesta, o None si hay que generarla con Llama-2, y nivel); la confianza de la
+      recuperación y las comprobaciones de cada nivel se guardan en stats["cascade"].
+    """
+    router = registry.get("cascade")
+    confidence = retrieval_confidence(retrieved_fragments, stats["retrieval"])
+    stats["cascade"] = {"confidence": round(confidence, 3), "checks": {}}
+    ultimo = router.tiers[-1]
+
+    if "extractive" in router.tiers:
+        response = _answer_extractive(query, retrieved_fragments, query_embedding, registry, stats)
+        accepted, stats["cascade"]["checks"]["extractive"] = router.accept_extractive(query, response, confidence, stats["retrieval"])
+        if accepted or ultimo == "extractive":
+            return response, "extractive"
+
+    # Con una recuperación poco fiable, GPT-2 no suele bastar: se pasa directamente a Llama-2
+    if "gpt2" in router.tiers and (ultimo == "gpt2" or router.try_gpt2(confidence)):
+        response = _generate(query, "gpt2", registry, retrieved_fragments, bundle, stats, prompt_lookup, deadline)
+        accepted, stats["cascade"]["checks"]["gpt2"] = router.accept_gpt2(response, " ".join(f["texto"] for f in retrieved_fragments))
+        if accepted or ultimo == "gpt2" or "truncated" in stats:
+            return response, "gpt2"
+    return None, "llama2"
+
+
+# Función para registrar el nivel de la cascada que ha respondido a la consulta
+def _record_tier(registry, stats, tier, start):
+    elapsed = time.perf_counter() - start
+    stats["cascade"]["tier"] = tier
+    registry.get("cascade").record(tier, elapsed)
+    # Una etapa por nivel: la telemetría muestra el tráfico y la latencia de cada uno
+    get_telemetry().record(f"cascade_{tier}", elapsed)
+
+
+# Función para responder a la consulta del usuario
+def answer_query(query, model_name="llama2", registry=None, use_cache=True, stats=None, prompt_lookup=False, filters=None, k=None, mode=None, deadline_s=None, cancel_token=None):
+    """
+    Realiza una consulta y genera una respuesta utilizando el modelo.
+
+    Parámetros:
+    - query (str): La consulta del usuario
+    - model_name (str): "gpt2", "llama2" o "cascade" (el nivel más barato que pasa las
+      comprobaciones: extractivo, GPT-2 o Llama-2, ver cascade.py)
+    - registry (ModelRegistry): registro de modelos (por defecto, el global del proceso)
+    - use_cache (bool): si es True, se consulta la caché de respuestas antes de generar
+    - stats (dict): se rellena con "cache" ("exact", "semantic" o None), "retrieval" (ruta de
+      recuperación: "intent", "hybrid" o "dense", y número de fragmentos) y, con prompt_lookup,
+      con "speculative" (tasa de aceptación y aceleración) y, en la cascada, con "cascade" (nivel,
+      confianza de la recuperación y comprobaciones)
+    - prompt_lookup (bool): si es True, decodificación voraz especulativa con borradores del prompt
+    - filters (dict): filtros de metadatos de la recuperación (ej. {"medicamento": "ibuprofeno"})
+    - k (int): número máximo de fragmentos recuperados (por defecto, RETRIEVAL_K del modelo)
+    - mode (str): "generate", "extractive" (frases de los fragmentos con sus fuentes, sin LLM) o
+      "auto" (por defecto, ANSWER_MODE); el modo usado se guarda en stats["answer_mode"]
+    - deadline_s (float): plazo de la consulta en segundos desde su llegada (por defecto,
+      GENERATION_DEADLINE_S; 0 para no limitarla). Al vencer, se devuelve la respuesta parcial con
+      una marca de truncado y el motivo en stats["truncated"]; no se guarda en la caché
+    - cancel_token (CancelToken): token para cancelar la consulta desde otro hilo (opcional)
+
+    Retorna:
+    - str: Respuesta generada
+    """
+    registry = registry or get_chatbot_registry()
+    stats = {} if stats is None else stats
+    start = time.perf_counter()
+    deadline = RequestDeadline(GENERATION_DEADLINE_S if deadline_s is None else deadline_s, cancel_token)
+    # En la cascada se recupera como para Llama-2 y las respuestas se guardan en la caché como "cascade"
+    llm_name = "llama2" if model_name == CASCADE_MODEL else model_name
+
+    with get_telemetry().span("request", model=model_name, mode="answer") as span:
+        # 1. Converir la consulta a minúsculas
+        query = query.lower()
+
+        # 2. Recuperamos los fragmentos relevantes para la consulta
+        retrieved_fragments, query_embedding, bundle = _retrieve(query, llm_name, registry, filters, stats, k)
+        # Con filtros, la caché semántica no se usa: una consulta parecida sin filtros tiene otra respuesta
+        cache_embedding = None if filters else query_embedding
+
+        # 3. Si la respuesta está en caché, no se genera
+        cache = registry.get("answer_cache") if use_cache else None
+        response = _lookup_answer_cache(cache, query, model_name, retrieved_fragments, cache_embedding, stats)
+        span.set(cache=stats["cache"], retrieval=stats["retrieval"]["path"])
+        if response is not None:
+            return response
+
+        # Respuesta extractiva: no pasa por el LLM ni se guarda en la caché de respuestas generadas
+        mode = _choose_answer_mode(mode, llm_name, registry, stats)
+        span.set(answer_mode=mode)
+        if mode == "extractive":
+            return _answer_extractive(query, retrieved_fragments, query_embedding, registry, stats)
+
+        # 4. En la cascada, se prueban primero la respuesta extractiva y GPT-2
+        tier = None
+        if model_name == CASCADE_MODEL:
+            response, tier = _answer_cascade(
+                query, retrieved_fragments, query_embedding, bundle, registry, stats, prompt_lookup, deadline
+            )
+            span.set(tier=tier)
+
+        # 5. Generamos la respuesta con el modelo a partir de los fragmentos
+        if response is None:
+            response = _generate(query, llm_name, registry, retrieved_fragments, bundle, stats, prompt_lookup, deadline)
+        if tier is not None:
+            _record_tier(registry, stats, tier, start)
+        span.set(truncated=stats.get("truncated"))
+
+        # Si el paquete ha cambiado durante la generación, la respuesta no se guarda en la caché nueva;
+        # tampoco las respuestas interrumpidas
+        if cache is not None and cache.version == bundle.version and tier != "extractive" and "truncated" not in stats:
+            cache.put(query, model_name, [f["id"] for f in retrieved_fragments], cache_embedding, response)
+        return response
+
+
+# Función para responder a la consulta del usuario en streaming
+def answer_query_stream(query, model_name="llama2", registry=None, stats=None, batching=False, use_cache=True, prompt_lookup=False, filters=None, k=None, mode=None, deadline_s=None, cancel_token=None):
+    """
+    Igual que answer_query, pero devuelve la respuesta como un generador de fragmentos de
+    texto según se van generando (para mostrarla progresivamente en Streamlit).
+
+    Parámetros:
+    - query (str): La consulta del usuario
+    - model_name (str): "gpt2", "llama2" o "cascade" (ver answer_query; las respuestas de los
+      niveles extractivo y GPT-2 se devuelven enteras, en un solo fragmento)
+    - registry (ModelRegistry): registro de modelos (por defecto, el global del proceso)
+    - stats (dict): se rellena con "ttft_s" y "total_s", medidos desde la llegada de la consulta,
+      con "cache" ("exact", "semantic" o None) y con "retrieval" (ruta "intent", "hybrid" o
+      "dense", y número de fragmentos) y, en la cascada, con "cascade"
+    - batching (bool): si es True, la generación se encola en el motor de batching continuo
+      compartido por todas las sesiones en lugar de lanzar un model.generate propio
+    - use_cache (bool): si es True, se consulta la caché de respuestas antes de generar
+    - prompt_lookup (bool): decodificación voraz especulativa con borradores del prompt; tiene
+      prioridad sobre `batching` (el motor de batching no la admite)
+    - filters (dict): filtros de metadatos de la recuperación
+    - k (int): número máximo de fragmentos recuperados
+    - mode (str): "generate", "extractive" o "auto" (ver answer_query); la respuesta extractiva
+      se devuelve entera, en un solo fragmento
+    - deadline_s (float): plazo de la consulta en segundos (ver answer_query); al vencer, el
+      último fragmento es la marca de truncado
+    - cancel_token (CancelToken): token de la sesión; se cancela al enviar otra pregunta. Si se
+      deja de leer el generador, la generación también se cancela
+
+    Retorna:
+    - generator: fragmentos de texto de la respuesta
+    """
+    registry = registry or get_chatbot_registry()
+    stats = {} if stats is None else stats
+    start = time.perf_counter()
+    deadline = RequestDeadline(GENERATION_DEADLINE_S if deadline_s is None else deadline_s, cancel_token)
+    llm_name = "llama2" if model_name == CASCADE_MODEL else model_name
+
+    with get_telemetry().span("request", model=model_name, mode="stream") as span:
+        query = query.lower()
+        retrieved_fragments, query_embedding, bundle = _retrieve(query, llm_name, registry, filters, stats, k)
+        # Con filtros, la caché semántica no se usa: una consulta parecida sin filtros tiene otra respuesta
+        cache_embedding = None if filters else query_embedding
+
+        # Si la respuesta está en caché se devuelve entera, sin pasar por el LLM
+        cache = registry.get("answer_cache") if use_cache else None
+        cached = _lookup_answer_cache(cache, query, model_name, retrieved_fragments, cache_embedding, stats)
+        span.set(cache=stats["cache"], retrieval=stats["retrieval"]["path"])
+        if cached is not None:
+            stats["ttft_s"] = stats["total_s"] = time.perf_counter() - start
+            stats["num_chunks"] = 1
+            yield cached
+            return
+
+        mode = _choose_answer_mode(mode, llm_name, registry, stats, batching=batching and not prompt_lookup)
+        span.set(answer_mode=mode)
+        if mode == "extractive":
+            response = _answer_extractive(query, retrieved_fragments, query_embedding, registry, stats)
+            stats["ttft_s"] = stats["total_s"] = time.perf_counter() - start
+            stats["num_chunks"] = 1
+            yield response
+            return
+
+        # En la cascada, las respuestas extractiva y de GPT-2 se comprueban enteras antes de mostrarlas
+        tier = None
+        if model_name == CASCADE_MODEL:
+            response, tier = _answer_cascade(
+                query, retrieved_fragments, query_embedding, bundle, registry, stats, prompt_lookup, deadline
+            )
+            span.set(tier=tier)
+            if response is not None:
+                _record_tier(registry, stats, tier, start)
+                stats["ttft_s"] = stats["total_s"] = time.perf_counter() - start
+                stats["num_chunks"] = 1
+                span.set(truncated=stats.get("truncated"))
+                if cache is not None and cache.version == bundle.version and tier != "extractive" and "truncated" not in stats:
+                    cache.put(query, model_name, [f["id"] for f in retrieved_fragments], cache_embedding, response)
+                yield response
+                return
+
+        # El modelo (y el motor o la caché del prefijo) quedan prestados hasta terminar el streaming
+        with ExitStack() as leases:
+            tokenizer, model = leases.enter_context(registry.use(f"llm:{llm_name}"))
+            assembler = _get_assembler(registry, llm_name, bundle)
+            context, prompt_ids = _pack_retrieved(retrieved_fragments, tokenizer, query, llm_name, stats, assembler)
+            batching = batching and not prompt_lookup
+            engine = leases.enter_context(registry.use(f"engine:{llm_name}")) if batching else None
+            prefix_cache = None if batching else leases.enter_context(registry.use(f"prefix:{llm_name}"))
+
+            gen_stats = {}
+            chunks = []
+            stream = generate_answer_stream(
+                query, context, model, tokenizer, llm_name, stats=gen_stats, engine=engine, prefix_cache=prefix_cache,
+                prompt_ids=prompt_ids, prompt_lookup=prompt_lookup, deadline=deadline,
+            )
+            with _GENERATIONS:
+                try:
+                    for delta in stream:
+                        chunks.append(delta)
+                        yield delta
+                finally:
+                    # Si la sesión deja de leer la respuesta, se cierra el generador y se cancela la generación
+                    stream.close()
+
+        # Los tiempos incluyen la recuperación de contexto, no solo la decodificación
+        offset = gen_stats["total_s"]
+        total = time.perf_counter() - start
+        stats["ttft_s"] = None if gen_stats["ttft_s"] is None else total - offset + gen_stats["ttft_s"]
+        stats["total_s"] = total
+        stats["num_chunks"] = gen_stats["num_chunks"]
+        if "speculative" in gen_stats:
+            stats["speculative"] = gen_stats["speculative"]
+        if "truncated" in gen_stats:
+            stats["truncated"] = gen_stats["truncated"]
+        if tier is not None:
+            _record_tier(registry, stats, tier, start)
+        span.set(truncated=stats.get("truncated"))
+
+        if cache is not None and cache.version == bundle.version and "truncated" not in stats:
+            cache.put(query, model_name, [f["id"] for f in retrieved_fragments], cache_embedding, "".join(chunks).strip())